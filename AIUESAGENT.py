@@ -1,44 +1,685 @@
 # AIUESAGENT.py
 
 # 导入所需库
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
 from rich.console import Console
 from rich.markdown import Markdown
+import asyncio
+import json
 import os
+import random
+import threading
+import time
+import weakref
+import Env
+from tokens import context_window, estimate_tokens
 
-# 环境参数，下方使用的火山引擎
-key=YOUR_API_KEY
-url=YOUR_BASE_URL
-model="doubao-1-5-pro-32k-character-250715"
+# 环境参数，下方使用的火山引擎；未在此填写时读取环境变量 AIUES_API_KEY 与 AIUES_BASE_URL，
+# 两者都没有时模块仍可导入，只在创建客户端请求模型时才需要
+key=os.environ.get('AIUES_API_KEY', 'YOUR_API_KEY')
+url=os.environ.get('AIUES_BASE_URL', 'YOUR_BASE_URL')
+model=Env.DOUBAO # 默认模型，推理模型超时时也回退到该模型
+reasoning_model=Env.DOUBAO_THINK # 推理模型
+
+# 进程内共享的客户端，密钥、地址与参数相同的智能体共用同一个客户端及其连接池，
+# 多次调用、多个线程之间保持连接复用，不再重复建立连接与TLS握手
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+def get_client(api_key=key, base_url=url, **options):
+    '''
+    获取共享的同步客户端，同步客户端可以在多个线程中同时使用
+    :param api_key: 接口密钥
+    :param base_url: 接口地址
+    :param options: 其他客户端参数，如 timeout、max_retries
+    :return: OpenAI 客户端
+    '''
+    client_key = (api_key, base_url, tuple(sorted(options.items())))
+    with _clients_lock:
+        client = _clients.get(client_key)
+        if client is None:
+            client = OpenAI(api_key=api_key, base_url=base_url, **options)
+            _clients[client_key] = client
+        return client
+
+def get_async_client(api_key=key, base_url=url, **options):
+    '''
+    获取当前事件循环共享的异步客户端，异步连接池与事件循环绑定，每个事件循环各建一个
+    :param api_key: 接口密钥
+    :param base_url: 接口地址
+    :param options: 其他客户端参数，如 timeout、max_retries
+    :return: AsyncOpenAI 客户端
+    '''
+    loop = asyncio.get_running_loop()
+    client_key = (api_key, base_url, tuple(sorted(options.items())))
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(client_key)
+        if client is None:
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, **options)
+            clients[client_key] = client
+        return client
+
+def close_clients():
+    '''
+    关闭全部共享的同步客户端，释放连接
+    '''
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+async def aclose_clients():
+    '''
+    关闭当前事件循环共享的全部异步客户端，释放连接；应在事件循环结束前调用
+    '''
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = list(_async_clients.pop(loop, {}).values())
+    for client in clients:
+        await client.close()
+
+def run(coroutine):
+    '''
+    在新的事件循环中运行协程，结束后关闭该事件循环的异步客户端
+    :param coroutine: 要运行的协程
+    :return: 协程的返回值
+    '''
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await aclose_clients()
+    return asyncio.run(main())
+
+def batch_request(custom_id, model, prompt, system_prompt='', temperature=0.7, max_tokens=2048):
+    '''
+    生成一条 OpenAI 批量任务格式的请求，请求体与 get_response 发出的请求相同
+    :param custom_id: 请求的唯一标识，结果文件中以它对应回请求
+    :param model: 使用的模型
+    :param prompt: 用户输入的提示词
+    :param system_prompt: 系统提示词
+    :param temperature: 生成文本的随机性
+    :param max_tokens: 最大生成长度
+    :return: 请求字典，序列化后为 JSONL 文件的一行
+    '''
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+    }
+
+def write_batch_requests(requests, path):
+    '''
+    写出批量任务的请求文件（JSONL），每条请求占一行
+    :param requests: batch_request 生成的请求字典
+    :param path: 文件路径
+    :return: 写出的请求数
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for request in requests:
+            f.write(json.dumps(request, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+def _read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def read_batch_results(path):
+    '''
+    读取批量任务的结果文件
+    :param path: 结果文件路径
+    :return: (以 custom_id 为键的回复文本字典, 以 custom_id 为键的错误信息字典)
+    '''
+    replies = {}
+    errors = {}
+    for record in _read_jsonl(path):
+        custom_id = record['custom_id']
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code', 200) != 200:
+            errors[custom_id] = record.get('error') or response.get('body')
+            continue
+        try:
+            replies[custom_id] = response['body']['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            errors[custom_id] = response.get('body')
+    return replies, errors
+
+def fixture_batch_results(requests_path, results_path, reply=None):
+    '''
+    为请求文件生成一份本地结果文件，不请求模型，用于离线调试批量任务的导出与导入
+    :param requests_path: 请求文件路径
+    :param results_path: 结果文件路径
+    :param reply: 由请求体生成回复文本的函数，默认原样返回用户提示词
+    :return: 写出的结果数
+    '''
+    if reply is None:
+        reply = lambda body: body['messages'][-1]['content']
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    count = 0
+    with open(results_path, 'w', encoding='utf-8') as f:
+        for n, request in enumerate(_read_jsonl(requests_path)):
+            body = request['body']
+            result = {
+                "id": f"batch_req_{n}",
+                "custom_id": request['custom_id'],
+                "response": {
+                    "status_code": 200,
+                    "request_id": f"fixture_{n}",
+                    "body": {
+                        "object": "chat.completion",
+                        "model": body['model'],
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": reply(body)}}]
+                    }
+                },
+                "error": None
+            }
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+def route_model(requested=None, reasoning=False, default=model, reasoning_default=reasoning_model):
+    '''
+    选择本次调用使用的模型
+    :param requested: 本次调用指定的模型，优先使用
+    :param reasoning: 是否使用推理模型
+    :param default: 默认模型
+    :param reasoning_default: 推理模型
+    :return: 模型名称
+    '''
+    if requested:
+        return requested
+    return reasoning_default if reasoning else default
 
 # 创建智能体类，实现与OpenAI模型的交互
 class AIUESAgent:
-    def __init__(self, api_key=key, base_url=url):
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+    def __init__(self, api_key=key, base_url=url, model=model, reasoning_model=reasoning_model,
+                 fallback_model=model, timeout=None, cache=None, metrics=None):
+        '''
+        :param api_key: 接口密钥
+        :param base_url: 接口地址
+        :param model: 默认使用的模型
+        :param reasoning_model: 调用时 reasoning=True 使用的推理模型
+        :param fallback_model: 请求超时后改用的较快模型，为 None 时不回退
+        :param timeout: 单次请求的超时秒数，为 None 时使用客户端默认值
+        :param cache: 可选的 ResponseCache，参数完全相同的请求直接返回缓存的回复
+        :param metrics: 可选的 MetricsRecorder，记录每次调用的token用量与耗时
+        '''
+        # 客户端在进程内共享，创建多个智能体不会重复建立连接
+        self.client = get_client(api_key, base_url)
         self.console = Console()
         self.markdown = Markdown
         self.model = model
+        self.reasoning_model = reasoning_model
+        self.fallback_model = fallback_model
+        self.timeout = timeout
+        self.cache = cache
+        self.metrics = metrics
+
+    def _create(self, model, system_prompt, prompt, temperature, max_tokens, client=None, **options):
+        if self.timeout is not None:
+            options['timeout'] = self.timeout
+        return (client or self.client).chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **options
+        )
+
+    def _create_with_fallback(self, model, *args, **options):
+        # 由这里而不是客户端重试，以便统计重试次数：超时后立即改用较快的模型，
+        # 其他可重试的错误按客户端的重试次数退避重试；返回实际使用的模型、回复与重试次数
+        client = self.client.with_options(max_retries=0)
+        attempt = 0
+        while True:
+            try:
+                return model, self._create(model, *args, client=client, **options), attempt
+            except Exception as e:
+                if isinstance(e, APITimeoutError) and self.fallback_model and model != self.fallback_model:
+                    model = self.fallback_model
+                    attempt += 1
+                    continue
+                if attempt >= self.client.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(retry_delay(e, attempt))
+                attempt += 1
 
-    def get_response(self, prompt, system_prompt='', temperature=0.7, max_tokens=2048):
+    def get_response(self, prompt, system_prompt='', temperature=0.7, max_tokens=2048, use_cache=True,
+                     reasoning=False, model=None):
         '''
         输入提示词获取模型回复
         :param prompt: 用户输入的提示词
         :param system_prompt: 系统提示词
         :param temperature: 生成文本的随机性
         :param max_tokens: 最大生成长度
+        :param use_cache: 为 False 时跳过缓存读取，直接请求模型并用新回复刷新缓存
+        :param reasoning: 为 True 时使用推理模型
+        :param model: 本次调用指定的模型，优先于 reasoning
         :return: 模型生成的回复文本
         '''
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature,
-            max_tokens=max_tokens
+        model = route_model(model, reasoning, self.model, self.reasoning_model)
+        if self.cache is not None and use_cache:
+            cached = self.cache.get(self.cache.make_key(model=model, system_prompt=system_prompt, prompt=prompt,
+                                                        temperature=temperature, max_tokens=max_tokens))
+            if cached is not None:
+                if self.metrics is not None:
+                    self.metrics.record(model, cached=True)
+                return cached
+
+        start = time.perf_counter()
+        model, response, retries = self._create_with_fallback(model, system_prompt, prompt, temperature, max_tokens)
+        latency = time.perf_counter() - start
+
+        content = response.choices[0].message.content
+        # 非流式调用无法得知首个token的耗时，只记录总耗时
+        if self.metrics is not None:
+            usage = response.usage
+            self.metrics.record(model,
+                                prompt_tokens=usage.prompt_tokens if usage else None,
+                                completion_tokens=usage.completion_tokens if usage else None,
+                                latency=latency, retries=retries)
+        # 以实际回复的模型为键写入缓存
+        if self.cache is not None and content is not None:
+            self.cache.set(self.cache.make_key(model=model, system_prompt=system_prompt, prompt=prompt,
+                                               temperature=temperature, max_tokens=max_tokens), content)
+        return content
+
+    def batch_request(self, custom_id, prompt, system_prompt='', temperature=0.7, max_tokens=2048,
+                      reasoning=False, model=None):
+        '''
+        生成一条批量任务请求而不立即发送，模型的选择与 get_response 相同
+        :param custom_id: 请求的唯一标识
+        :param prompt: 用户输入的提示词
+        :param system_prompt: 系统提示词
+        :param temperature: 生成文本的随机性
+        :param max_tokens: 最大生成长度
+        :param reasoning: 为 True 时使用推理模型
+        :param model: 本次调用指定的模型，优先于 reasoning
+        :return: OpenAI 批量任务格式的请求字典
+        '''
+        model = route_model(model, reasoning, self.model, self.reasoning_model)
+        return batch_request(custom_id, model, prompt, system_prompt, temperature, max_tokens)
+
+    def stream_response(self, prompt, system_prompt='', temperature=0.7, max_tokens=2048, use_cache=True,
+                        reasoning=False, model=None):
+        '''
+        流式获取模型回复，生成的片段到达一段就返回一段；命中缓存时不请求模型，一次返回缓存的整段回复
+        :param prompt: 用户输入的提示词
+        :param system_prompt: 系统提示词
+        :param temperature: 生成文本的随机性
+        :param max_tokens: 最大生成长度
+        :param use_cache: 为 False 时跳过缓存读取，直接请求模型并用新回复刷新缓存
+        :param reasoning: 为 True 时使用推理模型
+        :param model: 本次调用指定的模型，优先于 reasoning
+        :return: 逐段返回回复文本的生成器
+
+        示例：
+            with open('第1章.html', 'w', encoding='utf-8') as f:
+                for delta in agent.stream_response(prompt, system_prompt):
+                    f.write(delta)
+        '''
+        model = route_model(model, reasoning, self.model, self.reasoning_model)
+        if self.cache is not None and use_cache:
+            cached = self.cache.get(self.cache.make_key(model=model, system_prompt=system_prompt, prompt=prompt,
+                                                        temperature=temperature, max_tokens=max_tokens))
+            if cached is not None:
+                if self.metrics is not None:
+                    self.metrics.record(model, cached=True, stream=True)
+                yield cached
+                return
+
+        start = time.perf_counter()
+        ttft = None
+        usage = None
+        pieces = []
+        finished = False
+        # 只有建立流式连接时超时才回退，已经开始输出后不再切换模型
+        model, stream, retries = self._create_with_fallback(model, system_prompt, prompt, temperature, max_tokens,
+                                                            stream=True, stream_options={"include_usage": True})
+        try:
+            for chunk in stream:
+                # 开启 include_usage 后，最后一个片段只携带用量，没有 choices
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    pieces.append(delta)
+                    yield delta
+            finished = True
+        finally:
+            # 调用方提前停止迭代或出错时同样记录已经生成的部分，并关闭连接；只有完整的回复写入缓存
+            if not finished and hasattr(stream, 'close'):
+                stream.close()
+            latency = time.perf_counter() - start
+            content = ''.join(pieces)
+            if self.metrics is not None:
+                self.metrics.record(model,
+                                    prompt_tokens=usage.prompt_tokens if usage else estimate_tokens(system_prompt) + estimate_tokens(prompt),
+                                    completion_tokens=usage.completion_tokens if usage else estimate_tokens(content),
+                                    ttft=ttft, latency=latency, retries=retries, stream=True)
+        if self.cache is not None and content:
+            self.cache.set(self.cache.make_key(model=model, system_prompt=system_prompt, prompt=prompt,
+                                               temperature=temperature, max_tokens=max_tokens), content)
+
+# 每分钟请求数与每分钟token数限流
+class RateLimiter:
+    def __init__(self, rpm=None, tpm=None):
+        '''
+        令牌桶限流器，桶容量为一分钟的额度，按秒匀速补充
+        :param rpm: 每分钟最多请求数，为 None 时不限制
+        :param tpm: 每分钟最多token数，为 None 时不限制
+        '''
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm or 0)
+        self._tokens = float(tpm or 0)
+        self._updated = time.monotonic()
+        # 只在计算与扣减额度时持有，等待在锁外进行，可以在多个事件循环与线程之间共用
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def reserve(self, tokens=0):
+        '''
+        立即预扣一次请求的额度，额度不足时余额记为负数，由之后的补充抵消
+        :param tokens: 本次请求预计消耗的token数
+        :return: 额度补足之前需要等待的秒数
+        '''
+        if not self.rpm and not self.tpm:
+            return 0.0
+        if self.tpm:
+            tokens = min(tokens, self.tpm)
+        with self._lock:
+            self._refill()
+            wait = 0.0
+            if self.rpm:
+                self._requests -= 1
+                if self._requests < 0:
+                    wait = -self._requests * 60 / self.rpm
+            if self.tpm:
+                self._tokens -= tokens
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens * 60 / self.tpm)
+            return wait
+
+    async def acquire(self, tokens=0):
+        '''
+        等待直到额度足够发出一次请求；先到的请求先预扣额度，按到达顺序放行，等待时不持有锁
+        :param tokens: 本次请求预计消耗的token数
+        '''
+        wait = self.reserve(tokens)
+        if wait <= 0:
+            return
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            # 请求被取消时退还预扣的额度
+            self.release(tokens, request=True)
+            raise
+
+    def release(self, tokens=0, request=False):
+        '''
+        退还 reserve 预扣的额度，用于请求未发出或失败而没有消耗token的情况
+        :param tokens: 预扣时的token数
+        :param request: 是否同时退还请求次数
+        '''
+        with self._lock:
+            self._refill()
+            if self.rpm and request:
+                self._requests = min(self.rpm, self._requests + 1)
+            if self.tpm:
+                self._tokens = min(self.tpm, self._tokens + min(tokens, self.tpm))
+
+    def refund(self, tokens):
+        '''
+        按实际用量退还多预扣的token
+        :param tokens: 退还的token数，为负数时补扣
+        '''
+        if self.tpm:
+            with self._lock:
+                self._refill()
+                self._tokens = min(self.tpm, self._tokens + tokens)
+
+def is_retryable(error):
+    '''
+    判断请求错误是否值得重试：429、5xx与连接错误
+    :param error: 请求抛出的异常
+    :return: 是否重试
+    '''
+    if isinstance(error, RateLimitError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+def retry_delay(error, attempt, backoff=1.0, max_backoff=60.0):
+    '''
+    计算第 attempt 次重试前的等待时间，优先使用服务端的 Retry-After
+    :param error: 请求抛出的异常
+    :param attempt: 已重试次数，从0开始
+    :param backoff: 首次重试的基础等待秒数
+    :param max_backoff: 最长等待秒数
+    :return: 等待秒数
+    '''
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), max_backoff)
+            except ValueError:
+                pass
+    delay = min(backoff * 2 ** attempt, max_backoff)
+    # 加入随机抖动，避免并发请求同时重试
+    return delay * random.uniform(0.5, 1.0)
+
+# 创建异步智能体类，并发地与OpenAI模型交互
+class AsyncAIUESAgent:
+    def __init__(self, api_key=key, base_url=url, concurrency=8, rpm=None, tpm=None,
+                 max_retries=5, backoff=1.0, max_backoff=60.0, cache=None, metrics=None,
+                 model=model, reasoning_model=reasoning_model, fallback_model=model, timeout=None):
+        '''
+        :param api_key: 接口密钥
+        :param base_url: 接口地址，可以指向本地兼容OpenAI接口的测试服务
+        :param concurrency: 同时进行的最大请求数
+        :param rpm: 每分钟最多请求数
+        :param tpm: 每分钟最多token数
+        :param max_retries: 遇到429/5xx/连接错误时的最大重试次数
+        :param backoff: 首次重试的基础等待秒数，之后按指数增长
+        :param max_backoff: 最长等待秒数
+        :param cache: 可选的 ResponseCache，命中缓存的请求不占用并发与限流额度
+        :param metrics: 可选的 MetricsRecorder，记录每次调用的token用量、耗时与重试次数
+        :param model: 默认使用的模型
+        :param reasoning_model: 调用时 reasoning=True 使用的推理模型
+        :param fallback_model: 请求超时后改用的较快模型，为 None 时不回退
+        :param timeout: 单次请求的超时秒数，为 None 时使用客户端默认值
+        '''
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.reasoning_model = reasoning_model
+        self.fallback_model = fallback_model
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rpm, tpm)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = cache
+        self.metrics = metrics
+        self._semaphore = None
+        self._loop = None
+
+    @property
+    def client(self):
+        # 当前事件循环共享的客户端，重试由本类负责，关闭客户端自带的重试
+        return get_async_client(self.api_key, self.base_url, max_retries=0)
+
+    async def aclose(self):
+        '''
+        关闭当前事件循环共享的异步客户端，同一事件循环中的其他智能体之后会重新创建客户端
+        '''
+        await aclose_clients()
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def get_response(self, prompt, system_prompt='', temperature=0.7, max_tokens=2048, use_cache=True,
+                           reasoning=False, model=None):
+        '''
+        输入提示词获取模型回复，受并发数与限流控制，失败时按指数退避重试，超时后改用较快的模型
+        :param prompt: 用户输入的提示词
+        :param system_prompt: 系统提示词
+        :param temperature: 生成文本的随机性
+        :param max_tokens: 最大生成长度
+        :param use_cache: 为 False 时跳过缓存读取，直接请求模型并用新回复刷新缓存
+        :param reasoning: 为 True 时使用推理模型
+        :param model: 本次调用指定的模型，优先于 reasoning
+        :return: 模型生成的回复文本
+        '''
+        model = route_model(model, reasoning, self.model, self.reasoning_model)
+        # 缓存读写涉及磁盘，放到线程中进行，不阻塞事件循环
+        if self.cache is not None and use_cache:
+            cached = await asyncio.to_thread(
+                self.cache.get, self.cache.make_key(model=model, system_prompt=system_prompt, prompt=prompt,
+                                                    temperature=temperature, max_tokens=max_tokens))
+            if cached is not None:
+                if self.metrics is not None:
+                    self.metrics.record(model, cached=True)
+                return cached
+
+        expected_tokens = estimate_tokens(system_prompt) + estimate_tokens(prompt) + max_tokens
+        options = {'timeout': self.timeout} if self.timeout is not None else {}
+        async with self._get_semaphore():
+            # 总耗时包含重试与限流等待
+            start = time.perf_counter()
+            attempt = 0
+            while True:
+                await self.limiter.acquire(expected_tokens)
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=model,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": prompt}
+                        ],
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        **options
+                    )
+                except Exception as e:
+                    # 失败的请求没有消耗token，退还本次预扣的token额度，重试时重新预扣
+                    self.limiter.release(expected_tokens)
+                    # 超时后立即改用较快的模型，不再等待退避
+                    if isinstance(e, APITimeoutError) and self.fallback_model and model != self.fallback_model:
+                        model = self.fallback_model
+                        attempt += 1
+                        continue
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        raise
+                    await asyncio.sleep(retry_delay(e, attempt, self.backoff, self.max_backoff))
+                    attempt += 1
+                    continue
+                break
+        latency = time.perf_counter() - start
+
+        if self.metrics is not None:
+            usage = response.usage
+            self.metrics.record(model,
+                                prompt_tokens=usage.prompt_tokens if usage else None,
+                                completion_tokens=usage.completion_tokens if usage else None,
+                                latency=latency, retries=attempt)
+        if response.usage is not None:
+            self.limiter.refund(expected_tokens - response.usage.total_tokens)
+        content = response.choices[0].message.content
+        # 以实际回复的模型为键写入缓存
+        if self.cache is not None and content is not None:
+            await asyncio.to_thread(
+                self.cache.set, self.cache.make_key(model=model, system_prompt=system_prompt, prompt=prompt,
+                                                    temperature=temperature, max_tokens=max_tokens), content)
+        return content
+
+    def batch_request(self, custom_id, prompt, system_prompt='', temperature=0.7, max_tokens=2048,
+                      reasoning=False, model=None):
+        '''
+        生成一条批量任务请求而不立即发送，模型的选择与 get_response 相同
+        :param custom_id: 请求的唯一标识
+        :param prompt: 用户输入的提示词
+        :param system_prompt: 系统提示词
+        :param temperature: 生成文本的随机性
+        :param max_tokens: 最大生成长度
+        :param reasoning: 为 True 时使用推理模型
+        :param model: 本次调用指定的模型，优先于 reasoning
+        :return: OpenAI 批量任务格式的请求字典
+        '''
+        model = route_model(model, reasoning, self.model, self.reasoning_model)
+        return batch_request(custom_id, model, prompt, system_prompt, temperature, max_tokens)
+
+    async def gather(self, requests, return_exceptions=False):
+        '''
+        并发执行一组请求，结果与输入顺序一致
+        :param requests: 请求列表，每个元素为 get_response 的关键字参数字典
+        :param return_exceptions: 为 True 时失败的请求返回异常对象，而不是中断整批请求
+        :return: 模型回复列表
+        '''
+        return await asyncio.gather(
+            *(self.get_response(**request) for request in requests),
+            return_exceptions=return_exceptions
         )
 
-        return response.choices[0].message.content
+    async def map(self, prompts, system_prompt='', temperature=0.7, max_tokens=2048, return_exceptions=False):
+        '''
+        用相同的系统提示词与参数并发处理一组提示词，结果与输入顺序一致
+        :param prompts: 用户提示词列表
+        :param system_prompt: 系统提示词
+        :param temperature: 生成文本的随机性
+        :param max_tokens: 最大生成长度
+        :param return_exceptions: 为 True 时失败的请求返回异常对象，而不是中断整批请求
+        :return: 模型回复列表
+
+        示例：
+            agent = AsyncAIUESAgent(concurrency=8, rpm=300)
+            replies = run(agent.map(prompts, system_prompt))
+        '''
+        return await self.gather(
+            [{"prompt": prompt, "system_prompt": system_prompt,
+              "temperature": temperature, "max_tokens": max_tokens} for prompt in prompts],
+            return_exceptions=return_exceptions
+        )
@@ -7,3 +7,5 @@ import numpy as np
 # 环境参数
 DATA_PATH=Path('./兽血沸腾.epub') # 电子书路径
 LT_VOLUME_IDX = [np.int64(0), np.int64(1), np.int64(11), np.int64(24), np.int64(35), np.int64(48), np.int64(65), np.int64(81), np.int64(91), -1] # 卷名所在序号
+DOUBAO="doubao-1-5-pro-32k-character-250715" # 默认模型
+DOUBAO_THINK="doubao-seed-1-6-thinking-250715" # 推理模型
@@ -0,0 +1,186 @@
+# batch_jobs.py
+
+# 导入所需库
+import argparse
+from collections import defaultdict
+from pathlib import Path
+
+import AIUESAGENT as AT
+from rewrite_pipeline import RewritePipeline, join_segments, merge_image_prompts
+
+# 参数设置
+BATCH_DIR = Path('./output/batch') # 批量任务文件目录
+STAGES = ('rewrite', 'image_prompts')
+
+def make_custom_id(chapter_index, stage, part, input_hash):
+    """
+    生成稳定的请求标识：章节、阶段、片段序号与阶段输入哈希，输入不变时标识不变
+
+    Args:
+        chapter_index (int): 章节序号
+        stage (str): 阶段名
+        part (int): 片段序号
+        input_hash (str): 阶段的输入哈希
+
+    Returns:
+        str: 形如 ch00012-rewrite-003-1a2b3c4d5e6f 的标识
+    """
+    return f'ch{chapter_index:05d}-{stage}-{part:03d}-{input_hash[:12]}'
+
+def parse_custom_id(custom_id):
+    """
+    解析 make_custom_id 生成的标识
+
+    Args:
+        custom_id (str): 请求标识
+
+    Returns:
+        tuple: (章节序号, 阶段名, 片段序号, 哈希前缀)
+    """
+    chapter, stage, part, digest = custom_id.split('-')
+    return int(chapter[2:]), stage, int(part), digest
+
+# 整书的批量任务
+class RewriteBatch:
+    """
+    将重构流水线的模型请求导出为批量任务，并把结果导入流水线的任务日志
+
+    润色与插图信息提取依次为两个批量任务：导出润色请求 → 提交并取回结果 → 导入；
+    再导出插图信息提取请求 → 提交并取回结果 → 导入。导入的结果与流水线按输入哈希记录的一致，
+    之后运行流水线或写回电子书时这些章节都直接读取日志
+
+    Args:
+        pipeline (RewritePipeline): 重构流水线，提供电子书、任务日志、提示词与模型
+    """
+    def __init__(self, pipeline=None):
+        self.pipeline = pipeline if pipeline is not None else RewritePipeline()
+
+    def _rewrite_input(self, chapter_index):
+        pipeline = self.pipeline
+        title, split_hash, segments = pipeline.split_chapter(chapter_index)
+        return title, pipeline.rewrite_hash(split_hash), segments
+
+    def _image_input(self, chapter_index):
+        pipeline = self.pipeline
+        title, rewrite_hash, _ = self._rewrite_input(chapter_index)
+        rewritten = pipeline.journal.get(chapter_index, 'rewrite', rewrite_hash)
+        if rewritten is None:
+            return title, None, None
+        return title, pipeline.image_hash(rewrite_hash, rewritten), rewritten
+
+    def requests(self, stage='rewrite', start=0, stop=None, volume=None):
+        """
+        生成尚未完成的请求，日志中已有有效结果的章节不再导出
+
+        Args:
+            stage (str): 'rewrite' 或 'image_prompts'
+            start (int): 起始章节序号
+            stop (int): 结束章节序号（不包含）
+            volume (int): 卷序号，给出时忽略 start 与 stop
+
+        Returns:
+            generator: 逐条返回批量任务格式的请求字典
+        """
+        if stage not in STAGES:
+            raise ValueError(f'未知的阶段: {stage}')
+        pipeline = self.pipeline
+        agent = pipeline.agent
+        for chapter_index in pipeline.chapter_indices(start, stop, volume):
+            if stage == 'rewrite':
+                _, input_hash, segments = self._rewrite_input(chapter_index)
+                if pipeline.journal.get(chapter_index, stage, input_hash) is not None:
+                    continue
+                for part, segment in enumerate(segments):
+                    yield agent.batch_request(make_custom_id(chapter_index, stage, part, input_hash),
+                                              segment['text'], pipeline.rewrite_prompt, max_tokens=pipeline.max_tokens)
+            else:
+                _, input_hash, rewritten = self._image_input(chapter_index)
+                if input_hash is None or pipeline.journal.get(chapter_index, stage, input_hash) is not None:
+                    continue
+                for part, text in enumerate(pipeline.image_segments(rewritten)):
+                    yield agent.batch_request(make_custom_id(chapter_index, stage, part, input_hash),
+                                              text, pipeline.image_prompt, max_tokens=pipeline.max_tokens)
+
+    def export(self, path=None, stage='rewrite', start=0, stop=None, volume=None):
+        """
+        导出批量任务的请求文件
+
+        Args:
+            path (Path): 请求文件路径，默认为 BATCH_DIR 下以阶段命名的文件
+            stage (str): 'rewrite' 或 'image_prompts'
+            start (int): 起始章节序号
+            stop (int): 结束章节序号（不包含）
+            volume (int): 卷序号，给出时忽略 start 与 stop
+
+        Returns:
+            tuple: (请求文件路径, 请求数)
+        """
+        path = Path(path) if path is not None else BATCH_DIR / f'{stage}_requests.jsonl'
+        return path, AT.write_batch_requests(self.requests(stage, start, stop, volume), path)
+
+    def ingest(self, path):
+        """
+        导入批量任务的结果文件，按请求标识对应回章节并写入任务日志
+
+        章节的全部片段都成功返回、且阶段输入与导出时一致才会写入；源文本、提示词或模型已变化的结果被忽略
+
+        Args:
+            path (Path): 结果文件路径
+
+        Returns:
+            dict: 'done' 为写入日志的章节序号列表，'incomplete' 为缺少片段的章节，
+                  'stale' 为输入已变化的章节，'errors' 为失败的请求
+        """
+        pipeline = self.pipeline
+        replies, errors = AT.read_batch_results(path)
+        grouped = defaultdict(dict)
+        for custom_id, reply in replies.items():
+            chapter_index, stage, part, digest = parse_custom_id(custom_id)
+            grouped[(chapter_index, stage, digest)][part] = reply
+
+        summary = {'done': [], 'incomplete': [], 'stale': [], 'errors': errors}
+        # 润色结果先于插图信息提取导入，后者的输入校验依赖前者
+        for (chapter_index, stage, digest), parts in sorted(grouped.items(), key=lambda item: STAGES.index(item[0][1])):
+            if stage == 'rewrite':
+                _, input_hash, segments = self._rewrite_input(chapter_index)
+            else:
+                _, input_hash, rewritten = self._image_input(chapter_index)
+                segments = pipeline.image_segments(rewritten) if input_hash is not None else []
+            if input_hash is None or input_hash[:12] != digest:
+                summary['stale'].append(chapter_index)
+                continue
+            if len(parts) != len(segments):
+                summary['incomplete'].append(chapter_index)
+                continue
+            ordered = [parts[part] for part in range(len(segments))]
+            output = join_segments(ordered) if stage == 'rewrite' else merge_image_prompts(ordered)
+            pipeline.journal.put(chapter_index, stage, input_hash, output)
+            summary['done'].append(chapter_index)
+        return summary
+
+# 示例使用
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='整书的批量任务：导出请求、导入结果')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='导出请求文件')
+    export_parser.add_argument('--stage', choices=STAGES, default='rewrite')
+    export_parser.add_argument('--volume', type=int, help='只导出一卷')
+    export_parser.add_argument('--output', help='请求文件路径')
+    ingest_parser = subparsers.add_parser('ingest', help='导入结果文件')
+    ingest_parser.add_argument('results', help='结果文件路径')
+    fixture_parser = subparsers.add_parser('fixture', help='为请求文件生成本地结果文件，离线调试用')
+    fixture_parser.add_argument('requests', help='请求文件路径')
+    fixture_parser.add_argument('results', help='结果文件路径')
+    args = parser.parse_args()
+
+    if args.command == 'fixture':
+        print(f'已生成 {AT.fixture_batch_results(args.requests, args.results)} 条结果')
+    else:
+        batch = RewriteBatch(RewritePipeline(agent=AT.AsyncAIUESAgent()))
+        if args.command == 'export':
+            path, count = batch.export(args.output, args.stage, volume=args.volume)
+            print(f'已导出 {count} 条请求: {path}')
+        else:
+            summary = batch.ingest(args.results)
+            print(f"已导入 {len(summary['done'])} 章，缺少片段 {len(summary['incomplete'])} 章，"
+                  f"输入已变化 {len(summary['stale'])} 章，失败请求 {len(summary['errors'])} 条")
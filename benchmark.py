@@ -0,0 +1,733 @@
+# benchmark.py
+
+# 导入所需库
+import argparse
+import importlib.metadata
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pandas as pd
+
+import cost_report as CR
+import ledger_store as LS
+import operating_ebook as OE
+from epub_writer import StreamingEpubWriter
+
+# 参数设置
+BENCH_DIR = Path('./output/benchmark') # 合成数据与结果的保存目录
+ROOT = Path(__file__).resolve().parent
+SECTIONS = ('import', 'epub', 'ledger', 'report', 'llm')
+IMPORT_MODULES = ('operating_ebook', 'cost_report', 'AIUESAGENT')
+PACKAGES = ('ebooklib', 'lxml', 'pandas', 'numpy', 'openpyxl', 'pyecharts', 'openai')
+# 合成数据使用的常用字与标点，按固定种子抽取，相同参数生成相同的内容
+_HANZI = ('的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多然于心学么之都好看起发当没成只如事把还用第样道想作种开美总从无情己面最女但现前些所同日手又行意动方期它头经长儿回位分爱老因很给名法间斯知世什两次使身者被高已亲其进此话常与活正感'
+          '剑气山门宗师兄弟妖兽血魔灵丹阵法')
+_PUNCTUATION = '，，，，。。！？；'
+LEDGER_CATEGORIES = ('餐饮', '餐饮', '交通', '购物', '娱乐', '居住', '医疗')
+LEDGER_SUBCATEGORIES = ('早餐', '午晚餐', None, None, None, None, None)
+LEDGER_INCOMES = ('工资', '兼职', '理财', '其他收入')
+REPORT_REPLY = '<p>本月支出平稳，建议减少外卖与冲动消费。</p>'
+
+# 合成数据
+def _sentence(rng):
+    length = rng.randint(6, 24)
+    return ''.join(rng.choices(_HANZI, k=length)) + rng.choice(_PUNCTUATION[-4:])
+
+def _paragraph(rng, chars):
+    # 约三成的段落为对话，用中文引号包围
+    sentences = []
+    while sum(map(len, sentences)) < chars:
+        sentences.append(_sentence(rng))
+    text = ''.join(sentences)
+    if rng.random() < 0.3:
+        text = f'“{text}”'
+    return text
+
+def chapter_html(rng, chapter_number, chars, paragraph_chars=120):
+    """
+    生成一章合成正文：章节标题与若干段落
+
+    Args:
+        rng (Random): 随机数生成器
+        chapter_number (int): 章节编号，用于标题
+        chars (int): 正文的大致字数
+        paragraph_chars (int): 每段的大致字数
+
+    Returns:
+        tuple: (标题, 正文的HTML片段)
+    """
+    title = f'第{chapter_number}章 {"".join(rng.choices(_HANZI, k=4))}'
+    paragraphs = []
+    written = 0
+    while written < chars:
+        paragraph = _paragraph(rng, rng.randint(paragraph_chars // 2, paragraph_chars * 3 // 2))
+        paragraphs.append(f'<p>{paragraph}</p>')
+        written += len(paragraph)
+    return title, f'<h2>{title}</h2>\n' + '\n'.join(paragraphs)
+
+def make_epub(path, chapters=500, chapter_chars=3000, volume_chapters=50, seed=0):
+    """
+    生成合成电子书：每卷先是一页卷名，之后是若干章节；相同参数与种子生成相同的内容
+
+    Args:
+        path (Path): 电子书的保存路径
+        chapters (int): 章节数（不含卷名页）
+        chapter_chars (int): 每章的大致字数
+        volume_chapters (int): 每卷的章节数，为 0 时不分卷
+        seed (int): 随机种子
+
+    Returns:
+        list: 各卷卷名页的章节序号，可直接作为 Env.LT_VOLUME_IDX（末尾补 -1）
+    """
+    rng = random.Random(seed)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    volume_indices = []
+    position = 0
+    with StreamingEpubWriter(path, f'合成小说（{chapters}章）', identifier=f'benchmark-{chapters}-{chapter_chars}-{seed}') as writer:
+        for chapter_number in range(1, chapters + 1):
+            if volume_chapters and (chapter_number - 1) % volume_chapters == 0:
+                volume_number = (chapter_number - 1) // volume_chapters + 1
+                volume_title = f'第{volume_number}卷'
+                writer.add_chapter(f'text/volume_{volume_number:03d}.xhtml', f'<h1>{volume_title}</h1>',
+                                   title=volume_title, level=0)
+                volume_indices.append(position)
+                position += 1
+            title, body = chapter_html(rng, chapter_number, chapter_chars)
+            writer.add_chapter(f'text/chapter_{chapter_number:05d}.xhtml', body, title=title,
+                               level=1 if volume_chapters else 0)
+            position += 1
+    return volume_indices
+
+def make_ledger(path, years=3, start=date(2022, 1, 1), records_per_day=1, seed=0):
+    """
+    生成合成账本，表头与 cost_data.xlsx 相同：两行表头，前六列为日期、星期、每日合计、结余与备注，
+    其后为消费分类（第二行表头为子分类），最后四列为收入
+
+    Args:
+        path (Path): Excel 文件的保存路径
+        years (int): 覆盖的年数
+        start (date): 起始日期
+        records_per_day (int): 每天的记录行数
+        seed (int): 随机种子
+
+    Returns:
+        int: 数据行数
+    """
+    rng = random.Random(seed)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    header = ['日期', '星期', '总支出/天', '总收入/天', '结余', '备注'] + list(LEDGER_CATEGORIES) + list(LEDGER_INCOMES)
+    rows = [[None] * 6 + list(LEDGER_SUBCATEGORIES) + [None] * len(LEDGER_INCOMES)]
+    days = (date(start.year + years, start.month, start.day) - start).days
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        for _ in range(records_per_day):
+            # 约两成的分类当天没有支出，保留为空单元格
+            expenses = [round(rng.uniform(1, 120), 2) if rng.random() > 0.2 else None for _ in LEDGER_CATEGORIES]
+            incomes = [8000.0 if day.day == 10 else None, round(rng.uniform(0, 50), 2) if rng.random() < 0.3 else None,
+                       round(rng.uniform(-20, 30), 2), None]
+            expense = round(sum(value for value in expenses if value is not None), 2)
+            income = round(sum(value for value in incomes if value is not None), 2)
+            rows.append([int(day.strftime('%Y%m%d')), day.isoweekday(), expense, income, round(income - expense, 2), '']
+                        + expenses + incomes)
+    pd.DataFrame(rows, columns=header).to_excel(path, index=False)
+    return len(rows) - 1
+
+# 本地的模型服务
+class _FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 表头与正文分两次写出，关闭 Nagle 算法以免与延迟确认叠加出额外的等待
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'fake', 'object': 'model', 'owned_by': 'benchmark'}]})
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+        self.server.fake.handle(self, body)
+
+class FakeLLMServer:
+    """
+    兼容 OpenAI 接口的本地模型服务，用于在没有远程接口时测量请求开销与并发吞吐
+
+    每个请求等待固定延迟（可加随机抖动）后返回固定长度的回复；流式请求按块返回，块之间另有间隔。
+    fail_every 大于 0 时每隔若干个请求返回一次 503，用于检验重试
+
+    Args:
+        host (str): 监听地址
+        port (int): 监听端口，为 0 时自动选择空闲端口
+        latency (float): 每个请求的延迟秒数
+        jitter (float): 延迟的随机抖动比例，如 0.1 表示 ±10%
+        reply_chars (int): 回复的字数
+        chunk_chars (int): 流式回复每块的字数
+        chunk_interval (float): 流式回复块之间的间隔秒数
+        fail_every (int): 每隔多少个请求失败一次，为 0 时不失败
+        seed (int): 抖动的随机种子
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, jitter=0.0, reply_chars=200,
+                 chunk_chars=20, chunk_interval=0.0, fail_every=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.reply_chars = reply_chars
+        self.chunk_chars = chunk_chars
+        self.chunk_interval = chunk_interval
+        self.fail_every = fail_every
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.stats = {'requests': 0, 'failed': 0, 'max_in_flight': 0}
+        self._server = ThreadingHTTPServer((host, port), _FakeLLMHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """OpenAI 客户端使用的 base_url"""
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        """
+        在后台线程中启动服务
+
+        Returns:
+            FakeLLMServer: 服务本身
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        停止服务
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def reset(self):
+        """
+        清零请求统计
+        """
+        with self._lock:
+            self.stats = {'requests': 0, 'failed': 0, 'max_in_flight': 0}
+
+    def _reply(self, prompt):
+        # 回复由提示词决定，相同提示词得到相同回复
+        seed = sum(map(ord, prompt[:64])) % len(_HANZI)
+        text = (_HANZI[seed:] + _HANZI[:seed]) * (self.reply_chars // len(_HANZI) + 1)
+        return text[:self.reply_chars]
+
+    def handle(self, handler, body):
+        """
+        处理一个 /chat/completions 请求
+
+        Args:
+            handler (BaseHTTPRequestHandler): 当前请求的处理器
+            body (dict): 请求体
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            number = self.stats['requests']
+            self._in_flight += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self._in_flight)
+            delay = self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)) if self.jitter else self.latency
+        try:
+            if self.fail_every and number % self.fail_every == 0:
+                with self._lock:
+                    self.stats['failed'] += 1
+                handler._send_json(503, {'error': {'message': 'service unavailable', 'type': 'overloaded'}})
+                return
+            time.sleep(delay)
+            messages = body.get('messages') or [{}]
+            prompt = messages[-1].get('content') or ''
+            reply = self._reply(prompt)
+            usage = {'prompt_tokens': sum(len(message.get('content') or '') for message in messages),
+                     'completion_tokens': len(reply)}
+            usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+            base = {'id': f'fake-{number}', 'created': int(time.time()), 'model': body.get('model', 'fake')}
+            if body.get('stream'):
+                self._stream(handler, base, reply, usage)
+            else:
+                handler._send_json(200, {**base, 'object': 'chat.completion', 'usage': usage, 'choices': [
+                    {'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': reply}}]})
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _stream(self, handler, base, reply, usage):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        handler.close_connection = True
+
+        def send(payload):
+            handler.wfile.write(f'data: {payload}\n\n'.encode('utf-8'))
+            handler.wfile.flush()
+
+        for start in range(0, len(reply), self.chunk_chars):
+            if start and self.chunk_interval:
+                time.sleep(self.chunk_interval)
+            send(json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [
+                {'index': 0, 'delta': {'content': reply[start:start + self.chunk_chars]}, 'finish_reason': None}]},
+                ensure_ascii=False))
+        send(json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage}))
+        send('[DONE]')
+
+# 计时
+def measure(fn, repeat=3, setup=None, count=None):
+    """
+    重复运行并计时，取中位数作为结果
+
+    Args:
+        fn (callable): 被计时的函数，接收 setup 的返回值（没有 setup 时不接收参数）
+        repeat (int): 重复次数
+        setup (callable): 每次运行前调用、不计入耗时的准备函数
+        count (int): 每次运行处理的条目数，给出时另记录单条耗时与吞吐量
+
+    Returns:
+        dict: 'median'、'min'、'max' 与每次的耗时 'runs'（秒）
+    """
+    runs = []
+    for _ in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = time.perf_counter()
+        fn(*args)
+        runs.append(time.perf_counter() - start)
+    result = {'median': statistics.median(runs), 'min': min(runs), 'max': max(runs), 'runs': runs}
+    if count:
+        result['count'] = count
+        result['per_item'] = result['median'] / count
+        result['per_second'] = count / result['median'] if result['median'] else None
+    return result
+
+def bench_import(config):
+    """
+    在新的解释器中测量各模块的导入耗时（不含解释器启动）
+
+    Args:
+        config (dict): 基准参数
+
+    Returns:
+        dict: 以 'import.<模块名>' 为键的结果
+    """
+    results = {}
+    for module in IMPORT_MODULES:
+        code = f'import time\nstart = time.perf_counter()\nimport {module}\nprint(time.perf_counter() - start)'
+        runs = []
+        for _ in range(config['repeat']):
+            process = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+            if process.returncode:
+                error = (process.stderr.strip().splitlines() or ['导入失败'])[-1]
+                results[f'import.{module}'] = {'error': error}
+                break
+            runs.append(float(process.stdout.strip().splitlines()[-1]))
+        else:
+            results[f'import.{module}'] = {'median': statistics.median(runs), 'min': min(runs),
+                                           'max': max(runs), 'runs': runs}
+    return results
+
+def bench_epub(config, path):
+    """
+    测量电子书的打开、随机读取章节与逐章遍历
+
+    Args:
+        config (dict): 基准参数
+        path (Path): 合成电子书路径
+
+    Returns:
+        dict: 以 'epub.' 开头的结果
+    """
+    repeat = config['repeat']
+    results = {'epub.open': measure(lambda: len(OE.ChapterStore(path)), repeat)}
+
+    store = OE.ChapterStore(path)
+    total = len(store)
+    sample = random.Random(config['seed']).sample(range(total), min(config['sample'], total))
+
+    def access():
+        store.invalidate()
+        for chapter_index in sample:
+            OE.get_chapter_data(chapter_index, ebook=store)
+
+    results['epub.chapter_access'] = measure(access, repeat, count=len(sample))
+
+    def iterate():
+        return sum(len(chapter['content']) for chapter in OE.iter_chapters(as_text=True, ebook=store))
+
+    results['epub.iterate'] = measure(iterate, repeat, count=total)
+    return results
+
+def bench_ledger(config, path, workdir):
+    """
+    测量账本的清洗、带缓存的读取、导入只追加账本与按月查询
+
+    Args:
+        config (dict): 基准参数
+        path (Path): 合成 Excel 路径
+        workdir (Path): 临时文件目录
+
+    Returns:
+        dict: 以 'ledger.' 开头的结果
+    """
+    repeat = config['repeat']
+    rows = len(CR.proc_washing_data(path))
+    results = {'ledger.clean': measure(lambda: CR.proc_washing_data(path), repeat, count=rows)}
+
+    cache_dir = workdir / 'ledger_cache'
+    CR.load_cost_data(path, cache_dir)
+    results['ledger.load_cached'] = measure(lambda: CR.load_cost_data(path, cache_dir), repeat, count=rows)
+
+    databases = iter(range(repeat))
+
+    def new_ledger():
+        return LS.LedgerStore(workdir / f'ledger_{next(databases)}.sqlite')
+
+    def import_excel(ledger):
+        ledger.import_excel(path)
+        ledger.close()
+
+    results['ledger.import'] = measure(import_excel, repeat, setup=new_ledger, count=rows)
+
+    ledger = LS.LedgerStore(workdir / 'ledger_0.sqlite')
+    months = ledger.months()
+    results['ledger.query_months'] = measure(lambda: [ledger.month(year, month) for year, month in months],
+                                             repeat, count=len(months))
+    ledger.close()
+    return results
+
+def bench_report(config, path, workdir):
+    """
+    测量逐月生成报告（统计、渲染图表与拼接页面，模型回复为固定文本）
+
+    Args:
+        config (dict): 基准参数
+        path (Path): 合成 Excel 路径
+        workdir (Path): 临时文件目录
+
+    Returns:
+        dict: 以 'report.' 开头的结果
+    """
+    df = CR.load_cost_data(path, workdir / 'ledger_cache')
+    first, last = df[LS.DATE_COLUMN].min(), df[LS.DATE_COLUMN].max()
+    periods = CR.month_range((first.year, first.month), (last.year, last.month))
+
+    def prepare():
+        # 每次运行都使用新的 DataFrame，按月索引与汇总的构建计入耗时
+        return df.copy()
+
+    def prepare_all(data):
+        return [CR.prepare_report(data, year, month) for year, month in periods]
+
+    def generate_all(data):
+        for year, month in periods:
+            prepared = CR.prepare_report(data, year, month)
+            images = CR.render_report_charts(prepared['chart_data'])
+            CR.finish_report(prepared, REPORT_REPLY, f'{year}年{month}月消费报告', images, save=False)
+
+    return {
+        'report.prepare': measure(prepare_all, config['repeat'], setup=prepare, count=len(periods)),
+        'report.generate': measure(generate_all, config['repeat'], setup=prepare, count=len(periods))
+    }
+
+def bench_llm(config):
+    """
+    启动本地模型服务，测量同步智能体逐个请求的开销与异步智能体并发请求的吞吐
+
+    Args:
+        config (dict): 基准参数
+
+    Returns:
+        dict: 以 'llm.' 开头的结果，附带服务端观察到的最大并发数
+    """
+    # 只有这一部分需要模型客户端，其余部分不依赖接口配置与 openai
+    import AIUESAGENT as AT
+
+    repeat = config['repeat']
+    rng = random.Random(config['seed'])
+    prompts = [''.join(rng.choices(_HANZI, k=config['llm_prompt_chars'])) for _ in range(config['llm_requests'])]
+    sequential = prompts[:config['llm_sequential']]
+    results = {}
+    with FakeLLMServer(latency=config['llm_latency'], reply_chars=config['llm_reply_chars'], seed=config['seed']) as server:
+        agent = AT.AIUESAgent(api_key='benchmark', base_url=server.url, fallback_model=None)
+        agent.get_response(prompts[0])
+
+        def run_sequential():
+            for prompt in sequential:
+                agent.get_response(prompt)
+
+        result = measure(run_sequential, repeat, count=len(sequential))
+        # 扣除服务端延迟后即为客户端每个请求的开销
+        result['overhead'] = result['per_item'] - config['llm_latency']
+        results['llm.sequential'] = result
+
+        def run_async():
+            async_agent = AT.AsyncAIUESAgent(api_key='benchmark', base_url=server.url,
+                                             concurrency=config['llm_concurrency'], fallback_model=None)
+            AT.run(async_agent.map(prompts))
+
+        run_async()
+        server.reset()
+        result = measure(run_async, repeat, count=len(prompts))
+        # 并发数为上限时的理想耗时，efficiency 越接近 1 客户端开销越小
+        ideal = -(-len(prompts) // config['llm_concurrency']) * config['llm_latency']
+        result['efficiency'] = ideal / result['median'] if result['median'] else None
+        result['max_in_flight'] = server.stats['max_in_flight']
+        results['llm.async_map'] = result
+    return results
+
+# 运行与比较
+def environment():
+    """
+    记录运行环境：Python 与主要依赖的版本、平台与当前提交
+
+    Returns:
+        dict: 环境信息
+    """
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'packages': versions,
+        'commit': commit,
+        'dirty': dirty
+    }
+
+def prepare_data(config, workdir):
+    """
+    生成（或复用已生成的）合成电子书与账本，文件名包含生成参数
+
+    Args:
+        config (dict): 基准参数
+        workdir (Path): 保存目录
+
+    Returns:
+        tuple: (电子书路径, Excel 路径)
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    epub_path = workdir / f"book_{config['chapters']}x{config['chapter_chars']}_s{config['seed']}.epub"
+    if not epub_path.exists():
+        make_epub(epub_path, config['chapters'], config['chapter_chars'], config['volume_chapters'], config['seed'])
+    ledger_path = workdir / f"cost_data_{config['years']}y{config['records_per_day']}r_s{config['seed']}.xlsx"
+    if not ledger_path.exists():
+        make_ledger(ledger_path, config['years'], records_per_day=config['records_per_day'], seed=config['seed'])
+    return epub_path, ledger_path
+
+def run(config, sections=SECTIONS, workdir=BENCH_DIR):
+    """
+    运行基准测试
+
+    Args:
+        config (dict): 基准参数，见命令行参数
+        sections (tuple): 运行的部分，取自 SECTIONS
+        workdir (Path): 合成数据的保存目录
+
+    Returns:
+        dict: 'meta' 为运行环境与参数，'results' 为以基准名为键的结果
+    """
+    workdir = Path(workdir)
+    epub_path, ledger_path = prepare_data(config, workdir)
+    results = {}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        tmp = Path(tmp)
+        for section in sections:
+            print(f'运行 {section} ...', flush=True)
+            if section == 'import':
+                results.update(bench_import(config))
+            elif section == 'epub':
+                results.update(bench_epub(config, epub_path))
+            elif section == 'ledger':
+                results.update(bench_ledger(config, ledger_path, tmp))
+            elif section == 'report':
+                results.update(bench_report(config, ledger_path, tmp))
+            elif section == 'llm':
+                results.update(bench_llm(config))
+    meta = {'time': datetime.now().isoformat(timespec='seconds'), 'config': config, 'sections': list(sections),
+            'environment': environment()}
+    return {'meta': meta, 'results': results}
+
+def compare(baseline, current, threshold=0.2, min_delta=0.005):
+    """
+    比较两次运行的结果，中位耗时变慢超过阈值的基准视为退化
+
+    Args:
+        baseline (dict): 基线结果（run 的返回值或读取的 JSON）
+        current (dict): 本次结果
+        threshold (float): 相对变慢的阈值，如 0.2 表示慢 20%
+        min_delta (float): 绝对差值低于该秒数时忽略，避免极短的基准因噪声误报
+
+    Returns:
+        list: 每个共同基准一个字典，包含 'name'、'baseline'、'current'、'ratio' 与 'status'
+              （'regression'、'improvement' 或 'ok'）
+    """
+    rows = []
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None or 'median' not in old or 'median' not in result:
+            continue
+        ratio = result['median'] / old['median'] if old['median'] else float('inf')
+        delta = result['median'] - old['median']
+        status = 'ok'
+        if abs(delta) >= min_delta:
+            if ratio > 1 + threshold:
+                status = 'regression'
+            elif ratio < 1 / (1 + threshold):
+                status = 'improvement'
+        rows.append({'name': name, 'baseline': old['median'], 'current': result['median'],
+                     'ratio': ratio, 'status': status})
+    return rows
+
+def print_results(results):
+    """
+    打印结果表
+
+    Args:
+        results (dict): run 的返回值
+    """
+    for name, result in results['results'].items():
+        if 'error' in result:
+            print(f'{name:<24} 失败: {result["error"]}')
+            continue
+        line = f'{name:<24} {result["median"] * 1000:>10.2f} ms'
+        if 'per_item' in result:
+            line += f'  {result["per_item"] * 1000:>8.3f} ms/条  {result["per_second"]:>10.1f} 条/秒'
+        print(line)
+
+def print_comparison(rows, baseline, current):
+    """
+    打印比较结果；两次运行的参数不同时给出提示
+
+    Args:
+        rows (list): compare 的返回值
+        baseline (dict): 基线结果
+        current (dict): 本次结果
+    """
+    if baseline['meta'].get('config') != current['meta'].get('config'):
+        print('注意：两次运行的基准参数不同，结果不能直接比较')
+    for row in rows:
+        mark = {'regression': '退化', 'improvement': '提升', 'ok': ''}[row['status']]
+        print(f"{row['name']:<24} {row['baseline'] * 1000:>10.2f} → {row['current'] * 1000:>10.2f} ms"
+              f"  {row['ratio']:>6.2f}x  {mark}")
+
+def _load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# 示例使用
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='可复现的性能基准：合成电子书与账本、本地模型服务')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='运行基准测试并写出 JSON 结果')
+    run_parser.add_argument('--only', nargs='+', choices=SECTIONS, default=list(SECTIONS), help='只运行部分基准')
+    run_parser.add_argument('--output', help='结果文件路径，默认按时间命名')
+    run_parser.add_argument('--compare', metavar='BASELINE', help='与基线结果比较，有退化时以非零状态退出')
+    run_parser.add_argument('--threshold', type=float, default=0.2, help='视为退化的相对变慢比例')
+    run_parser.add_argument('--workdir', default=str(BENCH_DIR), help='合成数据的保存目录')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--chapters', type=int, default=500)
+    run_parser.add_argument('--chapter-chars', type=int, default=3000)
+    run_parser.add_argument('--volume-chapters', type=int, default=50)
+    run_parser.add_argument('--sample', type=int, default=200, help='随机读取的章节数')
+    run_parser.add_argument('--years', type=int, default=3)
+    run_parser.add_argument('--records-per-day', type=int, default=1)
+    run_parser.add_argument('--llm-requests', type=int, default=200)
+    run_parser.add_argument('--llm-sequential', type=int, default=20)
+    run_parser.add_argument('--llm-concurrency', type=int, default=16)
+    run_parser.add_argument('--llm-latency', type=float, default=0.05)
+    run_parser.add_argument('--llm-prompt-chars', type=int, default=1000)
+    run_parser.add_argument('--llm-reply-chars', type=int, default=200)
+    compare_parser = subparsers.add_parser('compare', help='比较两个结果文件')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2)
+    serve_parser = subparsers.add_parser('serve', help='单独运行本地模型服务，供手动调试')
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--latency', type=float, default=0.05)
+    serve_parser.add_argument('--jitter', type=float, default=0.0)
+    serve_parser.add_argument('--reply-chars', type=int, default=200)
+    serve_parser.add_argument('--chunk-interval', type=float, default=0.0)
+    serve_parser.add_argument('--fail-every', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = FakeLLMServer(port=args.port, latency=args.latency, jitter=args.jitter, reply_chars=args.reply_chars,
+                               chunk_interval=args.chunk_interval, fail_every=args.fail_every)
+        server.start()
+        print(f'本地模型服务: {server.url}')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
+    elif args.command == 'compare':
+        baseline, current = _load(args.baseline), _load(args.current)
+        rows = compare(baseline, current, args.threshold)
+        print_comparison(rows, baseline, current)
+        sys.exit(1 if any(row['status'] == 'regression' for row in rows) else 0)
+    else:
+        config = {key: value for key, value in vars(args).items()
+                  if key not in ('command', 'only', 'output', 'compare', 'threshold', 'workdir')}
+        results = run(config, tuple(args.only), args.workdir)
+        print_results(results)
+        output = Path(args.output or Path(args.workdir) / f"results_{datetime.now():%Y%m%d_%H%M%S}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f'结果已写入 {output}')
+        if args.compare:
+            baseline = _load(args.compare)
+            rows = compare(baseline, results, args.threshold)
+            print_comparison(rows, baseline, results)
+            sys.exit(1 if any(row['status'] == 'regression' for row in rows) else 0)
@@ -0,0 +1,318 @@
+# chapter_stats.py
+
+# 导入所需库
+import hashlib
+import heapq
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from pyecharts import options as opts
+from pyecharts.charts import Bar
+
+import operating_ebook as OE
+import tokens as TK
+
+# 参数设置
+STATS_PATH = Path('./cache/chapter_stats.sqlite') # 统计索引的保存路径
+STAT_FIELDS = ('chars', 'paragraphs', 'tokens', 'dialogue_ratio', 'content_hash')
+# 引号内的文字视为对话
+_DIALOGUE = re.compile(r'“[^”]*”|「[^」]*」|『[^』]*』|"[^"\n]*"')
+_SPACE = re.compile(r'\s+')
+
+def text_stats(text):
+    """
+    计算一段纯文本的统计量
+
+    Args:
+        text (str): 纯文本，每个段落占一行
+
+    Returns:
+        dict: 'chars' 为去掉空白后的字数，'paragraphs' 为段落数，'tokens' 为估算的token数，
+              'dialogue_ratio' 为引号内文字占字数的比例
+    """
+    chars = len(_SPACE.sub('', text))
+    dialogue = sum(len(_SPACE.sub('', match)) for match in _DIALOGUE.findall(text))
+    return {
+        'chars': chars,
+        'paragraphs': sum(1 for line in text.splitlines() if line.strip()),
+        'tokens': TK.estimate_tokens(text),
+        'dialogue_ratio': round(dialogue / chars, 4) if chars else 0.0
+    }
+
+def content_hash(content):
+    """
+    计算章节原始内容的哈希
+
+    Args:
+        content (str | bytes): 章节内容（HTML格式）
+
+    Returns:
+        str: 十六进制的 sha256 哈希
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content or b'').hexdigest()
+
+# 章节统计索引
+class ChapterStatsIndex:
+    """
+    持久化的章节统计索引：字数、段落数、估算token数、对话比例与内容哈希
+
+    第一次建立时直接从原始字节解析纯文本，之后电子书文件未变化则不再读取电子书；
+    通过 update_chapter_content 修改的章节被标记为过期，查询时只重新计算这些章节。
+    只在内存中的电子书没有稳定的键，统计只保存在本对象中，不写入数据库。
+    规划与调度可以据此估算成本、在多个工作进程之间平衡任务
+
+    Args:
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书
+        path (Path): 索引数据库路径
+    """
+    def __init__(self, ebook=None, path=STATS_PATH):
+        self.store = OE.get_store(ebook)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS chapter_stats ('
+            'book TEXT NOT NULL, chapter INTEGER NOT NULL, chars INTEGER NOT NULL, paragraphs INTEGER NOT NULL, '
+            'tokens INTEGER NOT NULL, dialogue_ratio REAL NOT NULL, content_hash TEXT NOT NULL, '
+            'PRIMARY KEY (book, chapter))'
+        )
+        # 电子书文件的修改时间与大小，与记录一致时可以跳过校验
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS chapter_books ('
+            'book TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, chapters INTEGER NOT NULL)'
+        )
+        self._rows = None
+        self._stale = set()
+        self.store.add_listener(self._mark_stale)
+
+    @property
+    def book(self):
+        """索引中电子书的键：文件的绝对路径，只在内存中的电子书为 None"""
+        if self.store.path is None:
+            return None
+        return str(self.store.path.resolve())
+
+    def _mark_stale(self, chapter_index):
+        self._stale.add(chapter_index)
+
+    def _file_signature(self):
+        path = self.store.path
+        if path is None or not path.exists():
+            return None
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        # 返回已保存的各章统计与电子书文件的记录
+        book = self.book
+        if book is None:
+            return {}, None
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT chapter, chars, paragraphs, tokens, dialogue_ratio, content_hash '
+                'FROM chapter_stats WHERE book = ? ORDER BY chapter', (book,)).fetchall()
+            record = self._conn.execute('SELECT mtime_ns, size, chapters FROM chapter_books WHERE book = ?',
+                                        (book,)).fetchone()
+        return {row[0]: dict(zip(STAT_FIELDS, row[1:])) for row in rows}, record
+
+    def _compute(self, chapter_index, raw_hash=None):
+        text = self.store.chapter_info(chapter_index, fields=('content',), as_text=True, cache=False)['content']
+        stats = text_stats(text)
+        if raw_hash is None:
+            raw_hash = content_hash(self.store.items[chapter_index].content)
+        stats['content_hash'] = raw_hash
+        return stats
+
+    def _write(self, changed, total):
+        book = self.book
+        if book is None:
+            return
+        signature = self._file_signature()
+        # 有未保存的修改时统计与文件内容不一致，不记录文件签名，下次重新校验
+        if self.store.dirty:
+            signature = None
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM chapter_stats WHERE book = ? AND chapter >= ?', (book, total))
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO chapter_stats VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(book, chapter_index) + tuple(stats[field] for field in STAT_FIELDS)
+                 for chapter_index, stats in changed.items()])
+            self._conn.execute('INSERT OR REPLACE INTO chapter_books VALUES (?, ?, ?, ?)',
+                               (book, *(signature or (None, None)), total))
+
+    def build(self, force=False):
+        """
+        建立或增量更新索引：电子书文件未变化时直接读取索引，否则只重新计算内容哈希变化的章节
+
+        Args:
+            force (bool): 是否忽略已有记录、重新计算全部章节
+
+        Returns:
+            int: 重新计算的章节数
+        """
+        rows, record = self._load()
+        if force:
+            rows = {}
+        signature = self._file_signature()
+        if (not force and not self._stale and signature is not None and record is not None
+                and tuple(record[:2]) == signature and len(rows) == record[2]):
+            self._rows = rows
+            return 0
+
+        total = len(self.store)
+        changed = {}
+        for chapter_index in range(total):
+            # 直接对文档项中保存的原始字节取哈希，不调用 get_content 重新解析章节
+            raw_hash = content_hash(self.store.items[chapter_index].content)
+            old = rows.get(chapter_index)
+            if old is None or old['content_hash'] != raw_hash:
+                changed[chapter_index] = self._compute(chapter_index, raw_hash)
+        rows = {chapter_index: stats for chapter_index, stats in rows.items() if chapter_index < total}
+        rows.update(changed)
+        self._write(changed, total)
+        self._rows = rows
+        self._stale.clear()
+        return len(changed)
+
+    def refresh(self):
+        """
+        重新计算被标记为过期的章节（通过 update_chapter_content 修改过的章节）
+
+        Returns:
+            int: 重新计算的章节数
+        """
+        if self._rows is None:
+            return self.build()
+        if not self._stale:
+            return 0
+        total = len(self.store)
+        changed = {chapter_index: self._compute(chapter_index)
+                   for chapter_index in sorted(self._stale) if chapter_index < total}
+        self._rows.update(changed)
+        self._write(changed, total)
+        self._stale.clear()
+        return len(changed)
+
+    def get(self, chapter_index):
+        """
+        获取指定章节的统计
+
+        Args:
+            chapter_index (int): 章节序号
+
+        Returns:
+            dict: 以 STAT_FIELDS 为键的字典
+        """
+        self.refresh()
+        return dict(self._rows[chapter_index])
+
+    def _indices(self, start=0, stop=None, volume=None, chapter_indices=None):
+        self.refresh()
+        if chapter_indices is not None:
+            return list(chapter_indices)
+        total = len(self._rows)
+        if volume is not None:
+            start, stop = OE.get_volume_range(volume, total)
+        return list(range(*slice(start, stop).indices(total)))
+
+    def table(self, start=0, stop=None, volume=None):
+        """
+        获取一段章节的统计
+
+        Args:
+            start (int): 起始章节序号
+            stop (int): 结束章节序号（不包含）
+            volume (int): 卷序号，给出时忽略 start 与 stop
+
+        Returns:
+            list: 每个章节一个字典，包含 'index' 与 STAT_FIELDS
+        """
+        return [{'index': chapter_index, **self._rows[chapter_index]}
+                for chapter_index in self._indices(start, stop, volume)]
+
+    def total(self, field='tokens', start=0, stop=None, volume=None, chapter_indices=None):
+        """
+        汇总一段章节的统计量，如估算整卷的token数
+
+        Args:
+            field (str): 'chars'、'paragraphs' 或 'tokens'
+            start (int): 起始章节序号
+            stop (int): 结束章节序号（不包含）
+            volume (int): 卷序号，给出时忽略 start 与 stop
+            chapter_indices (list): 章节序号列表，给出时忽略其余范围参数
+
+        Returns:
+            int: 合计值
+        """
+        indices = self._indices(start, stop, volume, chapter_indices)
+        return sum(self._rows[chapter_index][field] for chapter_index in indices)
+
+    def balance(self, workers, field='tokens', start=0, stop=None, volume=None, chapter_indices=None):
+        """
+        将章节分配给多个工作进程，使各自的工作量尽量接近（最长处理时间优先的贪心分配）
+
+        Args:
+            workers (int): 工作进程数
+            field (str): 衡量工作量的统计量
+            start (int): 起始章节序号
+            stop (int): 结束章节序号（不包含）
+            volume (int): 卷序号，给出时忽略 start 与 stop
+            chapter_indices (list): 章节序号列表，给出时忽略其余范围参数
+
+        Returns:
+            list: 每个工作进程一个按序号排列的章节序号列表
+        """
+        indices = self._indices(start, stop, volume, chapter_indices)
+        loads = [(0, worker) for worker in range(workers)]
+        groups = [[] for _ in range(workers)]
+        for chapter_index in sorted(indices, key=lambda i: -self._rows[i][field]):
+            load, worker = heapq.heappop(loads)
+            groups[worker].append(chapter_index)
+            heapq.heappush(loads, (load + self._rows[chapter_index][field], worker))
+        return [sorted(group) for group in groups]
+
+    def render_chart(self, path='render.html', field='chars'):
+        """
+        生成各章节统计量的柱状图
+
+        Args:
+            path (str): 图表的保存路径
+            field (str): 'chars'、'paragraphs'、'tokens' 或 'dialogue_ratio'
+
+        Returns:
+            str: 图表的保存路径
+        """
+        rows = self.table()
+        labels = {'chars': '字数', 'paragraphs': '段落数', 'tokens': '估算token数', 'dialogue_ratio': '对话比例'}
+        bar = (
+            Bar(init_opts=opts.InitOpts(width='1600px', height='600px'))
+            .add_xaxis([str(row['index']) for row in rows])
+            .add_yaxis(labels[field], [row[field] for row in rows], label_opts=opts.LabelOpts(is_show=False))
+            .set_global_opts(
+                title_opts=opts.TitleOpts(title=f'各章节{labels[field]}'),
+                datazoom_opts=[opts.DataZoomOpts(), opts.DataZoomOpts(type_='inside')]
+            )
+        )
+        return bar.render(path)
+
+    def close(self):
+        """
+        关闭数据库连接并取消对章节修改的监听
+        """
+        self.store.remove_listener(self._mark_stale)
+        self._conn.close()
+
+# 示例使用
+if __name__ == "__main__":
+    # 建立或增量更新统计索引，生成各章节字数的图表
+    # index = ChapterStatsIndex()
+    # print(f'重新计算 {index.build()} 章，全书估算 {index.total()} token')
+    # print(index.balance(4))
+    # index.render_chart('render.html')
+
+    pass
@@ -0,0 +1,209 @@
+# continuity_memory.py
+
+# 导入所需库
+from pathlib import Path
+
+import AIUESAGENT as AT
+import Env
+import operating_ebook as OE
+import tokens as TK
+from rewrite_pipeline import Journal, content_hash
+
+# 参数设置
+MEMORY_PATH = Path('./cache/continuity_memory.sqlite') # 前情记忆的保存路径
+
+SUMMARY_PROMPT = '''你是一名网络小说编辑，请用不超过{chars}字概括下面的小说章节：写明出场的主要人物、发生的关键事件，以及章节结束时人物的处境与关系变化。
+只输出概括，不要添加任何说明。'''
+ROLLUP_PROMPT = '''你是一名网络小说编辑，下面给出“已有梗概”和紧接其后的“新内容”，请将两者合并为一份不超过{chars}字的梗概：
+保留对后续情节仍有影响的人物、设定与伏笔，删去已经了结的细节。只输出合并后的梗概，不要添加任何说明。'''
+
+# 分层的前情记忆
+class ContinuityMemory:
+    """
+    分层滚动的前情记忆：章节概括 → 卷内滚动梗概 → 全书滚动梗概
+
+    每章完成后只概括这一章，并把概括并入所在卷截至该章的滚动梗概，不从头重新计算；
+    前几卷的梗概在需要时逐卷并入全书梗概。每一层的长度都有上限，
+    因此任何章节得到的上下文都不超过固定的token预算，提示词长度不随章节位置增长。
+    各层结果按输入哈希记在任务日志中，重新运行时直接读取。
+    多个卷并行处理时先用 snapshot 固定各卷的全书梗概，避免每章都重新合并仍在变化的其他卷
+
+    Args:
+        agent (AsyncAIUESAgent): 请求模型的异步智能体
+        journal (Journal): 保存各层梗概的任务日志
+        budget (int): 上下文的token上限
+        recent (int): 逐章附上概括的最近章节数
+        chapter_chars (int): 章节概括的字数上限
+        volume_chars (int): 卷内梗概的字数上限
+        book_chars (int): 全书梗概的字数上限
+    """
+    def __init__(self, agent=None, journal=None, budget=1500, recent=3,
+                 chapter_chars=150, volume_chars=400, book_chars=600):
+        self.agent = agent if agent is not None else AT.AsyncAIUESAgent()
+        self.journal = journal if journal is not None else Journal(MEMORY_PATH)
+        self.budget = budget
+        self.recent = recent
+        self.chapter_chars = chapter_chars
+        self.volume_chars = volume_chars
+        self.book_chars = book_chars
+        self.summaries = self.journal.completed('summary')
+        self.volume_rollups = self.journal.completed('volume_rollup')
+        self._snapshot = None
+
+    async def _ask(self, stage, key, prompt, system_prompt, chars):
+        # 以输入内容为哈希，输入未变化时直接读取日志；超出字数上限的部分截去
+        input_hash = content_hash(prompt, system_prompt, self.agent.model)
+        output = self.journal.get(key, stage, input_hash)
+        if output is None:
+            reply = await self.agent.get_response(prompt, system_prompt, max_tokens=chars * 2)
+            output = reply.strip()[:chars]
+            self.journal.put(key, stage, input_hash, output)
+        return output
+
+    def _volume_start(self, chapter_index):
+        return int(Env.LT_VOLUME_IDX[OE.get_volume_of(chapter_index)])
+
+    def _previous(self, entries, chapter_index, stop=None):
+        # 同一卷中序号小于 stop 的已有条目里最靠后的一个
+        stop = chapter_index if stop is None else stop
+        start = self._volume_start(chapter_index)
+        keys = [key for key in entries if start <= key < stop]
+        return max(keys) if keys else None
+
+    async def update(self, chapter_index, rewritten):
+        """
+        章节完成后更新记忆：概括该章，并将概括并入所在卷截至该章的滚动梗概
+
+        Args:
+            chapter_index (int): 章节序号
+            rewritten (str): 章节的润色结果
+
+        Returns:
+            str: 该章的概括
+        """
+        summary = await self._ask('summary', chapter_index, rewritten,
+                                  SUMMARY_PROMPT.format(chars=self.chapter_chars), self.chapter_chars)
+        self.summaries[chapter_index] = summary
+
+        previous = self._previous(self.volume_rollups, chapter_index)
+        if previous is None:
+            # 卷内第一章的梗概即该章的概括
+            rollup = summary[:self.volume_chars]
+            self.journal.put(chapter_index, 'volume_rollup', content_hash(summary), rollup)
+        else:
+            prompt = f'已有梗概：\n{self.volume_rollups[previous]}\n\n新内容：\n{summary}'
+            rollup = await self._ask('volume_rollup', chapter_index, prompt,
+                                     ROLLUP_PROMPT.format(chars=self.volume_chars), self.volume_chars)
+        self.volume_rollups[chapter_index] = rollup
+        return summary
+
+    def volume_summary(self, volume):
+        """
+        获取卷的滚动梗概，截至该卷已完成的最后一章
+
+        Args:
+            volume (int): 卷序号
+
+        Returns:
+            str: 卷梗概，该卷还没有完成的章节时为空字符串
+        """
+        start, stop = OE.get_volume_range(volume)
+        keys = [key for key in self.volume_rollups if key >= start and (stop is None or key < stop)]
+        return self.volume_rollups[max(keys)] if keys else ''
+
+    async def book_summary(self, volume, exclude=()):
+        """
+        获取截至指定卷（包含）的全书滚动梗概，缺少的卷逐卷并入
+
+        Args:
+            volume (int): 卷序号
+            exclude (iterable): 不并入的卷序号
+
+        Returns:
+            str: 全书梗概
+        """
+        exclude = set(exclude)
+        rollup = ''
+        for current in range(volume + 1):
+            volume_summary = self.volume_summary(current) if current not in exclude else ''
+            if not volume_summary:
+                continue
+            if not rollup:
+                rollup = volume_summary[:self.book_chars]
+            else:
+                prompt = f'已有梗概：\n{rollup}\n\n新内容：\n{volume_summary}'
+                rollup = await self._ask('book_rollup', current, prompt,
+                                         ROLLUP_PROMPT.format(chars=self.book_chars), self.book_chars)
+        return rollup
+
+    async def snapshot(self, volumes):
+        """
+        并行处理多个卷之前，固定每个卷使用的前几卷梗概：只并入不在本次处理范围内的卷
+
+        固定之后 context 不再合并全书梗概，各卷得到的上下文与处理的先后顺序无关，
+        也不会因其他卷的进度变化而为每一章重新请求模型；处理完成后调用 release 恢复
+
+        Args:
+            volumes (iterable): 本次并行处理的卷序号
+
+        Returns:
+            dict: 以卷序号为键、固定的全书梗概为值的字典
+        """
+        volumes = sorted(set(volumes))
+        snapshot = {}
+        for volume in volumes:
+            snapshot[volume] = await self.book_summary(volume - 1, exclude=volumes) if volume > 0 else ''
+        self._snapshot = snapshot
+        return dict(snapshot)
+
+    def release(self):
+        """
+        取消 snapshot 固定的全书梗概
+        """
+        self._snapshot = None
+
+    async def context(self, chapter_index):
+        """
+        生成指定章节的前情上下文：前几卷的全书梗概、本卷前文梗概与最近几章的概括
+
+        Args:
+            chapter_index (int): 章节序号
+
+        Returns:
+            str: 不超过 self.budget 个token的上下文，没有前情时为空字符串
+        """
+        volume = OE.get_volume_of(chapter_index)
+        start = self._volume_start(chapter_index)
+        recent = sorted(key for key in self.summaries if start <= key < chapter_index)[-self.recent:] if self.recent else []
+
+        parts = []
+        if volume > 0:
+            if self._snapshot is not None and volume in self._snapshot:
+                book = self._snapshot[volume]
+            else:
+                book = await self.book_summary(volume - 1)
+            if book:
+                parts.append(f'前几卷梗概：{book}')
+        # 本卷梗概只覆盖最近几章之前的内容，避免与逐章概括重复
+        previous = self._previous(self.volume_rollups, chapter_index, recent[0] if recent else chapter_index)
+        if previous is not None:
+            parts.append(f'本卷前文梗概：{self.volume_rollups[previous]}')
+        parts.extend(f'第{key}章概括：{self.summaries[key]}' for key in recent)
+
+        # 超出预算时先去掉最早的部分，只剩一部分时截去其开头（每个字符至多估算为一个token）
+        while len(parts) > 1 and TK.estimate_tokens('\n'.join(parts)) > self.budget:
+            parts.pop(0)
+        block = '\n'.join(parts)
+        if TK.estimate_tokens(block) > self.budget:
+            block = block[-self.budget:]
+        return block
+
+# 示例使用
+if __name__ == "__main__":
+    # 润色时附上固定长度的前情上下文，每章完成后更新记忆
+    # from rewrite_pipeline import RewritePipeline
+    # agent = AT.AsyncAIUESAgent(concurrency=4)
+    # pipeline = RewritePipeline(agent=agent, memory=ContinuityMemory(agent))
+    # pipeline.run(volume=2)
+
+    pass
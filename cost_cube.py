@@ -0,0 +1,168 @@
+# %%
+# 导入第三方库
+import weakref
+import numpy as np
+import pandas as pd
+
+# 参数设置
+DATE_COLUMN = '日期'
+EXPENSE_COLUMN = '总支出/天'
+INCOME_COLUMN = '总收入/天'
+DAYS_COLUMN = '天数'
+
+# %%
+class CostCube:
+    '''
+    按年月预先索引与聚合的消费数据
+
+    数据按日期排序后记录每个月所在的行区间，并一次性计算每个月、每一天所有数值列的合计，
+    之后任意月份的明细、合计与每日汇总都只需查表，多个月的合计直接从月度汇总相加。
+    明细保留原有的 float32 金额，各级汇总按 float64 累加，避免长期合计的舍入误差
+
+    参数:
+        df (DataFrame): proc_washing_data 清洗之后的数据
+    '''
+    def __init__(self, df):
+        data = df.sort_values(DATE_COLUMN, kind='stable').reset_index(drop=True)
+        data = data.fillna({col: 0 for col in data.columns if col != DATE_COLUMN})
+        self.columns = df.columns
+        self.data = data
+
+        # 分类列与收入列，与原先 df.columns[6:-4] 与 df.columns[-4:] 的划分一致
+        skip = (EXPENSE_COLUMN, DATE_COLUMN, INCOME_COLUMN)
+        self.category_columns = [col for col in df.columns[6:-4] if col not in skip]
+        self.income_columns = [col for col in df.columns[-4:] if col not in skip]
+        self.value_columns = [col for col in data.columns
+                              if col != DATE_COLUMN and pd.api.types.is_numeric_dtype(data[col])]
+
+        # 每个月在已排序数据中的行区间
+        dates = data[DATE_COLUMN]
+        keys = (dates.dt.year * 12 + dates.dt.month - 1).to_numpy()
+        month_keys, starts = np.unique(keys, return_index=True)
+        ends = np.append(starts[1:], len(data))
+        self._rows = {int(key): (int(start), int(end)) for key, start, end in zip(month_keys, starts, ends)}
+
+        # 每日汇总与月度汇总，均按 float64 累加
+        days = dates.dt.normalize()
+        values = data[self.value_columns].astype('float64')
+        self.daily = values.groupby(days.to_numpy()).sum()
+        self.daily.index.name = DATE_COLUMN
+        day_keys = (self.daily.index.year * 12 + self.daily.index.month - 1).to_numpy()
+        day_month_keys, day_starts = np.unique(day_keys, return_index=True)
+        day_ends = np.append(day_starts[1:], len(self.daily))
+        self._day_rows = {int(key): (int(start), int(end))
+                          for key, start, end in zip(day_month_keys, day_starts, day_ends)}
+
+        monthly = self.daily.groupby([self.daily.index.year, self.daily.index.month]).sum()
+        monthly[DAYS_COLUMN] = self.daily.groupby([self.daily.index.year, self.daily.index.month]).size()
+        monthly.index.names = ['年', '月']
+        self.monthly = monthly
+
+    @staticmethod
+    def _key(year, month):
+        return year * 12 + month - 1
+
+    def months(self):
+        '''
+        返回:
+            list: 数据覆盖的全部 (年, 月)
+        '''
+        return [(key // 12, key % 12 + 1) for key in self._rows]
+
+    def month(self, year, month):
+        '''
+        获取指定年月的明细数据
+
+        参数:
+            year (int): 指定年份
+            month (int): 指定月份
+
+        返回:
+            pd.DataFrame: 按日期排序、缺失值为0的明细数据，若无数据则返回空 DataFrame
+        '''
+        start, end = self._rows.get(self._key(year, month), (0, 0))
+        return self.data.iloc[start:end].reset_index(drop=True)
+
+    def totals(self, year, month):
+        '''
+        获取指定年月各数值列的合计与记账天数
+
+        参数:
+            year (int): 指定年份
+            month (int): 指定月份
+
+        返回:
+            pd.Series: 各列合计，另含 '天数'；若无数据则返回 None
+        '''
+        try:
+            return self.monthly.loc[(year, month)]
+        except KeyError:
+            return None
+
+    def daily_totals(self, year, month):
+        '''
+        获取指定年月每一天各数值列的合计
+
+        参数:
+            year (int): 指定年份
+            month (int): 指定月份
+
+        返回:
+            pd.DataFrame: 以日期为索引的每日合计
+        '''
+        start, end = self._day_rows.get(self._key(year, month), (0, 0))
+        return self.daily.iloc[start:end]
+
+    def range_totals(self, start, end):
+        '''
+        获取一段月份（含首尾）各数值列的合计
+
+        参数:
+            start (tuple): 起始 (年, 月)
+            end (tuple): 结束 (年, 月)
+
+        返回:
+            pd.Series: 各列合计，另含 '天数'
+        '''
+        keys = self.monthly.index.get_level_values(0) * 12 + self.monthly.index.get_level_values(1) - 1
+        mask = (keys >= self._key(*start)) & (keys <= self._key(*end))
+        return self.monthly[mask].sum()
+
+# %%
+# 同一个 DataFrame 只建立一次索引
+_cubes = {}
+
+def get_cube(df, version=None):
+    '''
+    获取数据对应的 CostCube，同一个 DataFrame 对象在同一版本下只构建一次
+
+    CostCube 持有数据的副本，之后对 DataFrame 的原地修改不会反映到已构建的 CostCube 中；
+    原地修改过数据时须传入新的 version，或先调用 invalidate，否则得到的是修改前的汇总
+
+    参数:
+        df (DataFrame | CostCube): 数据
+        version (hashable): 数据的版本标识，与上次构建时不同则重新构建
+
+    返回:
+        CostCube: 预先索引与聚合的数据
+    '''
+    if isinstance(df, CostCube):
+        return df
+    entry = _cubes.get(id(df))
+    if entry is not None and entry[0]() is df and entry[1] == version:
+        return entry[2]
+    cube = CostCube(df)
+    key = id(df)
+    _cubes[key] = (weakref.ref(df, lambda _: _cubes.pop(key, None)), version, cube)
+    return cube
+
+def invalidate(df):
+    '''
+    丢弃数据对应的 CostCube，下次 get_cube 时重新构建
+
+    参数:
+        df (DataFrame): 数据
+    '''
+    entry = _cubes.get(id(df))
+    if entry is not None and entry[0]() is df:
+        del _cubes[id(df)]
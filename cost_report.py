@@ -5,15 +5,24 @@ import numpy as np
 import datetime
 from pyecharts import charts
 from pyecharts import options as opts
-from pyecharts.globals import ThemeType
-from bs4 import BeautifulSoup
+from pyecharts.globals import ThemeType, CurrentConfig
 import re
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import AIUESAGENT as AT
+import cost_cube as CC
+import cost_stats as CS
+import ledger_store as LS
 from pathlib import Path
 import Env
 
 # 参数设置
 DATA_PATH = 'data/cost_data.xlsx'
+CACHE_DIR = 'data/.cache' # 清洗后数据的缓存目录
+REPORT_SYSTEM_PROMPT = '''你是一名数据分析专家，请根据提供的数据，生成一段消费报告，并且提供具体的省钱建议，要求字数不超过500字。要求：输出格式控制为html的p组件格式'''
 
 # %%
 def proc_washing_data(file_path):
@@ -28,35 +37,110 @@ def proc_washing_data(file_path):
     '''
     df = pd.read_excel(file_path)
 
-    # 列名替换
-    idx = df.index
-    up_columns = df.columns.values
-    low_columns = df.iloc[0,:].fillna('error').values
-    new_low_columns = low_columns
-    for i,j in enumerate(low_columns):
-        if j == 'error':
-            new_low_columns[i] = up_columns[i]
+    # 列名替换：第二行表头为空的列沿用第一行表头
+    columns = LS.merge_header(df.columns, df.iloc[0,:])
     df = df.iloc[1:,:]
-    df.columns = new_low_columns
+    df.columns = columns
 
-    # 数据格式转换
-    df['日期'] = pd.to_datetime(df['日期'], format='%Y%m%d')
+    # 数据格式转换：日期为 datetime64，能完整转换为数值的列为 float32 金额
+    df = LS.convert_columns(df)
     
     return df
 
+# %%
+def _file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_cost_data(file_path=DATA_PATH, cache_dir=CACHE_DIR):
+    '''
+    读取清洗后的数据，优先使用缓存
+
+    缓存为 Parquet（需要 pyarrow），否则为 pickle；源文件的修改时间与大小未变时直接读取缓存，
+    变化时再比较文件哈希，内容确实变化才重新读取 Excel 并清洗
+
+    参数:
+        file_path (str): 数据文件路径
+        cache_dir (str): 缓存目录
+
+    返回:
+        df (DataFrame): 清洗之后的数据
+    '''
+    source = Path(file_path)
+    cache_dir = Path(cache_dir)
+    meta_path = cache_dir / f'{source.stem}.json'
+    stat = source.stat()
+
+    meta = None
+    if meta_path.exists():
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    if meta is not None and Path(meta['cache']).exists():
+        unchanged = meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size
+        if not unchanged and meta['sha256'] == _file_sha256(source):
+            # 只是修改时间变化，内容相同
+            meta['mtime_ns'] = stat.st_mtime_ns
+            meta['size'] = stat.st_size
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            unchanged = True
+        if unchanged:
+            if meta['format'] == 'parquet':
+                return pd.read_parquet(meta['cache'])
+            return pd.read_pickle(meta['cache'])
+
+    df = proc_washing_data(source)
+    # 备注等文本列可能混有数字，统一为字符串，Parquet 的列必须是单一类型
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].map(lambda value: None if pd.isna(value) else str(value))
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # 先写临时文件再替换，写入失败时不会留下不完整的缓存；
+    # 没有 pyarrow 或列类型无法转换（ArrowTypeError、ArrowInvalid 等）时改用 pickle
+    cache_path = cache_dir / f'{source.stem}.parquet'
+    tmp_cache = cache_path.with_suffix('.parquet.tmp')
+    try:
+        df.to_parquet(tmp_cache)
+        cache_format = 'parquet'
+    except (ImportError, TypeError, ValueError, NotImplementedError):
+        tmp_cache.unlink(missing_ok=True)
+        cache_path = cache_dir / f'{source.stem}.pkl'
+        tmp_cache = cache_path.with_suffix('.pkl.tmp')
+        df.to_pickle(tmp_cache)
+        cache_format = 'pickle'
+    os.replace(tmp_cache, cache_path)
+    meta = {
+        'cache': str(cache_path),
+        'format': cache_format,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': _file_sha256(source)
+    }
+    # 先写临时文件再替换，避免中断时留下不完整的元数据
+    tmp_path = meta_path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+    return df
+
 # %%
 def extract_monthly_expenses(df, year, month):
     """
     提取指定年月的每日消费数据
 
     参数:
-        df (DataFrame): 数据
+        df (DataFrame | CostCube): 数据，传入 CostCube 时直接按索引取出该月数据
         year (int): 指定年份，如 2024
         month (int): 指定月份，如 3 表示 3月
 
     返回:
         pd.DataFrame: 指定月份的消费数据，若无数据则返回空 DataFrame
     """
+    if isinstance(df, CC.CostCube):
+        return df.month(year, month)
 
     # 提取目标年月的数据
     mask = (df['日期'].dt.year == year) & (df['日期'].dt.month == month)
@@ -71,58 +155,53 @@ def extract_monthly_expenses(df, year, month):
     return monthly_data.reset_index(drop=True)
 
 # %%
-def extract_chart_from_html(source_html_path):
-    # 读取源HTML文件
-    with open(source_html_path, 'r', encoding='utf-8') as f:
-        source_content = f.read()
-    
-    # 解析HTML
-    soup = BeautifulSoup(source_content, 'html.parser')
-    
-    # 提取图表容器（通常带有特定ID或class）
-    chart_div = soup.find('body').find('div')
-    chart_script = soup.find('body').find('script')
-    
-    # 返回提取的图表内容
-    return (chart_div, chart_script)
+# pyecharts 自带的图表片段模板，只包含图表的 <div> 与 <script>
+CHART_TEMPLATE = CurrentConfig.GLOBAL_ENV.from_string(
+    '{% import "macro" as macro %}{{ macro.render_chart_content(c) }}')
 
-# print(extract_chart_from_html('bar.html'))
+def embed_chart(chart):
+    """
+    在内存中生成图表的 HTML 片段，不写文件、不重新解析 HTML
+
+    参数:
+        chart (Chart): pyecharts 图表
+
+    返回:
+        str: 图表的 <div> 与 <script>，echarts.min.js 由报告页面统一引入
+    """
+    chart._prepare_render()
+    return CHART_TEMPLATE.render(c=chart)
 
 # %%
-def save_report_to_html(report, title, tables):
+def report_to_html(report, title, tables, images=('', '', '')):
     """
-    保存报告到 HTML 文件
+    生成报告的 HTML 页面
 
     Args:
         report (str): 报告内容
         title (str): 报告标题
         tables (list): 表格列表
-        images (list): 图片列表
+        images (list): 三张图表的 HTML 片段
 
     Returns:
-        None
+        str: 完整的 HTML 页面
     """
 
-    images = [0,1,2]
-
     # 基本数据
     section1 = re.search(re.compile(r"<title 1>(.*?)<title 2>", re.S), report).group().split('\n',1)
     section1_title = section1[0].split('<title 1>')[1]
     section1_content = section1[1].split('<title 2>')[0].split('\n')
     section1_content = '</p><p>'.join(section1_content)
-    images[0] = extract_chart_from_html('image/section_1.html')
     
     section2 = re.search(re.compile(r"<title 2>(.*?)<title 3>", re.S), report).group().split('\n',1)
     section2_title = section2[0].split('<title 2>')[1]
     section2_content = section2[1].split('<title 3>')[0].split('\n')
     section2_content = '</p><p>'.join(section2_content)
-    images[1] = extract_chart_from_html('image/section_2.html')
 
     section3 = re.search(re.compile(r"<title 3>(.*?)<title 4>", re.S), report).group().split('\n',1)
     section3_title = section3[0].split('<title 3>')[1]
     section3_content = section3[1].split('<title 4>')[0].split('\n')
     section3_content = '</p><p>'.join(section3_content)
-    images[2] = extract_chart_from_html('image/section_3.html')
     df_html_1 = tables[0].to_html(classes="table table-striped", index=True, justify="left")# 输出靠右
 
     section4 = re.search(re.compile(r"<title 4>.+", re.S), report).group().split('\n',1)
@@ -146,15 +225,15 @@ def save_report_to_html(report, title, tables):
         <h1 class="text-center mb-4">{title[:-5]}</h1>
 
         <h3>{section1_title}</h3>
-        <p>{images[0][0]}{images[0][1]}</p>
+        <p>{images[0]}</p>
         <p>{section1_content}</p>
 
         <h3>{section2_title}</h3>
-        <p>{images[1][0]}{images[1][1]}</p>
+        <p>{images[1]}</p>
         <p>{section2_content}</p>
 
         <h3>{section3_title}</h3>
-        <p>{images[2][0]}{images[2][1]}</p>
+        <p>{images[2]}</p>
         <p>{section3_content}</p>
         {df_html_1}
 
@@ -164,157 +243,51 @@ def save_report_to_html(report, title, tables):
     </body>
     </html>
     """
-    with open(f"{title}", "w", encoding="utf-8") as f:
-        f.write(html)
+    return html
 
-# %%
-def analyze_and_generate_report(df, year, month, model):
-    """
-    分析指定年月的消费数据并生成详细报告
-    
-    参数:
-        df (DataFrame): 数据
-        year (int): 指定年份
-        month (int): 指定月份
-    
-    返回:
-        dict: 包含分析结果和报告的字典
+def save_report_to_html(report, title, tables, images=('', '', '')):
     """
-    # 获取指定月份的数据
-    monthly_data = extract_monthly_expenses(df, year, month)
-    
-    if monthly_data.empty:
-        return {
-            "summary": f"未找到 {year}年{month}月 的消费记录。",
-            "data": monthly_data,
-            "statistics": None,
-            "report": ""
-        }
-    
-    # 数据分析部分
-    # 1. 基础统计信息
-    total_expense = (monthly_data['总支出/天'].sum()).round(2)
-    average_daily_expense = (total_expense / len(monthly_data['日期'].dt.date.unique())).round(2)
-    total_common_income = (monthly_data['总收入/天'].sum()).round(2)
-    average_daily_income = (total_common_income / len(monthly_data['日期'].dt.date.unique())).round(2)
-    total_benefit = (monthly_data['总收入/天'].sum() - monthly_data['总支出/天'].sum()).round(2)
-    average_daily_benefit = (total_benefit / len(monthly_data['日期'].dt.date.unique())).round(2)
-
-    # 2. 分类统计（如果有category列）
-    category_stats = {}
-    for col in df.columns[6:-4]:
-        if col != '总支出/天' and col != '日期' and col != '总收入/天':
-            # monthly_data[col] = monthly_data[col].astype(str)
-            category_stats[col] = monthly_data[col].sum()
-    income_stats = {}
-    for col in df.columns[-4:]:
-        if col != '总支出/天' and col != '日期' and col != '总收入/天':
-            # monthly_data[col] = monthly_data[col].astype(str)
-            income_stats[col] = monthly_data[col].sum()
-    # print(category_stats)
-    
-    ####
-    # 3. 日消费趋势
-    daily_expense = {}
-    if '总支出/天' in monthly_data.columns:
-        daily_expense = monthly_data.groupby(monthly_data['日期'].dt.date)['总支出/天'].sum().to_dict()
-    daily_income = {}
-    if '总收入/天' in monthly_data.columns:
-        daily_income = monthly_data.groupby(monthly_data['日期'].dt.date)['总收入/天'].sum().to_dict()
-    # print(daily_expense.keys)
-    daily_expense_info = []
-    if '总支出/天' in monthly_data.columns:
-        daily_expense_info = [monthly_data['总支出/天'].mean().round(2), 
-                         monthly_data['总支出/天'].median().round(2), 
-                         monthly_data['总支出/天'].mode().values[0].round(2),
-                         monthly_data['总支出/天'].max().round(2), 
-                         monthly_data['总支出/天'].min().round(2), 
-                         monthly_data['总支出/天'].var().round(2), 
-                         monthly_data['总支出/天'].std().round(2)]
-    daily_income_info = []
-    if '总收入/天' in monthly_data.columns:
-        daily_income_info = [monthly_data['总收入/天'].mean().round(2), 
-                         monthly_data['总收入/天'].median().round(2), 
-                         monthly_data['总收入/天'].mode().values[0].round(2),
-                         monthly_data['总收入/天'].max().round(2), 
-                         monthly_data['总收入/天'].min().round(2), 
-                         monthly_data['总收入/天'].var().round(2), 
-                         monthly_data['总收入/天'].std().round(2)]
-    ####
+    保存报告到 HTML 文件
 
-    # 组织统计数据
-    statistics = {
-        "total_expense": total_expense,
-        "average_daily_expense": average_daily_expense,
-        "total_common_income": total_common_income,
-        "total_expense_with_income": total_benefit,
-        "category_stats": category_stats,
-        "daily_expense": daily_expense,
-        "income_stats": income_stats,
-        "daily_income": daily_income
-    }
+    Args:
+        report (str): 报告内容
+        title (str): 报告标题
+        tables (list): 表格列表
+        images (list): 三张图表的 HTML 片段
 
-    # 生成报告文本与图片
-    report_lines = []
-    system_prompt = '''你是一名数据分析专家，请根据提供的数据，生成一段消费报告，并且提供具体的省钱建议，要求字数不超过500字。要求：输出格式控制为html的p组件格式'''
-    report_text = '一、总体概况'
+    Returns:
+        None
+    """
+    html = report_to_html(report, title, tables, images)
+    with open(f"{title}", "w", encoding="utf-8") as f:
+        f.write(html)
 
-    # 第一部分的文字内容
-    if True:
-        report_lines.append("<title 1>一、总体概况")
-        report_lines.append("")
-        report_text += f'''
-        下面是就需分析的消费数据。
-        总支出金额：¥{total_expense:.2f}，
-        日均支出金额：¥{average_daily_expense:.2f}，
-        总收入金额：¥{total_common_income:.2f}，
-        日均收入金额：¥{average_daily_income:.2f}，
-        总净收入：¥{total_benefit:.2f}。
-        日均收支金额：¥{average_daily_benefit:.2f}。\n
-        '''
-        # 第一部分的图片内容
-        (charts.Grid()
+# %%
+def build_overview_chart(chart_data):
+    # 第一部分的图片内容：（日均）收支金额
+    return (charts.Grid()
         .add(
             charts.Bar()
             .add_xaxis(['总支出金额', '总收入金额', '总净收入'])
-            .add_yaxis("收支金额", [total_expense, total_common_income, total_benefit])
+            .add_yaxis("收支金额", chart_data['totals'])
             .set_global_opts(title_opts=opts.TitleOpts(title="（日均）收支金额"),
                             legend_opts=opts.LegendOpts(pos_right="50%")),
             grid_opts=opts.GridOpts(pos_left="0%", pos_right="55%"))
         .add(
             charts.Bar()
             .add_xaxis(['日均消费金额', '日均收入金额', '日均净收入'])
-            .add_yaxis("日均收支金额", 
-                    [average_daily_expense, average_daily_income, average_daily_benefit],
+            .add_yaxis("日均收支金额",
+                    chart_data['averages'],
                     label_opts=opts.LabelOpts(formatter="{c}"),)
             .set_global_opts(title_opts=opts.TitleOpts(title="（日均）收支金额"),
                             legend_opts=opts.LegendOpts(pos_left="60%")),
-            grid_opts=opts.GridOpts(pos_left="55%", pos_right="0%"))
-        .render('image/section_1.html'))
-    
-    if category_stats:
-        # 第二部分的文字内容
-        report_lines.append("<title 2>二、分类收支统计")
+            grid_opts=opts.GridOpts(pos_left="55%", pos_right="0%")))
 
-        # 第二部分的图片内容
-        #report_lines.append("  以下为消费金额占比:")
-        report_text += "二、以下为消费金额占比:"
-        sorted_categories = sorted(category_stats.items(), key=lambda x: x[1], reverse=True)
-        expense_stats_pie = {}
-        for category, amount in sorted_categories:
-            percentage = (amount / total_expense * 100).round(2) if total_expense > 0 else 0
-            report_text += (f"  {category}: ¥{amount:.2f} ({percentage:.1f}%)")
-            expense_stats_pie[category] = percentage
-        #report_lines.append("  以下为收入金额占比:")
-        report_text += "以下为收入金额占比:"
-        sorted_income = sorted(income_stats.items(), key=lambda x: x[1], reverse=True)
-        income_stats_pie = {}
-        for income, amount in sorted_income:
-            percentage = (amount / total_common_income * 100).round(2) if total_common_income > 0 else 0
-            report_text += (f"  {income}: ¥{amount:.2f} ({percentage:.1f}%)")
-            income_stats_pie[income] = percentage
-        report_lines.append("")
-        (charts.Grid()
+def build_share_chart(chart_data):
+    # 第二部分的图片内容：收支金额占比
+    expense_stats_pie = chart_data['expense_pie']
+    income_stats_pie = chart_data['income_pie']
+    return (charts.Grid()
          .add(
             charts.Pie()
             .add(
@@ -339,24 +312,13 @@ def analyze_and_generate_report(df, year, month, model):
             .set_global_opts(title_opts=opts.TitleOpts(title="总收入金额占比", pos_right=('20%')),
                              legend_opts=opts.LegendOpts(pos_bottom="90%")),
             grid_opts=opts.GridOpts(pos_left="50%", pos_right="0%")
-         )
-         .render('image/section_2.html'))
-    
-    if daily_expense:
-        report_lines.append("<title 3>三、日收支概况及趋势")
-        df_info_columns = ['平均数','中位数','众数','最大值','最小值','方差','标准差']
-        df_info_index = ['消费金额','收入金额']
-        df_info = pd.DataFrame([daily_expense_info,daily_income_info],
-                               columns=df_info_columns,index=df_info_index)
-        # print(df_info)
-        report_text += (f'''\n三、日收支概况及趋势：
-                        1.消费数据：
-                        平均数：{df_info['平均数'][0]}，中位数：{df_info['中位数'][0]}，众数：{df_info['众数'][0]}，最大值：{df_info['最大值'][0]}，最小值：{df_info['最小值'][0]}，方差：{df_info['方差'][0]}，标准差：{df_info['标准差'][0]}；
-                        2.收入数据：
-                        平均数：{df_info['平均数'][1]}，中位数：{df_info['中位数'][1]}，众数：{df_info['众数'][1]}，最大值：{df_info['最大值'][1]}，最小值：{df_info['最小值'][1]}，方差：{df_info['方差'][1]}，标准差：{df_info['标准差'][1]}；
-                        ''')
-        report_lines.append("")
-        (charts.Bar()
+         ))
+
+def build_daily_chart(chart_data):
+    # 第三部分的图片内容：每日收支流水
+    daily_expense = chart_data['daily_expense']
+    daily_income = chart_data['daily_income']
+    return (charts.Bar()
               .add_xaxis(list(daily_expense.keys()))
               .add_yaxis('每日支出', list(daily_expense.values()),yaxis_index=0)#y0
               .add_yaxis('每日收入', list(daily_income.values()),yaxis_index=1)#y1
@@ -373,7 +335,7 @@ def analyze_and_generate_report(df, year, month, model):
               .set_global_opts(title_opts=opts.TitleOpts(title="每日收支流水"),
                                yaxis_opts=opts.AxisOpts(
                                    name='支出',
-                                   type_='value',  
+                                   type_='value',
                                    position='left',
                                    axislabel_opts=opts.AxisLineOpts(
                                        linestyle_opts=opts.LineStyleOpts(color="#009DFF"))
@@ -385,49 +347,423 @@ def analyze_and_generate_report(df, year, month, model):
                                   yaxis_index=0)
                        .add_yaxis('每日收入', list(daily_income.values()),
                                   label_opts=opts.LabelOpts(is_show=False),
-                                  yaxis_index=1))
-         .render('image/section_3.html'))
+                                  yaxis_index=1)))
+
+def render_report_charts(chart_data):
+    """
+    渲染报告的三张图表
+
+    参数:
+        chart_data (dict): prepare_report 返回的图表数据
+
+    返回:
+        list: 三张图表的 HTML 片段，没有数据的部分为空字符串
+    """
+    images = [embed_chart(build_overview_chart(chart_data)), '', '']
+    if chart_data['expense_pie'] is not None:
+        images[1] = embed_chart(build_share_chart(chart_data))
+    if chart_data['daily_expense']:
+        images[2] = embed_chart(build_daily_chart(chart_data))
+    return images
+
+# %%
+def prepare_report(df, year, month):
+    """
+    计算指定年月的统计数据并组织提示词，不渲染图表、不请求模型
+
+    参数:
+        df (DataFrame | CostCube): 数据
+        year (int): 指定年份
+        month (int): 指定月份
+
+    返回:
+        dict: 包含统计数据、提示词、报告骨架、表格与图表数据的字典；若无数据，'statistics' 为 None
+    """
+    # 获取指定月份的数据与预先计算的汇总
+    cube = CC.get_cube(df)
+    monthly_data = cube.month(year, month)
+
+    if monthly_data.empty:
+        return {
+            "summary": f"未找到 {year}年{month}月 的消费记录。",
+            "data": monthly_data,
+            "statistics": None,
+            "report": ""
+        }
+
+    # 数据分析部分：一次性得到全部统计量
+    stats = CS.compute_statistics(cube, [(year, month)])
+    period = (year, month)
+    totals = stats['totals'].loc[period]
+    total_expense = totals['总支出金额']
+    average_daily_expense = totals['日均支出金额']
+    total_common_income = totals['总收入金额']
+    average_daily_income = totals['日均收入金额']
+    total_benefit = totals['总净收入']
+    average_daily_benefit = totals['日均净收入']
+
+    # 2. 分类统计
+    category_stats = stats['category_stats'].loc[period].to_dict()
+    income_stats = stats['income_stats'].loc[period].to_dict()
+    category_shares = stats['category_shares'].loc[period]
+    income_shares = stats['income_shares'].loc[period]
+
+    # 3. 日消费趋势
+    daily_totals = cube.daily_totals(year, month)
+    daily_dates = daily_totals.index.date
+    daily_expense = {}
+    if '总支出/天' in daily_totals.columns:
+        daily_expense = dict(zip(daily_dates, daily_totals['总支出/天']))
+    daily_income = {}
+    if '总收入/天' in daily_totals.columns:
+        daily_income = dict(zip(daily_dates, daily_totals['总收入/天']))
+
+    # 组织统计数据
+    statistics = {
+        "total_expense": total_expense,
+        "average_daily_expense": average_daily_expense,
+        "total_common_income": total_common_income,
+        "total_expense_with_income": total_benefit,
+        "category_stats": category_stats,
+        "daily_expense": daily_expense,
+        "income_stats": income_stats,
+        "daily_income": daily_income
+    }
+
+    # 生成报告文本与图表数据
+    report_lines = []
+    chart_data = {
+        'totals': [total_expense, total_common_income, total_benefit],
+        'averages': [average_daily_expense, average_daily_income, average_daily_benefit],
+        'expense_pie': None,
+        'income_pie': None,
+        'daily_expense': daily_expense,
+        'daily_income': daily_income
+    }
+    df_info = None
+    report_text = '一、总体概况'
+
+    # 第一部分的文字内容
+    if True:
+        report_lines.append("<title 1>一、总体概况")
+        report_lines.append("")
+        report_text += f'''
+        下面是就需分析的消费数据。
+        总支出金额：¥{total_expense:.2f}，
+        日均支出金额：¥{average_daily_expense:.2f}，
+        总收入金额：¥{total_common_income:.2f}，
+        日均收入金额：¥{average_daily_income:.2f}，
+        总净收入：¥{total_benefit:.2f}。
+        日均收支金额：¥{average_daily_benefit:.2f}。\n
+        '''
+
+    if category_stats:
+        # 第二部分的文字内容
+        report_lines.append("<title 2>二、分类收支统计")
+
+        #report_lines.append("  以下为消费金额占比:")
+        report_text += "二、以下为消费金额占比:"
+        sorted_categories = sorted(category_stats.items(), key=lambda x: x[1], reverse=True)
+        expense_stats_pie = {category: category_shares[category] for category, _ in sorted_categories}
+        report_text += ''.join(f"  {category}: ¥{amount:.2f} ({expense_stats_pie[category]:.1f}%)"
+                               for category, amount in sorted_categories)
+        #report_lines.append("  以下为收入金额占比:")
+        report_text += "以下为收入金额占比:"
+        sorted_income = sorted(income_stats.items(), key=lambda x: x[1], reverse=True)
+        income_stats_pie = {income: income_shares[income] for income, _ in sorted_income}
+        report_text += ''.join(f"  {income}: ¥{amount:.2f} ({income_stats_pie[income]:.1f}%)"
+                               for income, amount in sorted_income)
+        report_lines.append("")
+        chart_data['expense_pie'] = expense_stats_pie
+        chart_data['income_pie'] = income_stats_pie
+
+    if daily_expense:
+        report_lines.append("<title 3>三、日收支概况及趋势")
+        df_info = CS.describe_table(stats, period)
+        # print(df_info)
+        report_text += (f'''\n三、日收支概况及趋势：
+                        1.消费数据：
+                        平均数：{df_info['平均数'].iloc[0]}，中位数：{df_info['中位数'].iloc[0]}，众数：{df_info['众数'].iloc[0]}，最大值：{df_info['最大值'].iloc[0]}，最小值：{df_info['最小值'].iloc[0]}，方差：{df_info['方差'].iloc[0]}，标准差：{df_info['标准差'].iloc[0]}；
+                        2.收入数据：
+                        平均数：{df_info['平均数'].iloc[1]}，中位数：{df_info['中位数'].iloc[1]}，众数：{df_info['众数'].iloc[1]}，最大值：{df_info['最大值'].iloc[1]}，最小值：{df_info['最小值'].iloc[1]}，方差：{df_info['方差'].iloc[1]}，标准差：{df_info['标准差'].iloc[1]}；
+                        ''')
+        report_lines.append("")
 
     # 添加数据详情
     report_lines.append("<title 4>四、详细消费记录")
-    report_lines.append(AT.AIUESAgent(model=model).get_response(report_text, system_prompt))
-    report_lines.append('')
-    
-    report = "\n".join(report_lines)
-    
-    # 打印报告
-    # print(report_text)
 
-    # 保存报告至 html 文件
-    save_report_to_html(report, f"cost_report/{year}年{month}月消费报告.html", [df_info, monthly_data])
-    
-    # 返回结构化结果
     return {
         "summary": f"{year}年{month}月共消费¥{total_expense:.2f}",
         "data": monthly_data,
         "statistics": statistics,
-        "report": report
+        "report_lines": report_lines,
+        "report_text": report_text,
+        "tables": [df_info, monthly_data],
+        "chart_data": chart_data,
+        "stats": stats
+    }
+
+def finish_report(prepared, reply, title, images=('', '', ''), save=True):
+    """
+    拼接模型回复并保存报告
+
+    参数:
+        prepared (dict): prepare_report 的返回结果
+        reply (str): 模型生成的消费报告
+        title (str): 报告文件路径
+        images (list): 三张图表的 HTML 片段
+        save (bool): 是否写出 html 文件
+
+    返回:
+        dict: 包含分析结果、报告与报告页面的字典
+    """
+    report = "\n".join(prepared['report_lines'] + [reply, ''])
+
+    # 打印报告
+    # print(report_text)
+
+    # 生成报告页面，需要时保存至 html 文件
+    html = report_to_html(report, title, prepared['tables'], images)
+    if save:
+        with open(f"{title}", "w", encoding="utf-8") as f:
+            f.write(html)
+
+    # 返回结构化结果
+    return {
+        "summary": prepared['summary'],
+        "data": prepared['data'],
+        "statistics": prepared['statistics'],
+        "report": report,
+        "html": html
     }
 
+def analyze_and_generate_report(df, year, month, model, cache=None):
+    """
+    分析指定年月的消费数据并生成详细报告
+
+    参数:
+        df (DataFrame | CostCube): 数据，同一份数据只在第一次调用时建立年月索引与汇总
+        year (int): 指定年份
+        month (int): 指定月份
+        model (str): 使用的模型
+        cache (ResponseCache): 可选的回复缓存，同一个月份的数据重复生成报告时不再请求模型
+
+    返回:
+        dict: 包含分析结果和报告的字典
+    """
+    prepared = prepare_report(df, year, month)
+    if prepared['statistics'] is None:
+        return prepared
 
+    images = render_report_charts(prepared['chart_data'])
+    reply = AT.AIUESAgent(model=model, cache=cache).get_response(prepared['report_text'], REPORT_SYSTEM_PROMPT)
+    return finish_report(prepared, reply, f"cost_report/{year}年{month}月消费报告.html", images)
 
 # %%
-# --------------------------
-# 使用示例
-# --------------------------
-if __name__ == "__main__":
-    # 示例调用
-    df = proc_washing_data(DATA_PATH)
+def month_range(start, end):
+    """
+    列出两个年月之间（含首尾）的全部年月
+
+    参数:
+        start (tuple): 起始 (年, 月)
+        end (tuple): 结束 (年, 月)
+
+    返回:
+        list: (年, 月) 列表
+    """
+    first = start[0] * 12 + start[1] - 1
+    last = end[0] * 12 + end[1] - 1
+    return [(key // 12, key % 12 + 1) for key in range(first, last + 1)]
+
+def generate_reports(df, periods, model, cache=None, llm_concurrency=4, output_dir='cost_report'):
+    """
+    批量生成多个月份的报告
+
+    数据只加载并索引一次，模型请求在限定并发数的线程池中同时进行，
+    等待回复期间在当前线程中渲染图表（生成 HTML 片段开销很小，无需子进程），
+    每个月份的图表与模型回复都就绪后立即写出该月报告。
+    某个月份失败时记录错误并继续生成其余月份，最后列出失败的月份
+
+    参数:
+        df (DataFrame | CostCube): 数据
+        periods (list): (年, 月) 列表
+        model (str): 使用的模型
+        cache (ResponseCache): 可选的回复缓存
+        llm_concurrency (int): 同时进行的模型请求数
+        output_dir (str): 报告输出目录
+
+    返回:
+        dict: 以 (年, 月) 为键的结果字典；失败月份的结果中 report 为空字符串，error 为异常对象
+    """
+    cube = CC.get_cube(df)
+    agent = AT.AIUESAgent(model=model, cache=cache)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    prepared = {}
+    for year, month in periods:
+        item = prepare_report(cube, year, month)
+        if item['statistics'] is None:
+            results[(year, month)] = item
+            print(item['summary'])
+        else:
+            prepared[(year, month)] = item
+
+    def fail(period, error):
+        item = prepared[period]
+        results[period] = {
+            "summary": item['summary'],
+            "data": item['data'],
+            "statistics": item['statistics'],
+            "report": "",
+            "error": error
+        }
+        print(f"生成 {period[0]}年{period[1]}月消费报告失败: {error}")
+
+    with ThreadPoolExecutor(max_workers=llm_concurrency) as llm_pool:
+        llm_futures = {llm_pool.submit(agent.get_response, item['report_text'], REPORT_SYSTEM_PROMPT): period
+                       for period, item in prepared.items()}
+
+        images = {}
+        for period, item in prepared.items():
+            try:
+                images[period] = render_report_charts(item['chart_data'])
+            except Exception as e:
+                fail(period, e)
+
+        # 按模型回复完成的先后写出报告
+        for future in as_completed(llm_futures):
+            year, month = period = llm_futures[future]
+            if period not in images:
+                continue
+            try:
+                results[period] = finish_report(prepared[period], future.result(),
+                                                f"{output_dir}/{year}年{month}月消费报告.html", images[period])
+            except Exception as e:
+                fail(period, e)
+                continue
+            print(f"已生成 {year}年{month}月消费报告")
+
+    failed = [period for period in periods if 'error' in results.get(period, {})]
+    if failed:
+        print("以下月份生成失败: " + "、".join(f"{year}年{month}月" for year, month in failed))
+    return {period: results[period] for period in periods}
+
+def _report_custom_id(prepared, year, month, model):
+    # 提示词、系统提示词与模型不变时标识不变
+    digest = hashlib.sha256('\x00'.join([prepared['report_text'], REPORT_SYSTEM_PROMPT, model]).encode('utf-8'))
+    return f"report-{year}-{month:02d}-{digest.hexdigest()[:12]}"
+
+def export_report_batch(df, periods, path, model):
+    """
+    将多个月份的报告请求导出为批量任务的请求文件，不请求模型
+
+    参数:
+        df (DataFrame | CostCube): 数据
+        periods (list): (年, 月) 列表
+        path (str): 请求文件路径
+        model (str): 使用的模型
 
-    # 输入要查询的信息（）如下
-    target_year = int(input('请输入要查询的年份：'))
-    target_month = int(input('请输入要查询的月份：'))
-    MODEL = Env.DOUBAO
-    if input('是否使用推理模型？(y/n)') == 'y':
-        MODEL = Env.DOUBAO_THINK
+    返回:
+        int: 导出的请求数，没有数据的月份不导出
+    """
+    cube = CC.get_cube(df)
+    requests = []
+    for year, month in periods:
+        prepared = prepare_report(cube, year, month)
+        if prepared['statistics'] is not None:
+            requests.append(AT.batch_request(_report_custom_id(prepared, year, month, model), model,
+                                             prepared['report_text'], REPORT_SYSTEM_PROMPT))
+    return AT.write_batch_requests(requests, path)
+
+def ingest_report_batch(df, path, model, output_dir='cost_report'):
+    """
+    导入批量任务的结果文件，为每个月份渲染图表并写出报告
 
-    result = extract_monthly_expenses(df, target_year, target_month)
+    参数:
+        df (DataFrame | CostCube): 数据
+        path (str): 结果文件路径
+        model (str): 导出时使用的模型
+        output_dir (str): 报告输出目录
 
-    analyze_and_generate_report(df, target_year, target_month, MODEL)['report']
+    返回:
+        dict: 以 (年, 月) 为键的结果字典；数据已变化或请求失败的月份不在其中
+    """
+    cube = CC.get_cube(df)
+    replies, errors = AT.read_batch_results(path)
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    results = {}
+    for custom_id, reply in replies.items():
+        _, year, month, _ = custom_id.split('-')
+        year, month = int(year), int(month)
+        prepared = prepare_report(cube, year, month)
+        if prepared['statistics'] is None or _report_custom_id(prepared, year, month, model) != custom_id:
+            print(f"{year}年{month}月的数据已变化，跳过")
+            continue
+        images = render_report_charts(prepared['chart_data'])
+        results[(year, month)] = finish_report(prepared, reply, f"{output_dir}/{year}年{month}月消费报告.html", images)
+        print(f"已生成 {year}年{month}月消费报告")
+    for custom_id in errors:
+        print(f"请求失败: {custom_id}")
+    return results
+
+def _parse_period(text):
+    year, month = text.split('-')
+    return int(year), int(month)
 
+# %%
+# --------------------------
+# 使用示例
+# --------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='生成消费报告')
+    parser.add_argument('--start', type=_parse_period, help='批量生成的起始年月，如 2024-01')
+    parser.add_argument('--end', type=_parse_period, help='批量生成的结束年月，如 2024-12，默认与起始年月相同')
+    parser.add_argument('--year', type=int, help='批量生成一整年的报告')
+    parser.add_argument('--think', action='store_true', help='批量模式下使用推理模型')
+    parser.add_argument('--llm-concurrency', type=int, default=4, help='同时进行的模型请求数')
+    parser.add_argument('--export-batch', metavar='PATH', help='批量模式下只导出批量任务的请求文件，不请求模型')
+    parser.add_argument('--ingest-batch', metavar='PATH', help='导入批量任务的结果文件并写出报告')
+    parser.add_argument('--ledger', nargs='?', const=LS.LEDGER_PATH,
+                        help='使用只追加的账本，先导入 Excel 中新增的行，再只读取所查询的月份')
+    args = parser.parse_args()
 
+    # 示例调用
+    if args.ledger:
+        ledger = LS.LedgerStore(args.ledger)
+        print(f'从 {DATA_PATH} 导入新增记录 {ledger.import_excel(DATA_PATH)} 条')
+        df = None
+    else:
+        df = load_cost_data(DATA_PATH)
+
+    if args.ingest_batch:
+        # 导入批量任务的结果
+        MODEL = Env.DOUBAO_THINK if args.think else Env.DOUBAO
+        if df is None:
+            df = ledger.to_frame()
+        ingest_report_batch(df, args.ingest_batch, MODEL)
+    elif args.year or args.start:
+        # 批量生成
+        start = (args.year, 1) if args.year else args.start
+        end = (args.year, 12) if args.year else (args.end or args.start)
+        MODEL = Env.DOUBAO_THINK if args.think else Env.DOUBAO
+        if df is None:
+            df = ledger.range_rows(start, end)
+        if args.export_batch:
+            count = export_report_batch(df, month_range(start, end), args.export_batch, MODEL)
+            print(f'已导出 {count} 条请求: {args.export_batch}')
+        else:
+            generate_reports(df, month_range(start, end), MODEL, llm_concurrency=args.llm_concurrency)
+    else:
+        # 输入要查询的信息（）如下
+        target_year = int(input('请输入要查询的年份：'))
+        target_month = int(input('请输入要查询的月份：'))
+        MODEL = Env.DOUBAO
+        if input('是否使用推理模型？(y/n)') == 'y':
+            MODEL = Env.DOUBAO_THINK
+        if df is None:
+            df = ledger.month(target_year, target_month)
+
+        result = extract_monthly_expenses(df, target_year, target_month)
+
+        analyze_and_generate_report(df, target_year, target_month, MODEL)['report']
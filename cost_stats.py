@@ -0,0 +1,122 @@
+# %%
+# 导入第三方库
+import pandas as pd
+import cost_cube as CC
+
+# 参数设置
+STAT_NAMES = ['平均数','中位数','众数','最大值','最小值','方差','标准差']
+STAT_LABELS = {CC.EXPENSE_COLUMN: '消费金额', CC.INCOME_COLUMN: '收入金额'}
+
+# %%
+def _period_rows(cube, periods):
+    # 按年月索引取出各期的明细行，并标记所属期的序号
+    frames = [cube.month(year, month).assign(期=i) for i, (year, month) in enumerate(periods)]
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=list(cube.data.columns) + ['期'])
+    return pd.concat(frames, ignore_index=True)
+
+def _describe(rows, column, index):
+    # 一次分组聚合得到除众数外的全部统计量，众数由一次计数分组得到
+    # 方差等统计量按 float64 计算，避免 float32 累加误差；金额先还原到分，
+    # 否则 float32 存储的 8000.3 等金额在平方后会放大表示误差
+    grouped = rows[column].astype('float64').round(2).groupby(rows['期'])
+    described = grouped.agg(['mean', 'median', 'max', 'min', 'var', 'std'])
+    counts = rows.groupby(['期', column]).size().rename('次数').reset_index()
+    # 与 Series.mode().values[0] 一致：出现次数最多的值中取最小的一个
+    counts = counts.sort_values(['期', '次数', column], ascending=[True, False, True])
+    modes = counts.drop_duplicates('期').set_index('期')[column]
+    described.insert(2, 'mode', modes)
+    described.columns = STAT_NAMES
+    return described.reindex(range(len(index))).set_axis(index).astype(float).round(2)
+
+def _shares(amounts, totals):
+    # 各列金额占总额的百分比，总额不大于0时为0
+    safe = totals.where(totals > 0)
+    return amounts.astype('float64').div(safe, axis=0).mul(100).round(2).fillna(0)
+
+def compute_statistics(df, periods):
+    '''
+    一次性计算多个年月的全部描述统计与分类占比，供图表、提示词与表格共用
+
+    参数:
+        df (DataFrame | CostCube): 数据
+        periods (list): (年, 月) 列表
+
+    返回:
+        dict: 包含以下 DataFrame 的字典，行索引均为 (年, 月)
+            'totals': 总支出、总收入、总净收入、天数及日均金额
+            'describe': 以 '消费金额'、'收入金额' 为键，各为七项描述统计（平均数、中位数、众数、最大值、最小值、方差、标准差）
+            'category_stats' / 'category_shares': 各消费分类的金额与占总支出的百分比
+            'income_stats' / 'income_shares': 各收入项的金额与占总收入的百分比
+    '''
+    cube = CC.get_cube(df)
+    periods = [tuple(period) for period in periods]
+    index = pd.MultiIndex.from_tuples(periods, names=['年', '月'])
+    monthly = cube.monthly.reindex(index)
+
+    # 1. 基础统计信息
+    days = monthly[CC.DAYS_COLUMN]
+    expense = monthly[CC.EXPENSE_COLUMN].round(2)
+    income = monthly[CC.INCOME_COLUMN].round(2)
+    benefit = (monthly[CC.INCOME_COLUMN] - monthly[CC.EXPENSE_COLUMN]).round(2)
+    totals = pd.DataFrame({
+        '总支出金额': expense,
+        '总收入金额': income,
+        '总净收入': benefit,
+        CC.DAYS_COLUMN: days,
+        '日均支出金额': (expense / days).round(2),
+        '日均收入金额': (income / days).round(2),
+        '日均净收入': (benefit / days).round(2)
+    }, index=index)
+
+    # 2. 分类统计
+    category_columns = [col for col in cube.category_columns if col in monthly.columns]
+    income_columns = [col for col in cube.income_columns if col in monthly.columns]
+    category_stats = monthly[category_columns]
+    income_stats = monthly[income_columns]
+
+    # 3. 每条记录的描述统计
+    rows = _period_rows(cube, periods)
+    describe = {STAT_LABELS[col]: _describe(rows, col, index)
+                for col in (CC.EXPENSE_COLUMN, CC.INCOME_COLUMN) if col in rows.columns}
+
+    return {
+        'totals': totals,
+        'describe': describe,
+        'category_stats': category_stats,
+        'category_shares': _shares(category_stats, expense),
+        'income_stats': income_stats,
+        'income_shares': _shares(income_stats, income)
+    }
+
+def describe_table(statistics, period):
+    '''
+    取出某个年月的描述统计表
+
+    参数:
+        statistics (dict): compute_statistics 的返回结果
+        period (tuple): (年, 月)
+
+    返回:
+        pd.DataFrame: 行为 '消费金额'、'收入金额'，列为七项描述统计
+    '''
+    return pd.DataFrame({label: table.loc[period] for label, table in statistics['describe'].items()}).T
+
+def compare_table(statistics, column='消费金额'):
+    '''
+    多个年月的描述统计并排对比
+
+    参数:
+        statistics (dict): compute_statistics 的返回结果
+        column (str): '消费金额' 或 '收入金额'
+
+    返回:
+        pd.DataFrame: 行为年月，列为总额、日均金额与七项描述统计
+    '''
+    totals = statistics['totals']
+    if column == '消费金额':
+        amounts = totals[['总支出金额', '日均支出金额']]
+    else:
+        amounts = totals[['总收入金额', '日均收入金额']]
+    return amounts.join(statistics['describe'][column])
@@ -0,0 +1,342 @@
+# dedup.py
+
+# 导入所需库
+import hashlib
+import pickle
+import re
+from pathlib import Path
+
+import numpy as np
+
+import operating_ebook as OE
+import scene_splitter as SS
+
+# 参数设置
+INDEX_PATH = Path('./cache/dedup_index.pkl') # 索引的保存路径
+_MASK32 = np.uint64(0xFFFFFFFF)
+_EMPTY = np.uint64(1 << 32) # 空文本的签名取值，大于任何32位哈希
+# 去掉空白与标点后再取片段，排版差异不影响相似度
+_NOISE = re.compile(r'[\W_]+')
+
+def shingle_hashes(text, shingle=5):
+    """
+    计算文本中全部长度为 shingle 的字符片段的32位哈希
+
+    Args:
+        text (str): 纯文本
+        shingle (int): 片段长度（字符数）
+
+    Returns:
+        np.ndarray: 去重后的哈希数组
+    """
+    text = _NOISE.sub('', text)
+    if not text:
+        return np.zeros(0, dtype=np.uint64)
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < shingle:
+        codes = np.pad(codes, (0, shingle - len(codes)))
+    # 多项式滚动哈希，按 2^64 取模，再混合高位得到32位哈希
+    windows = np.lib.stride_tricks.sliding_window_view(codes, shingle)
+    powers = np.uint64(1000003) ** np.arange(shingle - 1, -1, -1, dtype=np.uint64)
+    hashes = (windows * powers).sum(axis=1, dtype=np.uint64)
+    hashes = ((hashes * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)) & _MASK32
+    return np.unique(hashes)
+
+class _UnionFind:
+    def __init__(self, keys):
+        self.parent = {key: key for key in keys}
+
+    def find(self, key):
+        root = key
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[key] != root:
+            self.parent[key], key = root, self.parent[key]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            # 以较小的键为根，簇的代表即为最靠前的章节或场景
+            if b < a:
+                a, b = b, a
+            self.parent[b] = a
+
+# 近似重复检测索引
+class DedupIndex:
+    """
+    基于 MinHash 与 LSH 的近似重复索引
+
+    每个条目（章节或场景）取字符片段集合的 MinHash 签名，签名分成若干段放入哈希桶，
+    同一个桶里的条目才比较签名，估算的 Jaccard 相似度不低于阈值即视为近似重复；
+    条目可以单独增删，源内容哈希未变化的条目不会重新计算
+
+    Args:
+        num_perm (int): MinHash 签名长度
+        bands (int): LSH 分段数，num_perm 需能被整除；分段越多召回越高
+        shingle (int): 字符片段长度
+        threshold (float): 判定为近似重复的相似度下限
+        seed (int): 随机种子，相同种子的索引签名可以相互比较
+    """
+    def __init__(self, num_perm=128, bands=16, shingle=5, threshold=0.7, seed=1):
+        if num_perm % bands:
+            raise ValueError(f'num_perm={num_perm} 不能被 bands={bands} 整除')
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        self.threshold = threshold
+        self.seed = seed
+        # 乘法移位哈希族：(a * x + b) 按 2^64 取模后取高32位，a 为奇数
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self.signatures = {}
+        self.hashes = {}
+        self._buckets = [{} for _ in range(bands)]
+        self._clusters = None
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __contains__(self, key):
+        return key in self.signatures
+
+    def signature(self, text):
+        """
+        计算文本的 MinHash 签名
+
+        Args:
+            text (str): 纯文本
+
+        Returns:
+            np.ndarray: 长度为 num_perm 的签名
+        """
+        hashes = shingle_hashes(text, self.shingle)
+        if not len(hashes):
+            return np.full(self.num_perm, _EMPTY, dtype=np.uint64)
+        values = np.multiply(self._a[:, None], hashes[None, :])
+        values += self._b[:, None]
+        values >>= np.uint64(32)
+        return values.min(axis=1)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, text, source_hash=None):
+        """
+        加入或更新一个条目，源内容哈希未变化时直接返回
+
+        Args:
+            key: 条目的键，如章节序号或 (章节序号, 场景序号)
+            text (str): 纯文本
+            source_hash (str): 源内容的哈希，默认为纯文本的哈希
+
+        Returns:
+            bool: 是否重新计算了签名
+        """
+        if source_hash is None:
+            source_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        if self.hashes.get(key) == source_hash:
+            return False
+        self.remove(key)
+        signature = self.signature(text)
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            band.setdefault(band_key, set()).add(key)
+        self.signatures[key] = signature
+        self.hashes[key] = source_hash
+        self._clusters = None
+        return True
+
+    def remove(self, key):
+        """
+        删除一个条目，条目不存在时忽略
+
+        Args:
+            key: 条目的键
+        """
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        self.hashes.pop(key, None)
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            members = band.get(band_key)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del band[band_key]
+        self._clusters = None
+
+    def similarity(self, a, b):
+        """
+        估算两个条目的 Jaccard 相似度
+
+        Args:
+            a: 条目的键
+            b: 条目的键
+
+        Returns:
+            float: 签名中相同位置取值相同的比例
+        """
+        return float(np.mean(self.signatures[a] == self.signatures[b]))
+
+    def query(self, text=None, key=None):
+        """
+        查找与一段文本或一个已有条目近似重复的条目
+
+        Args:
+            text (str): 纯文本
+            key: 已有条目的键，给出时忽略 text
+
+        Returns:
+            list: (键, 相似度) 列表，按相似度从高到低排列
+        """
+        signature = self.signatures[key] if key is not None else self.signature(text)
+        candidates = set()
+        for band, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates |= band.get(band_key, set())
+        candidates.discard(key)
+        matches = [(other, float(np.mean(self.signatures[other] == signature))) for other in candidates]
+        matches = [(other, score) for other, score in matches if score >= self.threshold]
+        return sorted(matches, key=lambda item: -item[1])
+
+    def clusters(self):
+        """
+        将近似重复的条目聚成簇
+
+        Returns:
+            list: 簇列表，每个簇为按键排序的条目列表，只包含两个及以上条目的簇
+        """
+        if self._clusters is None:
+            union = _UnionFind(self.signatures)
+            for band in self._buckets:
+                for members in band.values():
+                    if len(members) < 2:
+                        continue
+                    members = sorted(members)
+                    for i, a in enumerate(members):
+                        for b in members[i + 1:]:
+                            if union.find(a) != union.find(b) and self.similarity(a, b) >= self.threshold:
+                                union.union(a, b)
+            groups = {}
+            for key in self.signatures:
+                groups.setdefault(union.find(key), []).append(key)
+            self._clusters = sorted((sorted(group) for group in groups.values() if len(group) > 1),
+                                    key=lambda group: group[0])
+        return self._clusters
+
+    def duplicates(self):
+        """
+        获取每个重复条目对应的代表条目（簇中最靠前的条目）
+
+        Returns:
+            dict: 以重复条目为键、代表条目为值的字典，代表条目本身不在其中
+        """
+        return {key: group[0] for group in self.clusters() for key in group[1:]}
+
+    def save(self, path=INDEX_PATH):
+        """
+        保存索引
+
+        Args:
+            path (Path): 保存路径
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        """
+        读取保存的索引
+
+        Args:
+            path (Path): 保存路径
+
+        Returns:
+            DedupIndex: 索引，文件不存在时返回 None
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+def _raw_hash(store, chapter_index):
+    # 直接对文档项中保存的原始字节取哈希：不经过 ChapterStore 的内容缓存，
+    # 也不调用 EpubHtml.get_content（它会用 lxml 重新解析并序列化整个章节）
+    return hashlib.sha256(store.items[chapter_index].content or b'').hexdigest()
+
+def index_book(index=None, ebook=None, level='chapter', start=0, stop=None, volume=None):
+    """
+    用电子书的章节或场景建立或增量更新索引，源内容未变化的章节不会重新读取文本
+
+    Args:
+        index (DedupIndex): 已有的索引，默认新建
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书
+        level (str): 'chapter' 以章节为条目，'scene' 以 (章节序号, 场景序号) 为条目
+        start (int): 起始章节序号
+        stop (int): 结束章节序号（不包含）
+        volume (int): 卷序号，给出时忽略 start 与 stop
+
+    Returns:
+        DedupIndex: 更新后的索引
+    """
+    if level not in ('chapter', 'scene'):
+        raise ValueError(f'未知的条目级别: {level}')
+    index = index if index is not None else DedupIndex()
+    store = OE.get_store(ebook)
+    total = len(store)
+    if volume is not None:
+        start, stop = OE.get_volume_range(volume, total)
+    start, stop, _ = slice(start, stop).indices(total)
+
+    # 电子书中已不存在的章节从索引中删除；场景条目按章节分组，之后每章只查看自己的场景
+    scene_keys = {}
+    for key in list(index.signatures):
+        chapter_index = key[0] if isinstance(key, tuple) else key
+        if chapter_index >= total:
+            index.remove(key)
+        elif isinstance(key, tuple):
+            scene_keys.setdefault(chapter_index, []).append(key)
+
+    for chapter_index in range(start, stop):
+        raw_hash = _raw_hash(store, chapter_index)
+        if level == 'chapter':
+            if index.hashes.get(chapter_index) == raw_hash:
+                continue
+            text = store.chapter_info(chapter_index, fields=('content',), as_text=True, cache=False)['content']
+            index.add(chapter_index, text, raw_hash)
+            continue
+
+        # 场景级别：章节未变化时跳过，变化时替换该章节的全部场景
+        existing = scene_keys.get(chapter_index, [])
+        if existing and all(index.hashes[key].startswith(raw_hash) for key in existing):
+            continue
+        for key in existing:
+            index.remove(key)
+        text = store.chapter_info(chapter_index, fields=('content',), as_text=True, cache=False)['content']
+        for scene_index, scene in enumerate(SS.split_scenes(text)):
+            index.add((chapter_index, scene_index), '\n'.join(scene), f'{raw_hash}:{scene_index}')
+    return index
+
+def report(index):
+    """
+    打印近似重复的簇
+
+    Args:
+        index (DedupIndex): 索引
+    """
+    for group in index.clusters():
+        names = [f'第{key[0]}章场景{key[1]}' if isinstance(key, tuple) else f'第{key}章' for key in group]
+        print(f"保留 {names[0]}，可删去：{'、'.join(names[1:])}")
+
+# 示例使用
+if __name__ == "__main__":
+    # 增量更新章节级索引，打印近似重复的章节
+    # index = index_book(DedupIndex.load())
+    # index.save()
+    # report(index)
+
+    pass
@@ -0,0 +1,653 @@
+# entity_index.py
+
+# 导入所需库
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import AIUESAGENT as AT
+import operating_ebook as OE
+import scene_splitter as SS
+from rewrite_pipeline import content_hash, parse_image_prompts
+
+# 参数设置
+INDEX_PATH = Path('./cache/entity_index.pkl') # 索引的保存路径
+PROFILE_PATH = Path('./cache/entity_profiles.sqlite') # 人物档案的保存路径
+ROLE_FIELDS = ('gender', 'identity', 'ps_feature', 'clothing', 'act_an_exprs') # 人物形象 role_style 的各项
+SCENE_FIELDS = ('envir', 'role_number', 'LSandP', 'complete_style') # 图片风格 photo_style，不含画师风格
+PLACE_FIELDS = ('envir', 'LSandP', 'complete_style') # 随地点沿用的图片风格各项，角色数量按场景统计
+
+PROFILE_PROMPT = '''你是一名插画师助手，下面给出若干角色与地点“已有的档案”和小说中提到它们的“新段落”，请根据新段落补充或修改档案，以JSON格式输出：
+{"roles": [{"name": 角色名, "gender": 性别, "identity": 角色身份与性质, "ps_feature": 身体特征, "clothing": 服装与配饰, "act_an_exprs": 动作与表情}],
+ "places": [{"name": 地点名, "envir": 环境场景, "LSandP": 光影与视角, "complete_style": 整体风格}]}
+新段落中没有提到的项保持原样，只输出JSON，不要添加任何说明。'''
+
+# 多模式匹配
+class Automaton:
+    """
+    Aho-Corasick 自动机，一次扫描文本即可找出名称词典中全部名称的出现位置
+
+    Args:
+        patterns (dict): 以待匹配的字符串为键、匹配结果为值的字典
+    """
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None] # 以该状态结尾的最长模式 (长度, 值)
+        self._link = [0] # 沿失败链接最近的有输出的状态
+        for pattern, value in patterns.items():
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(None)
+                    self._link.append(0)
+                state = nxt
+            self._output[state] = (len(pattern), value)
+
+        # 按广度优先顺序建立失败链接
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                target = self._fail[nxt]
+                self._link[nxt] = target if self._output[target] is not None else self._link[target]
+
+    def iter(self, text):
+        """
+        找出全部（可能重叠的）匹配
+
+        Args:
+            text (str): 纯文本
+
+        Returns:
+            generator: 逐个返回 (起始位置, 结束位置, 值)
+        """
+        goto, fail, output, link = self._goto, self._fail, self._output, self._link
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            match = state if output[state] is not None else link[state]
+            while match:
+                length, value = output[match]
+                yield end - length, end, value
+                match = link[match]
+
+    def find(self, text):
+        """
+        找出互不重叠的匹配，重叠时优先取靠前且较长的名称
+
+        Args:
+            text (str): 纯文本
+
+        Returns:
+            list: (起始位置, 结束位置, 值) 列表
+        """
+        matches = sorted(self.iter(text), key=lambda match: (match[0], match[0] - match[1]))
+        selected = []
+        covered = 0
+        for start, end, value in matches:
+            if start >= covered:
+                selected.append((start, end, value))
+                covered = end
+        return selected
+
+def load_names(path):
+    """
+    读取名称词典
+
+    Args:
+        path (Path): JSON 文件路径，内容形如 {"角色名": ["别名1", "别名2"]}
+
+    Returns:
+        dict: 以角色名为键、别名列表为值的字典
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return {name: list(aliases) for name, aliases in json.load(f).items()}
+
+def names_from_journal(journal):
+    """
+    从重构流水线的插图信息提取结果中收集角色名，作为名称词典的初稿
+
+    Args:
+        journal (Journal): 重构流水线的任务日志
+
+    Returns:
+        dict: 以角色名为键、空别名列表为值的字典
+    """
+    names = {}
+    for output in journal.completed('image_prompts').values():
+        for role in output.get('roles', []) if isinstance(output, dict) else []:
+            name = role.get('name') if isinstance(role, dict) else None
+            if isinstance(name, str) and name.strip():
+                names.setdefault(name.strip(), [])
+    return names
+
+# 人物与场景倒排索引
+class EntityIndex:
+    """
+    从角色名、地点名及其别名到章节、段落位置的倒排索引，并记录每个场景出现的角色与地点
+
+    用名称词典建立 Aho-Corasick 自动机，每个章节只扫描一遍；章节按原始内容哈希增量更新，
+    名称词典变化时全部章节重新扫描。场景按场景分隔行划分，场景的图片风格 photo_style
+    可以由所含地点的档案与角色数得到，不必为每个场景重新发送整段描写
+
+    Args:
+        names (dict): 以角色名为键、别名列表为值的字典
+        places (dict): 以地点名为键、别名列表为值的字典
+    """
+    def __init__(self, names=None, places=None):
+        self.names = {}
+        self.places = {}
+        self.kinds = {} # 名称 → 'role' 或 'place'
+        self.chapters = {} # 章节序号 → {名称: [段落序号]}
+        self.postings = {} # 名称 → {章节序号: [段落序号]}
+        self.scenes = {} # 章节序号 → [{'paragraphs': (起始, 结束), 'roles': [...], 'places': [...]}]
+        self.hashes = {}
+        self._aliases = {}
+        self._automaton = None
+        self.set_names(names or {}, places or {})
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_automaton'] = None
+        return state
+
+    def set_names(self, names, places=None):
+        """
+        更换名称词典，词典有变化时清空索引，之后的 index_book 重新扫描全部章节
+
+        Args:
+            names (dict): 以角色名为键、别名列表为值的字典
+            places (dict): 以地点名为键、别名列表为值的字典，为 None 时保持不变
+
+        Returns:
+            bool: 词典是否有变化
+        """
+        names = {name: list(aliases) for name, aliases in names.items()}
+        places = self.places if places is None else {name: list(aliases) for name, aliases in places.items()}
+        if names == self.names and places == self.places:
+            return False
+        self.names, self.places = names, places
+        self.chapters, self.postings, self.scenes, self.hashes = {}, {}, {}, {}
+        self.kinds = {**{name: 'place' for name in places}, **{name: 'role' for name in names}}
+        self._aliases = {}
+        for kind_names in (names, places):
+            for name, aliases in kind_names.items():
+                for alias in [name] + aliases:
+                    self._aliases.setdefault(alias, name)
+        self._automaton = None
+        return True
+
+    @property
+    def automaton(self):
+        """由名称词典建立的自动机，第一次用到时才建立"""
+        if self._automaton is None:
+            self._automaton = Automaton(self._aliases)
+        return self._automaton
+
+    def canonical(self, alias, kind=None):
+        """
+        将别名转换为角色名或地点名
+
+        Args:
+            alias (str): 名称或别名
+            kind (str): 'role' 或 'place'，给出时只接受该类名称
+
+        Returns:
+            str: 名称，不在词典中（或类别不符）时返回 None
+        """
+        name = self._aliases.get(alias)
+        if name is not None and kind is not None and self.kinds.get(name) != kind:
+            return None
+        return name
+
+    def scan(self, text):
+        """
+        扫描一个章节的纯文本
+
+        Args:
+            text (str): 纯文本，每个段落占一行
+
+        Returns:
+            dict: 以角色名或地点名为键、出现的段落序号列表为值的字典
+        """
+        found = {}
+        for paragraph_index, paragraph in enumerate(text.splitlines()):
+            for name in {value for _, _, value in self.automaton.find(paragraph)}:
+                found.setdefault(name, []).append(paragraph_index)
+        return found
+
+    def add(self, chapter_index, text, source_hash=None):
+        """
+        加入或更新一个章节，源内容哈希未变化时直接返回
+
+        Args:
+            chapter_index (int): 章节序号
+            text (str): 纯文本，每个段落占一行
+            source_hash (str): 源内容的哈希，默认为纯文本的哈希
+
+        Returns:
+            bool: 是否重新扫描了章节
+        """
+        if source_hash is None:
+            source_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        if self.hashes.get(chapter_index) == source_hash:
+            return False
+        self.remove(chapter_index)
+        found = self.scan(text)
+        self.chapters[chapter_index] = found
+        for name, paragraphs in found.items():
+            self.postings.setdefault(name, {})[chapter_index] = paragraphs
+        scenes = []
+        for start, stop in SS.scene_ranges(text):
+            present = sorted(name for name, paragraphs in found.items()
+                             if any(start <= paragraph_index < stop for paragraph_index in paragraphs))
+            scenes.append({'paragraphs': (start, stop),
+                           'roles': [name for name in present if self.kinds[name] == 'role'],
+                           'places': [name for name in present if self.kinds[name] == 'place']})
+        self.scenes[chapter_index] = scenes
+        self.hashes[chapter_index] = source_hash
+        return True
+
+    def remove(self, chapter_index):
+        """
+        删除一个章节，章节不存在时忽略
+
+        Args:
+            chapter_index (int): 章节序号
+        """
+        found = self.chapters.pop(chapter_index, None)
+        self.scenes.pop(chapter_index, None)
+        self.hashes.pop(chapter_index, None)
+        for name in found or ():
+            chapters = self.postings.get(name)
+            if chapters is not None:
+                chapters.pop(chapter_index, None)
+                if not chapters:
+                    del self.postings[name]
+
+    def locations(self, name):
+        """
+        获取角色或地点出现的全部位置
+
+        Args:
+            name (str): 名称或别名
+
+        Returns:
+            list: 按顺序排列的 (章节序号, 段落序号) 列表
+        """
+        chapters = self.postings.get(self.canonical(name), {})
+        return [(chapter_index, paragraph_index) for chapter_index in sorted(chapters)
+                for paragraph_index in chapters[chapter_index]]
+
+    def first_chapter(self, name):
+        """
+        Args:
+            name (str): 名称或别名
+
+        Returns:
+            int: 角色或地点首次出现的章节序号，没有出现时返回 None
+        """
+        chapters = self.postings.get(self.canonical(name))
+        return min(chapters) if chapters else None
+
+    def scenes_with(self, name):
+        """
+        获取出现某个角色或地点的全部场景
+
+        Args:
+            name (str): 名称或别名
+
+        Returns:
+            list: 按顺序排列的 (章节序号, 场景序号) 列表
+        """
+        name = self.canonical(name)
+        key = 'places' if self.kinds.get(name) == 'place' else 'roles'
+        return [(chapter_index, scene_index) for chapter_index in sorted(self.postings.get(name, {}))
+                for scene_index, scene in enumerate(self.scenes.get(chapter_index, []))
+                if name in scene[key]]
+
+    def save(self, path=INDEX_PATH):
+        """
+        保存索引
+
+        Args:
+            path (Path): 保存路径
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        """
+        读取保存的索引
+
+        Args:
+            path (Path): 保存路径
+
+        Returns:
+            EntityIndex: 索引，文件不存在时返回 None
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+def index_book(index, ebook=None, start=0, stop=None, volume=None):
+    """
+    用电子书的章节建立或增量更新索引，源内容未变化的章节不会重新读取文本
+
+    Args:
+        index (EntityIndex): 索引
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书
+        start (int): 起始章节序号
+        stop (int): 结束章节序号（不包含）
+        volume (int): 卷序号，给出时忽略 start 与 stop
+
+    Returns:
+        EntityIndex: 更新后的索引
+    """
+    store = OE.get_store(ebook)
+    total = len(store)
+    if volume is not None:
+        start, stop = OE.get_volume_range(volume, total)
+    start, stop, _ = slice(start, stop).indices(total)
+
+    for chapter_index in [key for key in index.chapters if key >= total]:
+        index.remove(chapter_index)
+    for chapter_index in range(start, stop):
+        # 直接对文档项中保存的原始字节取哈希：不经过内容缓存，建立全书索引时不会缓存全部章节，
+        # 也不调用 EpubHtml.get_content 重新解析未变化的章节
+        raw_hash = hashlib.sha256(store.items[chapter_index].content or b'').hexdigest()
+        if index.hashes.get(chapter_index) == raw_hash:
+            continue
+        text = store.chapter_info(chapter_index, fields=('content',), as_text=True, cache=False)['content']
+        index.add(chapter_index, text, raw_hash)
+    return index
+
+# 版本化的人物档案
+class ProfileStore:
+    """
+    每个角色合并后的档案，每次内容变化都保存为一个新版本
+
+    Args:
+        path (Path): 档案数据库路径
+    """
+    def __init__(self, path=PROFILE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS profiles ('
+            'name TEXT NOT NULL, version INTEGER NOT NULL, chapter INTEGER, attributes TEXT NOT NULL, '
+            'created REAL NOT NULL, PRIMARY KEY (name, version))'
+        )
+        # 已提取过的章节及其输入哈希，输入未变化时不再请求模型
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS extractions ('
+            'chapter INTEGER PRIMARY KEY, input_hash TEXT NOT NULL, finished REAL NOT NULL)'
+        )
+
+    def get(self, name, version=None):
+        """
+        读取角色档案
+
+        Args:
+            name (str): 角色名
+            version (int): 版本号，默认为最新版本
+
+        Returns:
+            dict: 档案各项，没有档案时返回空字典
+        """
+        with self._lock:
+            if version is None:
+                row = self._conn.execute('SELECT attributes FROM profiles WHERE name = ? ORDER BY version DESC LIMIT 1',
+                                         (name,)).fetchone()
+            else:
+                row = self._conn.execute('SELECT attributes FROM profiles WHERE name = ? AND version = ?',
+                                         (name, version)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def history(self, name):
+        """
+        读取角色档案的全部版本
+
+        Args:
+            name (str): 角色名
+
+        Returns:
+            list: 按版本排列的字典，包含 'version'、'chapter'（来源章节）与 'attributes'
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT version, chapter, attributes FROM profiles WHERE name = ? ORDER BY version',
+                                      (name,)).fetchall()
+        return [{'version': version, 'chapter': chapter, 'attributes': json.loads(attributes)}
+                for version, chapter, attributes in rows]
+
+    def names(self):
+        """
+        Returns:
+            list: 已有档案的角色名
+        """
+        with self._lock:
+            return [name for (name,) in self._conn.execute('SELECT DISTINCT name FROM profiles ORDER BY name')]
+
+    def merge(self, name, attributes, chapter_index=None):
+        """
+        将新提取的各项合并进档案，空值不覆盖已有内容；内容有变化时保存为新版本
+
+        Args:
+            name (str): 角色名
+            attributes (dict): 新提取的档案各项
+            chapter_index (int): 来源章节序号
+
+        Returns:
+            int: 合并后的版本号，内容未变化时为原版本号，没有任何内容时为 0
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT version, attributes FROM profiles WHERE name = ? ORDER BY version DESC LIMIT 1',
+                                     (name,)).fetchone()
+            version, current = (row[0], json.loads(row[1])) if row else (0, {})
+            merged = dict(current)
+            merged.update({key: value for key, value in attributes.items() if value not in (None, '', [], {})})
+            if merged == current:
+                return version
+            self._conn.execute('INSERT INTO profiles (name, version, chapter, attributes, created) VALUES (?, ?, ?, ?, ?)',
+                               (name, version + 1, chapter_index, json.dumps(merged, ensure_ascii=False), time.time()))
+            return version + 1
+
+    def extracted(self, chapter_index):
+        """
+        Args:
+            chapter_index (int): 章节序号
+
+        Returns:
+            str: 该章节上次提取时的输入哈希，没有提取过时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT input_hash FROM extractions WHERE chapter = ?', (chapter_index,)).fetchone()
+        return row[0] if row else None
+
+    def mark_extracted(self, chapter_index, input_hash):
+        """
+        记录章节已提取
+
+        Args:
+            chapter_index (int): 章节序号
+            input_hash (str): 本次提取的输入哈希
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO extractions (chapter, input_hash, finished) VALUES (?, ?, ?)',
+                               (chapter_index, input_hash, time.time()))
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
+
+# 人物与地点档案提取
+class ProfileExtractor:
+    """
+    按章节顺序更新人物与地点档案：提示词只包含本章提到这些名称的段落与已有档案，而不是整章正文
+
+    Args:
+        index (EntityIndex): 人物倒排索引
+        profiles (ProfileStore): 人物档案
+        agent (AsyncAIUESAgent): 请求模型的异步智能体
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书
+        max_tokens (int): 每次请求的最大生成长度
+    """
+    def __init__(self, index, profiles=None, agent=None, ebook=None, max_tokens=2048):
+        self.index = index
+        self.profiles = profiles if profiles is not None else ProfileStore()
+        self.agent = agent if agent is not None else AT.AsyncAIUESAgent()
+        self.store = OE.get_store(ebook)
+        self.max_tokens = max_tokens
+
+    def relevant_paragraphs(self, chapter_index):
+        """
+        取出章节中提到词典内角色或地点的段落
+
+        Args:
+            chapter_index (int): 章节序号
+
+        Returns:
+            tuple: (按名称排序的角色名与地点名列表, 拼接后的段落)，本章没有提到任何名称时为 ([], '')
+        """
+        found = self.index.chapters.get(chapter_index)
+        if not found:
+            return [], ''
+        paragraphs = self.store.chapter_info(chapter_index, fields=('content',), as_text=True, cache=False)['content'].splitlines()
+        selected = sorted({paragraph_index for indices in found.values() for paragraph_index in indices})
+        return sorted(found), '\n'.join(paragraphs[i] for i in selected if i < len(paragraphs))
+
+    def build_prompt(self, names, paragraphs):
+        """
+        组装提取提示词：角色与地点的已有档案与新段落
+
+        Args:
+            names (list): 角色名与地点名列表
+            paragraphs (str): 提到这些角色的段落
+
+        Returns:
+            str: 提示词
+        """
+        profiles = {name: self.profiles.get(name) for name in names}
+        return f"已有的档案：\n{json.dumps(profiles, ensure_ascii=False)}\n\n新段落：\n{paragraphs}"
+
+    async def extract(self, chapter_index):
+        """
+        更新一个章节提到的角色与地点的档案，输入未变化时直接返回
+
+        Args:
+            chapter_index (int): 章节序号
+
+        Returns:
+            dict: 以名称为键、合并后版本号为值的字典，跳过时为空字典
+        """
+        names, paragraphs = self.relevant_paragraphs(chapter_index)
+        if not names:
+            return {}
+        # 输入哈希不含档案本身，档案因本章而更新后不会再次提取
+        input_hash = content_hash(json.dumps(names, ensure_ascii=False), paragraphs, PROFILE_PROMPT, self.agent.model)
+        if self.profiles.extracted(chapter_index) == input_hash:
+            return {}
+        prompt = self.build_prompt(names, paragraphs)
+        reply = parse_image_prompts(await self.agent.get_response(prompt, PROFILE_PROMPT, max_tokens=self.max_tokens))
+        versions = {}
+        for key, kind, fields in (('roles', 'role', ROLE_FIELDS), ('places', 'place', PLACE_FIELDS)):
+            # 模型可能返回列表、null 等不符合格式的内容，只接受对象列表
+            entries = reply.get(key) if isinstance(reply, dict) else None
+            for entry in entries if isinstance(entries, list) else []:
+                if not isinstance(entry, dict):
+                    continue
+                name = self.index.canonical(str(entry.get('name') or '').strip(), kind)
+                if name is None:
+                    continue
+                versions[name] = self.profiles.merge(name, {field: entry.get(field) for field in fields}, chapter_index)
+        self.profiles.mark_extracted(chapter_index, input_hash)
+        return versions
+
+    def scene_style(self, chapter_index, scene_index):
+        """
+        由已有档案组装场景的插图信息：场景中角色的人物形象与地点的图片风格
+
+        Args:
+            chapter_index (int): 章节序号
+            scene_index (int): 场景序号
+
+        Returns:
+            dict: 'roles' 为含 'name' 与 ROLE_FIELDS 的字典列表，'photo_style' 为以 SCENE_FIELDS 为键的字典
+        """
+        scene = self.index.scenes[chapter_index][scene_index]
+        roles = [{'name': name, **self.profiles.get(name)} for name in scene['roles']]
+        photo_style = dict.fromkeys(SCENE_FIELDS, '')
+        for name in scene['places']:
+            profile = self.profiles.get(name)
+            for field in PLACE_FIELDS:
+                if profile.get(field) and not photo_style[field]:
+                    photo_style[field] = profile[field]
+        photo_style['role_number'] = len(roles)
+        return {'roles': roles, 'photo_style': photo_style}
+
+    async def run_async(self, start=0, stop=None, volume=None):
+        """
+        依次更新章节范围内的人物档案，后面章节的提示词依赖前面章节合并后的档案
+
+        Args:
+            start (int): 起始章节序号
+            stop (int): 结束章节序号（不包含）
+            volume (int): 卷序号，给出时忽略 start 与 stop
+
+        Returns:
+            dict: 以章节序号为键、extract 结果为值的字典
+        """
+        total = len(self.store)
+        if volume is not None:
+            start, stop = OE.get_volume_range(volume, total)
+        results = {}
+        for chapter_index in range(*slice(start, stop).indices(total)):
+            results[chapter_index] = await self.extract(chapter_index)
+        return results
+
+    def run(self, start=0, stop=None, volume=None):
+        """
+        run_async 的同步入口，参数相同
+        """
+        return AT.run(self.run_async(start, stop, volume))
+
+# 示例使用
+if __name__ == "__main__":
+    # 用名称词典增量更新倒排索引，再按章节顺序更新人物与地点档案
+    # index = EntityIndex.load() or EntityIndex()
+    # index.set_names(load_names('./data/names.json'), load_names('./data/places.json'))
+    # index = index_book(index)
+    # index.save()
+    # extractor = ProfileExtractor(index)
+    # extractor.run(volume=2)
+    # print(extractor.scene_style(12, 0))
+
+    pass
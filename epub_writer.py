@@ -0,0 +1,369 @@
+# epub_writer.py
+
+# 导入所需库
+import html
+import mimetypes
+import posixpath
+import re
+import shutil
+import time
+import uuid
+import zipfile
+from pathlib import Path
+
+from lxml import etree
+
+import Env
+import operating_ebook as OE
+
+# 参数设置
+CHUNK_SIZE = 1 << 20 # 从磁盘复制文件时每次读取的字节数
+OPF_DIR = 'EPUB'
+_OPF_NS = 'http://www.idpf.org/2007/opf'
+_DC_NS = 'http://purl.org/dc/elements/1.1/'
+_NCX_NS = 'http://www.daisy.org/z3986/2005/ncx/'
+_HEADING = re.compile(r'<(h[1-3]|title)\b[^>]*>(.*?)</\1>', re.S | re.I)
+_TAG = re.compile(r'<[^>]+>')
+# 由写入器生成、不从源电子书复制的文件
+_GENERATED = ('mimetype', 'META-INF/container.xml')
+
+def volume_level(chapter_index):
+    """
+    根据 Env.LT_VOLUME_IDX 获取章节在目录中的级别
+
+    Args:
+        chapter_index (int): 章节序号
+
+    Returns:
+        int: 卷名章节为 0，卷内的章节为 1
+    """
+    volumes = {int(i) for i in Env.LT_VOLUME_IDX if i >= 0}
+    if chapter_index in volumes or chapter_index < min(volumes, default=0):
+        return 0
+    return 1
+
+def heading_of(content):
+    """
+    取出章节内容中的第一个标题
+
+    Args:
+        content (str | bytes): 章节内容（HTML格式）
+
+    Returns:
+        str: 标题文字，没有标题时返回 None
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+    for match in _HEADING.finditer(content):
+        title = html.unescape(_TAG.sub('', match.group(2))).strip()
+        if title:
+            return title
+    return None
+
+def _xhtml(title, body):
+    # 将章节正文片段包装为完整的XHTML文档
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+            f'<head><title>{html.escape(title or "")}</title></head>\n<body>{body}</body>\n</html>\n')
+
+# 流式写出的电子书
+class StreamingEpubWriter:
+    """
+    逐个写出章节与资源文件的EPUB写入器
+
+    每个章节与图片在加入时立即写入压缩包，图片从磁盘按块读取；清单、书脊与目录只记录文件名等少量信息，
+    在 close 时写出，因此内存占用与章节和图片的数量无关
+
+    Args:
+        path (Path): 输出路径
+        title (str): 书名
+        language (str): 语言
+        identifier (str): 唯一标识，默认随机生成
+        creator (str): 作者
+    """
+    def __init__(self, path, title, language='zh', identifier=None, creator=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.title = title
+        self.language = language
+        self.identifier = identifier or f'urn:uuid:{uuid.uuid4()}'
+        self.creator = creator
+        self._manifest = [] # (ID, 文件名, 媒体类型, 属性)
+        self._spine = []
+        self._toc = [] # (标题, 文件名, 级别)
+        self._names = set()
+        self._nav_index = None
+        self._zip = zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED)
+        # mimetype 必须是第一个且不压缩的成员
+        self._zip.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        self._zip.writestr('META-INF/container.xml',
+                           '<?xml version="1.0" encoding="utf-8"?>\n'
+                           '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+                           f'<rootfiles><rootfile full-path="{OPF_DIR}/content.opf" '
+                           'media-type="application/oebps-package+xml"/></rootfiles></container>')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._zip.close()
+
+    def _member(self, file_name):
+        if file_name in self._names:
+            raise ValueError(f'文件已存在: {file_name}')
+        self._names.add(file_name)
+        return posixpath.join(OPF_DIR, file_name)
+
+    def _item_id(self):
+        return f'item_{len(self._manifest)}'
+
+    def add_chapter(self, file_name, content, title=None, level=1, item_id=None):
+        """
+        写入一个章节，并加入书脊；给出标题时加入目录
+
+        Args:
+            file_name (str): 章节文件名（相对于 OPF 文件）
+            content (str | bytes): 完整的XHTML文档，或只有正文的HTML片段
+            title (str): 目录中的标题
+            level (int): 目录级别，0 为卷，1 为卷内的章节
+            item_id (str): 清单中的ID，默认自动生成
+
+        Returns:
+            str: 清单中的ID
+        """
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        if '<html' not in content[:1024].lower():
+            content = _xhtml(title, content)
+        item_id = item_id or self._item_id()
+        self._zip.writestr(self._member(file_name), content)
+        self._manifest.append((item_id, file_name, 'application/xhtml+xml', None))
+        self._spine.append(item_id)
+        if title:
+            self._toc.append((title, file_name, level))
+        return item_id
+
+    def add_file(self, file_name, source, media_type=None, item_id=None):
+        """
+        写入一个资源文件（图片、样式表、字体等）
+
+        Args:
+            file_name (str): 文件名（相对于 OPF 文件）
+            source (Path | bytes | file): 磁盘路径时按块读取，也可以是字节或已打开的二进制文件
+            media_type (str): 媒体类型，默认按扩展名推断
+            item_id (str): 清单中的ID，默认自动生成
+
+        Returns:
+            str: 清单中的ID
+        """
+        media_type = media_type or mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        item_id = item_id or self._item_id()
+        member = self._member(file_name)
+        if isinstance(source, (bytes, bytearray)):
+            self._zip.writestr(member, source)
+        elif isinstance(source, (str, Path)):
+            with open(source, 'rb') as src, self._zip.open(member, 'w') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        else:
+            with self._zip.open(member, 'w') as dst:
+                shutil.copyfileobj(source, dst, CHUNK_SIZE)
+        self._manifest.append((item_id, file_name, media_type, None))
+        return item_id
+
+    def add_nav(self, file_name='nav.xhtml', item_id='nav'):
+        """
+        在清单的当前位置预留目录页，目录页的内容在 close 时写出；不调用时目录页排在清单最后
+
+        Args:
+            file_name (str): 目录页文件名（相对于 OPF 文件）
+            item_id (str): 清单中的ID
+
+        Returns:
+            str: 清单中的ID
+        """
+        if self._nav_index is not None:
+            raise ValueError('目录页已存在')
+        self._names.add(file_name)
+        self._nav_index = len(self._manifest)
+        self._manifest.append((item_id, file_name, 'application/xhtml+xml', 'nav'))
+        return item_id
+
+    def _toc_tree(self):
+        # 按级别将目录项组织为树，每个节点为 (标题, 文件名, 子节点列表)
+        roots = []
+        stack = [roots]
+        for title, file_name, level in self._toc:
+            level = max(0, min(level, len(stack) - 1))
+            del stack[level + 1:]
+            node = (title, file_name, [])
+            stack[level].append(node)
+            stack.append(node[2])
+        return roots
+
+    def _nav(self):
+        # EPUB3 目录：按级别嵌套的有序列表
+        def render(nodes):
+            return '<ol>' + ''.join(f'<li><a href="{html.escape(file_name)}">{html.escape(title)}</a>'
+                                    f'{render(children) if children else ""}</li>'
+                                    for title, file_name, children in nodes) + '</ol>'
+        return _xhtml(self.title, f'<nav epub:type="toc" id="toc"><h1>目录</h1>{render(self._toc_tree())}</nav>')
+
+    def _ncx(self):
+        # EPUB2 目录，兼容旧的阅读器
+        def tag(name):
+            return f'{{{_NCX_NS}}}{name}'
+        root = etree.Element(tag('ncx'), nsmap={None: _NCX_NS}, version='2005-1')
+        head = etree.SubElement(root, tag('head'))
+        etree.SubElement(head, tag('meta'), name='dtb:uid', content=self.identifier)
+        etree.SubElement(etree.SubElement(root, tag('docTitle')), tag('text')).text = self.title
+        order = 0
+
+        def render(parent, nodes):
+            nonlocal order
+            for title, file_name, children in nodes:
+                order += 1
+                point = etree.SubElement(parent, tag('navPoint'), id=f'nav_{order}', playOrder=str(order))
+                etree.SubElement(etree.SubElement(point, tag('navLabel')), tag('text')).text = title
+                etree.SubElement(point, tag('content'), src=file_name)
+                render(point, children)
+        render(etree.SubElement(root, tag('navMap')), self._toc_tree())
+        return etree.tostring(root, xml_declaration=True, encoding='utf-8')
+
+    def _opf(self):
+        root = etree.Element(f'{{{_OPF_NS}}}package', nsmap={None: _OPF_NS}, version='3.0',
+                             attrib={'unique-identifier': 'bookid'})
+        metadata = etree.SubElement(root, f'{{{_OPF_NS}}}metadata', nsmap={'dc': _DC_NS})
+        etree.SubElement(metadata, f'{{{_DC_NS}}}identifier', id='bookid').text = self.identifier
+        etree.SubElement(metadata, f'{{{_DC_NS}}}title').text = self.title
+        etree.SubElement(metadata, f'{{{_DC_NS}}}language').text = self.language
+        if self.creator:
+            etree.SubElement(metadata, f'{{{_DC_NS}}}creator').text = self.creator
+        etree.SubElement(metadata, f'{{{_OPF_NS}}}meta', property='dcterms:modified').text = \
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        manifest = etree.SubElement(root, f'{{{_OPF_NS}}}manifest')
+        for item_id, file_name, media_type, properties in self._manifest:
+            attrib = {'id': item_id, 'href': file_name, 'media-type': media_type}
+            if properties:
+                attrib['properties'] = properties
+            etree.SubElement(manifest, f'{{{_OPF_NS}}}item', attrib=attrib)
+        spine = etree.SubElement(root, f'{{{_OPF_NS}}}spine', toc='ncx')
+        for item_id in self._spine:
+            etree.SubElement(spine, f'{{{_OPF_NS}}}itemref', idref=item_id)
+        return etree.tostring(root, xml_declaration=True, encoding='utf-8', pretty_print=True)
+
+    def close(self):
+        """
+        写出目录与清单，并关闭压缩包
+
+        Returns:
+            Path: 输出路径
+        """
+        if self._nav_index is None:
+            self.add_nav()
+        nav_file = self._manifest[self._nav_index][1]
+        self._zip.writestr(posixpath.join(OPF_DIR, nav_file), self._nav())
+        self._zip.writestr(self._member('toc.ncx'), self._ncx())
+        self._manifest.append(('ncx', 'toc.ncx', 'application/x-dtbncx+xml', None))
+        self._zip.writestr(posixpath.join(OPF_DIR, 'content.opf'), self._opf())
+        self._zip.close()
+        return self.path
+
+def _read_package(source):
+    # 读取源电子书 OPF 的书名、语言与清单，清单中的 href 转换为压缩包内的路径
+    opf_path = OE._opf_path(source)
+    opf_dir = posixpath.dirname(opf_path)
+    root = etree.fromstring(source.read(opf_path))
+    title = root.findtext('.//{*}title') or ''
+    language = root.findtext('.//{*}language') or 'zh'
+    items = []
+    for element in root.find('{*}manifest'):
+        href = element.get('href')
+        items.append({
+            'id': element.get('id'),
+            'href': href,
+            'member': posixpath.normpath(posixpath.join(opf_dir, href)),
+            'media_type': element.get('media-type', ''),
+            'properties': element.get('properties', '') or ''
+        })
+    return opf_path, title, language, items
+
+def write_book(output_path, ebook=None, overrides=None, images=None, title=None):
+    """
+    以流式方式写出整本电子书：章节逐个从源压缩包读取或取自 overrides，资源文件与插图按块复制
+
+    章节序号与 ChapterStore 一致（清单中的全部XHTML文档依次编号，目录页也占一个序号），
+    目录页由写入器重新生成并保留在清单中原来的位置，因此写出的电子书章节序号不变；文件名不变，原有的插图链接仍然有效；
+    目录按 Env.LT_VOLUME_IDX 分为卷与卷内章节两级。仓库中已修改但未保存的章节与新增的资源项也会写出
+
+    Args:
+        output_path (Path): 输出路径，不能与源文件相同
+        ebook (EpubBook | ChapterStore): 源电子书，需要有源文件
+        overrides (dict): 以章节序号为键、新章节内容为值的字典，如润色并插入插图后的章节；目录页的序号被忽略
+        images (dict): 以文件名（相对于 OPF 文件）为键、磁盘路径为值的插图，如 ImageCache 中的文件
+        title (str): 书名，默认沿用源电子书
+
+    Returns:
+        Path: 写入的文件路径
+    """
+    store = OE.get_store(ebook)
+    if store.path is None:
+        raise ValueError('电子书没有源文件，无法流式写出')
+    output_path = Path(output_path)
+    if output_path.resolve() == store.path.resolve():
+        raise ValueError('输出路径不能与源文件相同')
+    overrides = overrides or {}
+    images = dict(images or {})
+
+    with zipfile.ZipFile(store.path) as source:
+        opf_path, source_title, language, items = _read_package(source)
+        # 与 ChapterStore 一致：清单中的XHTML文档（包括目录页）依次为各章节
+        chapters = [item for item in items if item['media_type'] == 'application/xhtml+xml']
+        chapter_members = {item['member'] for item in chapters}
+        skipped = {opf_path, *_GENERATED} | {item['member'] for item in items
+                                             if 'nav' in item['properties'].split()
+                                             or item['media_type'] == 'application/x-dtbncx+xml'}
+        with StreamingEpubWriter(output_path, title or source_title, language) as writer:
+            for chapter_index, item in enumerate(chapters):
+                if 'nav' in item['properties'].split():
+                    writer.add_nav(item['href'], item['id'])
+                    continue
+                if chapter_index in overrides:
+                    content = overrides[chapter_index]
+                elif chapter_index in store.dirty:
+                    content = store.get_content(chapter_index)
+                else:
+                    content = source.read(item['member'])
+                level = volume_level(chapter_index)
+                writer.add_chapter(item['href'], content, heading_of(content) or f'Chapter {chapter_index + 1}',
+                                   level, item['id'])
+
+            for item in items:
+                if item['member'] in chapter_members or item['member'] in skipped:
+                    continue
+                if item['href'] in images:
+                    continue
+                with source.open(item['member']) as src:
+                    writer.add_file(item['href'], src, item['media_type'], item['id'])
+
+            existing = {item['href'] for item in items}
+            for file_name in sorted(store.added):
+                if file_name not in images and file_name not in existing:
+                    added = store.book.get_item_with_href(file_name)
+                    writer.add_file(file_name, added.get_content(), added.media_type)
+            for file_name, path in sorted(images.items()):
+                writer.add_file(file_name, path)
+    return output_path
+
+# 示例使用
+if __name__ == "__main__":
+    # 将润色结果与插图缓存中的插图流式写出为新的电子书
+    # from rewrite_pipeline import Journal, text_to_html
+    # store = OE.ChapterStore()
+    # overrides = {i: text_to_html(store.chapter_info(i, ('title',))['title'], text)
+    #              for i, text in Journal().completed('rewrite').items()}
+    # write_book('./output/final.epub', store, overrides)
+
+    pass
@@ -0,0 +1,511 @@
+# image_queue.py
+
+# 导入所需库
+import asyncio
+import base64
+import hashlib
+import html
+import os
+import posixpath
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from ebooklib import epub
+
+import AIUESAGENT as AT
+import operating_ebook as OE
+import scene_splitter as SS
+from entity_index import ROLE_FIELDS, SCENE_FIELDS
+
+# 参数设置
+IMAGE_CACHE_DIR = Path('./cache/images') # 插图缓存目录
+IMAGE_DIR = 'images' # 插图在电子书中的目录（相对于 OPF 文件）
+MEDIA_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+_TAG_SEPARATOR = re.compile(r'[,，、;；\n]+')
+_PARAGRAPH = re.compile(r'<p\b[^>]*>(.*?)</p>', re.S | re.I)
+_TAG = re.compile(r'<[^>]+>')
+
+def normalize_prompt(prompt):
+    """
+    规范化提示词：按逗号等分隔为标签，去掉首尾空白、统一小写、去重并排序，
+    只有标签顺序或大小写不同的提示词规范化后相同
+
+    Args:
+        prompt (str): 提示词
+
+    Returns:
+        str: 以 ', ' 连接的标签
+    """
+    tags = {' '.join(tag.split()).lower() for tag in _TAG_SEPARATOR.split(prompt)}
+    return ', '.join(sorted(tag for tag in tags if tag))
+
+def prompt_key(prompt):
+    """
+    计算规范化提示词的哈希，作为插图任务的键
+
+    Args:
+        prompt (str): 提示词
+
+    Returns:
+        str: 十六进制的 sha256 哈希
+    """
+    return hashlib.sha256(normalize_prompt(prompt).encode('utf-8')).hexdigest()
+
+def scene_prompts(image_prompts, artist_style=''):
+    """
+    由插图信息提取的结果组装每个场景的提示词：场景的图片风格加上全部角色的人物形象
+
+    Args:
+        image_prompts (dict): 含 'roles' 与 'scenes' 的提取结果
+        artist_style (str): 喜好的艺术家的画风 artist_style
+
+    Returns:
+        list: 每个场景一个提示词
+    """
+    if not isinstance(image_prompts, dict):
+        return []
+    roles = [role for role in image_prompts.get('roles', []) if isinstance(role, dict)]
+    role_tags = [str(role[field]) for role in roles for field in ROLE_FIELDS if role.get(field)]
+    prompts = []
+    for scene in image_prompts.get('scenes', []):
+        if not isinstance(scene, dict):
+            continue
+        tags = [artist_style] + [str(scene[field]) for field in SCENE_FIELDS if scene.get(field)] + role_tags
+        prompts.append(', '.join(tag for tag in tags if tag))
+    return prompts
+
+# 插图生成后端
+class ImageBackend(ABC):
+    """
+    插图生成后端的接口，子类必须实现 generate
+
+    Attributes:
+        suffix (str): 生成的图片格式
+    """
+    suffix = 'png'
+
+    @abstractmethod
+    async def generate(self, prompt):
+        """
+        生成一张插图
+
+        Args:
+            prompt (str): 规范化后的提示词
+
+        Returns:
+            bytes: 图片内容
+        """
+
+class TransientImageError(Exception):
+    """可以重试的插图生成错误"""
+
+def _png(width, height, rgb):
+    # 生成纯色 PNG，不依赖图像库
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF)
+    row = b'\x00' + bytes(rgb) * width
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * height))
+            + chunk(b'IEND', b''))
+
+class StubBackend(ImageBackend):
+    """
+    本地调试用的后端：按提示词的哈希生成纯色图片，可以模拟耗时与失败
+
+    Args:
+        latency (float): 每张图片的耗时（秒）
+        fail_every (int): 每隔多少次调用失败一次，为 0 时不失败
+        size (int): 图片边长
+    """
+    def __init__(self, latency=0.0, fail_every=0, size=64):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.size = size
+        self.calls = 0
+
+    async def generate(self, prompt):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(self.latency)
+        if self.fail_every and call % self.fail_every == 0:
+            raise TransientImageError('模拟的插图生成失败')
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        return _png(self.size, self.size, digest[:3])
+
+class OpenAIImageBackend(ImageBackend):
+    """
+    兼容 OpenAI 图片接口的后端，共用 AIUESAGENT 中的异步客户端
+
+    Args:
+        model (str): 图片模型
+        size (str): 图片尺寸，如 '1024x1024'
+        api_key (str): 接口密钥
+        base_url (str): 接口地址
+    """
+    def __init__(self, model, size='1024x1024', api_key=AT.key, base_url=AT.url):
+        self.model = model
+        self.size = size
+        self.api_key = api_key
+        self.base_url = base_url
+
+    async def generate(self, prompt):
+        client = AT.get_async_client(self.api_key, self.base_url, max_retries=0)
+        response = await client.images.generate(model=self.model, prompt=prompt, size=self.size,
+                                                response_format='b64_json')
+        return base64.b64decode(response.data[0].b64_json)
+
+# 内容寻址的插图缓存
+class ImageCache:
+    """
+    以图片内容哈希为文件名的插图缓存，并记录提示词键到图片的对应关系
+
+    总大小超过上限时按最近使用时间淘汰图片，指向被淘汰图片的提示词键一并删除
+
+    Args:
+        root (Path): 缓存目录
+        max_bytes (int): 缓存总大小上限（字节）
+    """
+    def __init__(self, root=IMAGE_CACHE_DIR, max_bytes=512 * 1024 * 1024):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.root / 'index.sqlite', check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            'digest TEXT PRIMARY KEY, suffix TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS prompts (prompt_key TEXT PRIMARY KEY, digest TEXT NOT NULL)')
+
+    def path(self, digest, suffix='png'):
+        """
+        Args:
+            digest (str): 图片内容的哈希
+            suffix (str): 图片格式
+
+        Returns:
+            Path: 图片文件路径
+        """
+        return self.root / digest[:2] / f'{digest}.{suffix}'
+
+    def lookup(self, key):
+        """
+        按提示词键查找已生成的图片，并刷新其最近使用时间
+
+        Args:
+            key (str): 提示词键
+
+        Returns:
+            tuple: (图片哈希, 图片格式)，没有缓存时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT b.digest, b.suffix FROM prompts p JOIN blobs b ON p.digest = b.digest '
+                                     'WHERE p.prompt_key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if not self.path(*row).exists():
+                self._conn.execute('DELETE FROM blobs WHERE digest = ?', (row[0],))
+                self._conn.execute('DELETE FROM prompts WHERE digest = ?', (row[0],))
+                return None
+            self._conn.execute('UPDATE blobs SET last_used = ? WHERE digest = ?', (time.time(), row[0]))
+        return tuple(row)
+
+    def put(self, key, data, suffix='png'):
+        """
+        写入一张图片，内容相同的图片只保存一份
+
+        Args:
+            key (str): 提示词键
+            data (bytes): 图片内容
+            suffix (str): 图片格式
+
+        Returns:
+            str: 图片内容的哈希
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest, suffix)
+        if not path.exists():
+            # 先写临时文件再替换，避免中断时留下不完整的图片
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO blobs (digest, suffix, size, last_used) VALUES (?, ?, ?, ?)',
+                               (digest, suffix, len(data), time.time()))
+            self._conn.execute('INSERT OR REPLACE INTO prompts (prompt_key, digest) VALUES (?, ?)', (key, digest))
+        self.evict()
+        return digest
+
+    def read(self, digest, suffix='png'):
+        """
+        Args:
+            digest (str): 图片内容的哈希
+            suffix (str): 图片格式
+
+        Returns:
+            bytes: 图片内容
+        """
+        return self.path(digest, suffix).read_bytes()
+
+    def total_bytes(self):
+        """
+        Returns:
+            int: 缓存中图片的总大小
+        """
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    def evict(self):
+        """
+        淘汰最久未使用的图片，直到总大小不超过上限
+
+        Returns:
+            int: 淘汰的图片数
+        """
+        removed = 0
+        with self._lock:
+            total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            rows = self._conn.execute('SELECT digest, suffix, size FROM blobs ORDER BY last_used').fetchall()
+            # 最近写入的一张总是保留
+            for digest, suffix, size in rows[:-1]:
+                if total <= self.max_bytes:
+                    break
+                self.path(digest, suffix).unlink(missing_ok=True)
+                self._conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+                self._conn.execute('DELETE FROM prompts WHERE digest = ?', (digest,))
+                total -= size
+                removed += 1
+        return removed
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
+
+def _retryable(error):
+    return AT.is_retryable(error) or isinstance(error, (TransientImageError, ConnectionError, asyncio.TimeoutError))
+
+# 插图任务队列
+class ImageQueue:
+    """
+    去重并缓存的插图生成队列
+
+    任务以规范化提示词的哈希为键：已缓存的直接返回，正在生成的相同任务共用一次生成；
+    同时进行的生成数受 concurrency 限制，可重试的错误按指数退避重试。
+    缓存的磁盘与数据库读写在线程中进行，不阻塞事件循环；生成失败的提示词记录在 failures 中
+
+    Args:
+        backend (ImageBackend): 插图生成后端，默认为本地的 StubBackend
+        cache (ImageCache): 插图缓存
+        concurrency (int): 最大并发生成数
+        max_retries (int): 最大重试次数
+        backoff (float): 首次重试的基础等待秒数，之后按指数增长
+    """
+    def __init__(self, backend=None, cache=None, concurrency=4, max_retries=3, backoff=1.0):
+        self.backend = backend if backend is not None else StubBackend()
+        self.cache = cache if cache is not None else ImageCache()
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = {'requested': 0, 'cached': 0, 'deduplicated': 0, 'generated': 0, 'retries': 0, 'failed': 0}
+        self.failures = []
+        self._inflight = {}
+        self._semaphore = None
+        self._loop = None
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _generate(self, key, prompt):
+        async with self._get_semaphore():
+            attempt = 0
+            while True:
+                try:
+                    data = await self.backend.generate(prompt)
+                    break
+                except Exception as e:
+                    if attempt >= self.max_retries or not _retryable(e):
+                        self.stats['failed'] += 1
+                        raise
+                    await asyncio.sleep(AT.retry_delay(e, attempt, self.backoff))
+                    attempt += 1
+                    self.stats['retries'] += 1
+        self.stats['generated'] += 1
+        suffix = self.backend.suffix
+        digest = await asyncio.to_thread(self.cache.put, key, data, suffix)
+        return {'key': key, 'digest': digest, 'suffix': suffix, 'prompt': prompt}
+
+    async def submit(self, prompt):
+        """
+        获取一个提示词对应的插图，没有缓存时生成
+
+        Args:
+            prompt (str): 提示词
+
+        Returns:
+            dict: 包含 'key'、'digest'（图片内容哈希）、'suffix' 与 'prompt'（规范化后的提示词）
+        """
+        self.stats['requested'] += 1
+        normalized = normalize_prompt(prompt)
+        key = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        hit = await asyncio.to_thread(self.cache.lookup, key)
+        if hit is not None:
+            self.stats['cached'] += 1
+            return {'key': key, 'digest': hit[0], 'suffix': hit[1], 'prompt': normalized}
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate(key, normalized))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats['deduplicated'] += 1
+        return await asyncio.shield(task)
+
+    async def map(self, prompts):
+        """
+        并发获取多个提示词的插图
+
+        Args:
+            prompts (list): 提示词列表
+
+        Returns:
+            list: 与提示词一一对应的 submit 结果，失败的为 None，失败的提示词与异常追加到 self.failures
+        """
+        results = await asyncio.gather(*(self.submit(prompt) for prompt in prompts), return_exceptions=True)
+        for prompt, result in zip(prompts, results):
+            if isinstance(result, Exception):
+                self.failures.append({'prompt': prompt, 'error': result})
+        return [None if isinstance(result, Exception) else result for result in results]
+
+def _scene_ends(content):
+    # 各场景最后一个段落在章节内容中的结束位置
+    paragraphs = [(match.end(), html.unescape(_TAG.sub('', match.group(1))).strip())
+                  for match in _PARAGRAPH.finditer(content)]
+    text = '\n'.join(line for _, line in paragraphs)
+    ends = []
+    position = 0
+    for scene in SS.split_scenes(text):
+        last = scene[-1]
+        while position < len(paragraphs) and paragraphs[position][1] != last:
+            position += 1
+        if position == len(paragraphs):
+            break
+        ends.append(paragraphs[position][0])
+        position += 1
+    return ends
+
+def image_file_name(image):
+    """
+    Args:
+        image (dict): ImageQueue.submit 的结果
+
+    Returns:
+        str: 插图在电子书中的文件名（相对于 OPF 文件）
+    """
+    return f"{IMAGE_DIR}/{image['digest']}.{image['suffix']}"
+
+def insert_images(content, srcs):
+    """
+    将插图插入到章节内容中各场景之后；插图少于场景时均匀分布，已插入的插图不会重复插入
+
+    Args:
+        content (str): 章节内容（HTML格式）
+        srcs (list): 插图相对于章节文件的路径
+
+    Returns:
+        tuple: (插入插图之后的章节内容, 新插入的插图数)
+    """
+    ends = _scene_ends(content)
+    if not srcs or not ends:
+        return content, 0
+    insertions = {}
+    for i, src in enumerate(srcs):
+        src = html.escape(src)
+        if f'src="{src}"' in content:
+            continue
+        # 第 i 张插图放在第 round((i + 1) * 场景数 / 插图数) 个场景之后
+        end = ends[min(len(ends), max(1, round((i + 1) * len(ends) / len(srcs)))) - 1]
+        insertions.setdefault(end, []).append(f'<div class="illustration"><img src="{src}" alt="插图"/></div>')
+    for end in sorted(insertions, reverse=True):
+        content = content[:end] + ''.join(insertions[end]) + content[end:]
+    return content, sum(len(tags) for tags in insertions.values())
+
+def link_images(chapter_index, images, cache=None, ebook=None):
+    """
+    将插图加入电子书，并通过 update_chapter_content 插入到章节中各场景之后
+
+    Args:
+        chapter_index (int): 章节序号
+        images (list): ImageQueue.submit 的结果列表，None 会被跳过
+        cache (ImageCache): 插图缓存
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书
+
+    Returns:
+        int: 新插入的插图数
+    """
+    cache = cache if cache is not None else ImageCache()
+    store = OE.get_store(ebook)
+    images = [image for image in images if image is not None]
+    if not images:
+        return 0
+
+    chapter_file = store.chapter_info(chapter_index, fields=('file_name',))['file_name'] or ''
+    srcs = []
+    for image in images:
+        file_name = image_file_name(image)
+        store.add_item(epub.EpubImage(uid=f"img_{image['digest'][:16]}", file_name=file_name,
+                                      media_type=MEDIA_TYPES.get(image['suffix'], 'image/png'),
+                                      content=cache.read(image['digest'], image['suffix'])))
+        srcs.append(posixpath.relpath(file_name, posixpath.dirname(chapter_file) or '.'))
+    content, inserted = insert_images(store.get_content(chapter_index), srcs)
+    if inserted:
+        OE.update_chapter_content(chapter_index, content, ebook=store)
+    return inserted
+
+async def illustrate(queue, image_prompts, ebook=None, artist_style=''):
+    """
+    为多个章节生成插图并插入章节，全部章节的提示词一起去重
+
+    Args:
+        queue (ImageQueue): 插图任务队列
+        image_prompts (dict): 以章节序号为键、插图信息提取结果为值的字典，如 Journal.completed('image_prompts')
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书（通常为重构后的电子书）
+        artist_style (str): 喜好的艺术家的画风
+
+    Returns:
+        dict: 以章节序号为键、新插入的插图数为值的字典
+    """
+    prompts = {chapter_index: scene_prompts(output, artist_style) for chapter_index, output in image_prompts.items()}
+    results = dict(zip(prompts, await asyncio.gather(*(queue.map(items) for items in prompts.values()))))
+    # 读取图片与改写章节在线程中逐章进行，不阻塞事件循环
+    inserted = {}
+    for chapter_index, images in sorted(results.items()):
+        inserted[chapter_index] = await asyncio.to_thread(link_images, chapter_index, images, queue.cache, ebook)
+    return inserted
+
+# 示例使用
+if __name__ == "__main__":
+    # 为重构后的电子书生成插图（本地调试后端），写回后保存
+    # from rewrite_pipeline import Journal, OUTPUT_PATH
+    # store = OE.ChapterStore(OUTPUT_PATH)
+    # queue = ImageQueue(StubBackend(latency=0.1))
+    # print(AT.run(illustrate(queue, Journal().completed('image_prompts'), store)), queue.stats, queue.failures)
+    # store.save()
+
+    pass
@@ -0,0 +1,368 @@
+# %%
+# 导入第三方库
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+import numpy as np
+import openpyxl
+import pandas as pd
+
+# 参数设置
+LEDGER_PATH = 'data/ledger.sqlite'
+DATE_COLUMN = '日期'
+HEADER_ROWS = 2 # 表格的两行表头
+
+# %%
+def merge_header(columns, first_row):
+    '''
+    合并两行表头：第二行表头为空的列沿用第一行表头
+
+    参数:
+        columns (Index): 第一行表头
+        first_row (Series): 第二行表头
+
+    返回:
+        list: 合并之后的列名
+    '''
+    return list(np.where(pd.isna(first_row), columns, first_row).astype(str))
+
+def convert_columns(df, numeric=None):
+    '''
+    数据格式转换：日期为 datetime64，金额列为 float32
+
+    参数:
+        df (DataFrame): 已合并表头的数据
+        numeric (list): 金额列，为 None 时将能完整转换为数值的列视为金额列
+
+    返回:
+        df (DataFrame): 转换之后的数据
+    '''
+    df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN], format='%Y%m%d')
+    for col in df.columns:
+        if col == DATE_COLUMN:
+            continue
+        values = pd.to_numeric(df[col], errors='coerce')
+        if numeric is None:
+            is_numeric = values.notna().sum() == df[col].notna().sum()
+        else:
+            is_numeric = col in numeric
+        if is_numeric:
+            df[col] = values.astype('float32')
+    return df
+
+def _header_names(values):
+    # 与 pd.read_excel 的表头一致：空单元格为 Unnamed: 列序号，重复的列名依次加 .1、.2
+    names = []
+    seen = {}
+    for position, value in enumerate(values):
+        name = f'Unnamed: {position}' if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name)
+    return pd.Index(names)
+
+def _file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+# %%
+class LedgerStore:
+    '''
+    只追加的本地账本，SQLite 存储并按日期建立索引
+
+    从 Excel 导入时只清洗与写入上次导入之后新增的行，也可以直接追加记录；
+    按月份或日期区间查询都走日期索引，返回与 proc_washing_data 相同列顺序与类型的 DataFrame，
+    报告只需读取所查询的月份，耗时不随账本增长
+
+    参数:
+        path (str): 账本数据库路径
+    '''
+    def __init__(self, path=LEDGER_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # 列名、列序与类型（date、real、text），账本表按首次导入的表头建立
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS ledger_columns ('
+            'name TEXT PRIMARY KEY, position INTEGER NOT NULL, kind TEXT NOT NULL)'
+        )
+        # 每个 Excel 文件已导入的数据行数，以及导入时文件的修改时间、大小与哈希
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS ledger_sources ('
+            'source TEXT PRIMARY KEY, rows INTEGER NOT NULL, mtime_ns INTEGER, size INTEGER, sha256 TEXT)'
+        )
+        self._columns = self._load_columns()
+
+    def _load_columns(self):
+        rows = self._conn.execute('SELECT name, kind FROM ledger_columns ORDER BY position').fetchall()
+        return dict(rows)
+
+    @property
+    def columns(self):
+        '''
+        返回:
+            list: 账本的列名，顺序与 Excel 表头一致
+        '''
+        return list(self._columns)
+
+    def _sync_columns(self, df):
+        # 新出现的列追加到账本表中，列序以最新的表头为准
+        kinds = {}
+        for col in df.columns:
+            if col == DATE_COLUMN:
+                kinds[col] = 'date'
+            elif col in self._columns:
+                kinds[col] = self._columns[col]
+            else:
+                kinds[col] = 'real' if pd.api.types.is_numeric_dtype(df[col]) else 'text'
+        if not self._columns:
+            definitions = ', '.join(f"{_quote(col)} {'TEXT' if kind != 'real' else 'REAL'}"
+                                    for col, kind in kinds.items())
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS ledger (seq INTEGER PRIMARY KEY, {definitions})')
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS idx_ledger_date ON ledger ({_quote(DATE_COLUMN)})')
+        else:
+            for col, kind in kinds.items():
+                if col not in self._columns:
+                    self._conn.execute(f"ALTER TABLE ledger ADD COLUMN {_quote(col)} {'REAL' if kind == 'real' else 'TEXT'}")
+        # 旧表头中有、新表头中没有的列保留在最后
+        order = list(kinds) + [col for col in self._columns if col not in kinds]
+        kinds.update({col: kind for col, kind in self._columns.items() if col not in kinds})
+        self._conn.executemany('INSERT OR REPLACE INTO ledger_columns (name, position, kind) VALUES (?, ?, ?)',
+                               [(col, position, kinds[col]) for position, col in enumerate(order)])
+        self._columns = {col: kinds[col] for col in order}
+
+    def _insert(self, df):
+        values = []
+        for col in df.columns:
+            if col == DATE_COLUMN:
+                values.append(df[col].dt.strftime('%Y-%m-%d'))
+            elif self._columns[col] == 'real':
+                values.append(df[col].astype('float64'))
+            else:
+                values.append(df[col].map(lambda x: None if pd.isna(x) else str(x)))
+        rows = [tuple(None if isinstance(v, float) and np.isnan(v) else v for v in row) for row in zip(*values)]
+        names = ', '.join(_quote(col) for col in df.columns)
+        marks = ', '.join('?' * len(df.columns))
+        self._conn.executemany(f'INSERT INTO ledger ({names}) VALUES ({marks})', rows)
+
+    def append(self, records):
+        '''
+        追加记录
+
+        参数:
+            records (DataFrame | list): 清洗之后的数据，或以列名为键的字典列表（日期可为 20240101 形式）
+
+        返回:
+            int: 追加的行数
+        '''
+        df = pd.DataFrame(records).copy()
+        if df.empty:
+            return 0
+        if DATE_COLUMN not in df.columns:
+            raise ValueError(f'记录缺少 {DATE_COLUMN} 列')
+        if not pd.api.types.is_datetime64_any_dtype(df[DATE_COLUMN]):
+            numeric = [col for col, kind in self._columns.items() if kind == 'real'] if self._columns else None
+            df = convert_columns(df, numeric)
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._sync_columns(df)
+                self._insert(df)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return len(df)
+
+    def import_excel(self, file_path):
+        '''
+        从 Excel 导入上次导入之后新增的行
+
+        账本只追加，已导入的行不会再被清洗与写入。文件的修改时间与大小和上次导入时相同，
+        或内容哈希相同时，不打开文件直接返回；否则以只读模式流式读取表头，
+        并从上次导入的最后一行开始逐行读取。若该行已为空（文件的数据行比已导入的少，例如改写了历史记录），
+        需要先 rebuild 再导入
+
+        参数:
+            file_path (str): 数据文件路径
+
+        返回:
+            int: 新导入的行数
+        '''
+        source = str(Path(file_path).resolve())
+        stat = Path(file_path).stat()
+        row = self._conn.execute('SELECT rows, mtime_ns, size, sha256 FROM ledger_sources WHERE source = ?',
+                                 (source,)).fetchone()
+        imported = row[0] if row else 0
+        if row is not None and (row[1], row[2]) == (stat.st_mtime_ns, stat.st_size):
+            return 0
+        sha256 = _file_sha256(file_path)
+        if row is not None and row[3] == sha256:
+            # 只是修改时间变化，内容相同
+            self._conn.execute('UPDATE ledger_sources SET mtime_ns = ?, size = ? WHERE source = ?',
+                               (stat.st_mtime_ns, stat.st_size, source))
+            return 0
+
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            first, second = (list(values) for values in
+                             sheet.iter_rows(min_row=1, max_row=HEADER_ROWS, values_only=True))
+            columns = merge_header(_header_names(first), pd.Series(second + [None] * (len(first) - len(second))))
+            # 从上次导入的最后一行开始读取，该行用于确认文件没有缩短
+            rows = sheet.iter_rows(min_row=HEADER_ROWS + max(imported, 1), values_only=True)
+            if imported:
+                last = next(rows, None)
+                if last is None or all(value is None for value in last):
+                    raise ValueError(f'{file_path} 的数据行少于已导入的 {imported} 行，请先 rebuild')
+            width = len(columns)
+            new_rows = []
+            consumed = 0
+            for offset, values in enumerate(rows, 1):
+                values = list(values[:width]) + [None] * (width - len(values))
+                if any(value is not None for value in values):
+                    new_rows.append(values)
+                    # 中间的空行计入已读取的行数，末尾的空行留待以后填写
+                    consumed = offset
+        finally:
+            workbook.close()
+
+        if new_rows:
+            numeric = [col for col, kind in self._columns.items() if kind == 'real'] if self._columns else None
+            df = convert_columns(pd.DataFrame(new_rows, columns=columns), numeric)
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                if new_rows:
+                    self._sync_columns(df)
+                    self._insert(df)
+                self._conn.execute('INSERT OR REPLACE INTO ledger_sources (source, rows, mtime_ns, size, sha256) '
+                                   'VALUES (?, ?, ?, ?, ?)',
+                                   (source, imported + consumed, stat.st_mtime_ns, stat.st_size, sha256))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return len(new_rows)
+
+    def rebuild(self, file_path=None):
+        '''
+        清空账本，给出 file_path 时重新完整导入
+
+        参数:
+            file_path (str): 数据文件路径
+
+        返回:
+            int: 导入的行数
+        '''
+        with self._lock:
+            self._conn.execute('DROP TABLE IF EXISTS ledger')
+            self._conn.execute('DELETE FROM ledger_columns')
+            self._conn.execute('DELETE FROM ledger_sources')
+            self._columns = {}
+        return self.import_excel(file_path) if file_path is not None else 0
+
+    def _query(self, where='', params=()):
+        if not self._columns:
+            return pd.DataFrame(columns=[DATE_COLUMN])
+        names = ', '.join(_quote(col) for col in self._columns)
+        sql = f'SELECT {names} FROM ledger {where} ORDER BY {_quote(DATE_COLUMN)}, seq'
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        df = pd.DataFrame(rows, columns=list(self._columns))
+        for col, kind in self._columns.items():
+            if kind == 'date':
+                df[col] = pd.to_datetime(df[col], format='%Y-%m-%d')
+            elif kind == 'real':
+                df[col] = df[col].astype('float32')
+            else:
+                df[col] = df[col].astype(object).where(df[col].notna(), np.nan)
+        return df
+
+    def range_rows(self, start, end):
+        '''
+        查询一段月份（含首尾）的数据
+
+        参数:
+            start (tuple): 起始 (年, 月)
+            end (tuple): 结束 (年, 月)
+
+        返回:
+            pd.DataFrame: 按日期排序的数据
+        '''
+        end_year, end_month = end
+        next_month = (end_year + end_month // 12, end_month % 12 + 1)
+        return self._query(f'WHERE {_quote(DATE_COLUMN)} >= ? AND {_quote(DATE_COLUMN)} < ?',
+                           (f'{start[0]:04d}-{start[1]:02d}-01', f'{next_month[0]:04d}-{next_month[1]:02d}-01'))
+
+    def month(self, year, month):
+        '''
+        查询指定年月的数据
+
+        参数:
+            year (int): 指定年份
+            month (int): 指定月份
+
+        返回:
+            pd.DataFrame: 按日期排序的数据
+        '''
+        return self.range_rows((year, month), (year, month))
+
+    def between(self, start_date, end_date):
+        '''
+        查询两个日期之间（含首尾）的数据
+
+        参数:
+            start_date (str | date): 起始日期
+            end_date (str | date): 结束日期
+
+        返回:
+            pd.DataFrame: 按日期排序的数据
+        '''
+        start_date = pd.Timestamp(start_date).strftime('%Y-%m-%d')
+        end_date = pd.Timestamp(end_date).strftime('%Y-%m-%d')
+        return self._query(f'WHERE {_quote(DATE_COLUMN)} BETWEEN ? AND ?', (start_date, end_date))
+
+    def to_frame(self):
+        '''
+        返回:
+            pd.DataFrame: 账本中的全部数据
+        '''
+        return self._query()
+
+    def months(self):
+        '''
+        返回:
+            list: 账本覆盖的全部 (年, 月)
+        '''
+        if not self._columns:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT DISTINCT substr({_quote(DATE_COLUMN)}, 1, 7) FROM ledger ORDER BY 1').fetchall()
+        return [(int(key[:4]), int(key[5:7])) for (key,) in rows]
+
+    def __len__(self):
+        if not self._columns:
+            return 0
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM ledger').fetchone()[0]
+
+    def close(self):
+        '''
+        关闭数据库连接
+        '''
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,114 @@
+# llm_metrics.py
+
+# 导入所需库
+import csv
+import json
+import threading
+import time
+from pathlib import Path
+
+# 每次调用记录的字段
+METRIC_FIELDS = ['timestamp', 'model', 'prompt_tokens', 'completion_tokens', 'total_tokens',
+                 'ttft', 'latency', 'retries', 'cached', 'stream']
+
+def _percentile(values, q):
+    # 线性插值的分位数，values 需已排序
+    if not values:
+        return None
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+# 模型调用指标记录器
+class MetricsRecorder:
+    def __init__(self):
+        '''
+        记录每次模型调用的token用量与耗时，可汇总为分位数并导出为CSV/JSON
+        '''
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, model, prompt_tokens=None, completion_tokens=None, ttft=None, latency=None,
+               retries=0, cached=False, stream=False):
+        '''
+        记录一次调用
+        :param model: 使用的模型
+        :param prompt_tokens: 提示词token数
+        :param completion_tokens: 生成token数
+        :param ttft: 首个token的耗时（秒）
+        :param latency: 总耗时（秒）
+        :param retries: 重试次数
+        :param cached: 是否命中缓存
+        :param stream: 是否为流式调用
+        '''
+        total_tokens = None
+        if prompt_tokens is not None or completion_tokens is not None:
+            total_tokens = (prompt_tokens or 0) + (completion_tokens or 0)
+        with self._lock:
+            self.records.append({
+                'timestamp': time.time(),
+                'model': model,
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': total_tokens,
+                'ttft': ttft,
+                'latency': latency,
+                'retries': retries,
+                'cached': cached,
+                'stream': stream
+            })
+
+    def summary(self):
+        '''
+        按模型汇总调用次数、token用量以及耗时的 p50/p95
+        :return: 以模型名为键的汇总字典，另含键 'all' 为全部调用的汇总
+        '''
+        with self._lock:
+            records = list(self.records)
+        groups = {'all': records}
+        for record in records:
+            groups.setdefault(record['model'], []).append(record)
+
+        result = {}
+        for name, group in groups.items():
+            item = {
+                'calls': len(group),
+                'cached': sum(1 for r in group if r['cached']),
+                'retries': sum(r['retries'] for r in group),
+                'prompt_tokens': sum(r['prompt_tokens'] or 0 for r in group),
+                'completion_tokens': sum(r['completion_tokens'] or 0 for r in group)
+            }
+            for field in ('ttft', 'latency'):
+                values = sorted(r[field] for r in group if r[field] is not None and not r['cached'])
+                item[f'{field}_p50'] = _percentile(values, 0.5)
+                item[f'{field}_p95'] = _percentile(values, 0.95)
+            result[name] = item
+        return result
+
+    def to_csv(self, path):
+        '''
+        将每次调用的记录导出为CSV
+        :param path: 输出路径
+        '''
+        with self._lock:
+            records = list(self.records)
+        with open(Path(path), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=METRIC_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+
+    def to_json(self, path):
+        '''
+        将汇总结果与每次调用的记录导出为JSON
+        :param path: 输出路径
+        '''
+        with self._lock:
+            records = list(self.records)
+        with open(Path(path), 'w', encoding='utf-8') as f:
+            json.dump({'summary': self.summary(), 'records': records}, f, ensure_ascii=False, indent=2)
+
+    def clear(self):
+        '''清空记录'''
+        with self._lock:
+            self.records.clear()
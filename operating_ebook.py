@@ -1,128 +1,624 @@
 # operating_ebook.py
 
+import bisect
+import copy
+import os
+import posixpath
+import struct
+import tempfile
+import weakref
+import zipfile
+from pathlib import Path
+
 import Env
 import ebooklib
 from ebooklib import epub
 from ebooklib.epub import EpubHtml
+from lxml import etree
+from lxml import html as lxml_html
+
+# 章节信息字典包含的全部字段
+CHAPTER_FIELDS = ('id', 'title', 'content', 'file_name', 'index')
+# 提取纯文本时视为段落的块级标签
+_BLOCK_TAGS = ('p', 'div', 'br', 'li', 'tr', 'blockquote', 'section',
+               'h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# 章节仓库
+class ChapterStore:
+    """
+    电子书章节仓库：第一次用到时才解析EPUB，并预先建立章节索引
+
+    索引可按序号、ID、文件名和标题定位章节，章节内容只在第一次被访问时解码并缓存
+
+    Args:
+        path (Path): 电子书路径，默认为 Env.DATA_PATH
+        ebook (EpubBook): 已经读取好的电子书，传入后不再从 path 读取
+    """
+    def __init__(self, path=Env.DATA_PATH, ebook=None):
+        self.path = Path(path) if path is not None else None
+        self._book = ebook
+        self._items = None
+        self._by_id = {}
+        self._by_file_name = {}
+        self._by_title = {}
+        self._positions = {}
+        self._contents = {}
+        self._listeners = []
+        self.dirty = set()
+        self.added = set()
+
+    @property
+    def book(self):
+        """EpubBook对象，第一次访问时才读取文件；读取后登记到 get_store 的索引中，之后以该对象操作时共用本仓库"""
+        if self._book is None:
+            self._book = epub.read_epub(self.path)
+            _book_stores.setdefault(self._book, self)
+        return self._book
+
+    @property
+    def items(self):
+        """按阅读顺序排列的所有文档项（HTML文件）"""
+        if self._items is None:
+            self._build_index()
+        return self._items
+
+    def _build_index(self):
+        book = self.book
+        items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
+
+        # 目录中的标题，章节本身没有标题时用来补充标题索引
+        toc_titles = {}
+        for link in _walk_toc(book.toc):
+            toc_titles.setdefault(link.href.split('#')[0], link.title)
+
+        self._by_id = {}
+        self._by_file_name = {}
+        self._by_title = {}
+        # 文档项在 book.items 中的位置，替换章节时原地替换，不改变顺序
+        self._positions = {item.id: pos for pos, item in enumerate(book.items)}
+        for i, item in enumerate(items):
+            self._by_id.setdefault(item.id, i)
+            file_name = getattr(item, 'file_name', None)
+            if file_name:
+                self._by_file_name.setdefault(file_name, i)
+            title = getattr(item, 'title', '') or toc_titles.get(file_name)
+            if title:
+                self._by_title.setdefault(title, i)
+        self._items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def locate(self, key):
+        """
+        将序号、ID、文件名或标题转换为章节序号
+
+        Args:
+            key (int | str): 章节序号，或章节的ID、文件名、标题
+
+        Returns:
+            int: 章节序号，找不到时返回 None
+        """
+        total = len(self.items)
+        if isinstance(key, str):
+            for index in (self._by_id, self._by_file_name, self._by_title):
+                if key in index:
+                    return index[key]
+            return None
+        if -total <= key < total:
+            return key % total
+        return None
+
+    def get_content(self, chapter_index):
+        """
+        获取指定章节解码后的内容，只在第一次访问时解码
+
+        Args:
+            chapter_index (int): 章节序号
+
+        Returns:
+            str: 章节内容（HTML格式）
+        """
+        content = self._contents.get(chapter_index)
+        if content is None:
+            content = _decode(self.items[chapter_index])
+            self._contents[chapter_index] = content
+        return content
+
+    def chapter_info(self, chapter_index, fields=CHAPTER_FIELDS, as_text=False, cache=True):
+        """
+        组装指定章节的信息字典
+
+        Args:
+            chapter_index (int): 章节序号
+            fields (tuple): 需要的字段，默认为全部字段
+            as_text (bool): 是否将内容转换为纯文本
+            cache (bool): 是否缓存解码后的内容，遍历全书时关闭以控制内存
+
+        Returns:
+            dict: 包含章节信息的字典，包括标题、内容、ID等
+        """
+        chapter = self.items[chapter_index]
+        chapter_info = {}
+        for field in fields:
+            if field == 'id':
+                chapter_info['id'] = chapter.id
+            elif field == 'title':
+                chapter_info['title'] = getattr(chapter, 'title', f'Chapter {chapter_index + 1}')
+            elif field == 'content':
+                chapter_info['content'] = self._read_content(chapter_index, as_text, cache)
+            elif field == 'file_name':
+                chapter_info['file_name'] = chapter.file_name if hasattr(chapter, 'file_name') else None
+            elif field == 'index':
+                chapter_info['index'] = chapter_index
+        return chapter_info
+
+    def _read_content(self, chapter_index, as_text, cache):
+        content = self._contents.get(chapter_index)
+        if content is None:
+            if cache:
+                content = self.get_content(chapter_index)
+            elif as_text:
+                # 纯文本直接从原始字节解析，省去一次解码
+                return html_to_text(self.items[chapter_index].get_content())
+            else:
+                content = _decode(self.items[chapter_index])
+        return html_to_text(content) if as_text else content
+
+    def invalidate(self, chapter_index=None):
+        """
+        丢弃已缓存的章节内容
+
+        Args:
+            chapter_index (int): 章节序号，为 None 时丢弃全部缓存
+        """
+        if chapter_index is None:
+            self._contents.clear()
+        else:
+            self._contents.pop(chapter_index, None)
+
+    def set_content(self, chapter_index, new_content):
+        """
+        在内存中替换指定章节的内容并标记为已修改
+
+        Args:
+            chapter_index (int): 章节序号
+            new_content (str): 新的章节内容（HTML格式）
+        """
+        original_chapter = self.items[chapter_index]
+        if isinstance(original_chapter, EpubHtml):
+            original_chapter.set_content(new_content.encode('utf-8'))
+        else:
+            # 如果不是EpubHtml类型，创建新的EpubHtml对象
+            new_chapter = EpubHtml(
+                uid=original_chapter.id,
+                file_name=getattr(original_chapter, 'file_name', f'chapter_{chapter_index}.xhtml'),
+                content=new_content.encode('utf-8')
+            )
+            # 在原位置替换原章节，书脊按ID引用章节，顺序保持不变
+            self.book.items[self._positions[original_chapter.id]] = new_chapter
+            self.items[chapter_index] = new_chapter
+        self.invalidate(chapter_index)
+        self.dirty.add(chapter_index)
+        for listener in list(self._listeners):
+            listener(chapter_index)
+
+    def add_listener(self, listener):
+        """
+        注册章节修改的回调，每次 set_content 之后以章节序号调用
+
+        Args:
+            listener (callable): 接收章节序号的回调
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """
+        取消注册章节修改的回调
+
+        Args:
+            listener (callable): 已注册的回调
+        """
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def add_item(self, item):
+        """
+        向电子书添加新的资源项（如插图），同一文件名只添加一次；保存时需要改写清单
+
+        Args:
+            item (EpubItem): 新的资源项
+
+        Returns:
+            EpubItem: 电子书中该文件名对应的资源项
+        """
+        existing = self.book.get_item_with_href(item.file_name)
+        if existing is not None:
+            return existing
+        self.book.add_item(item)
+        self.added.add(item.file_name)
+        return item
+
+    def save(self, output_path=None):
+        """
+        将修改写入EPUB文件：先写临时文件，再原子替换目标文件
+
+        有源文件时只重写被修改的章节，其余成员直接从源压缩包复制
+
+        Args:
+            output_path (Path): 输出路径，默认覆盖源文件
+
+        Returns:
+            Path: 写入的文件路径
+        """
+        target = Path(output_path) if output_path is not None else self.path
+        if target is None:
+            raise ValueError("电子书没有源文件，需要指定输出路径")
+        if self.path is not None and self.path == target and not self.dirty and not self.added:
+            return target
+
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=target.parent or None)
+        os.close(fd)
+        # mkstemp 创建的文件仅所有者可读写，保持与普通文件一致的权限
+        os.chmod(tmp_path, 0o644)
+        try:
+            if self.path is None or not self._copy_with_changes(tmp_path):
+                epub.write_epub(tmp_path, self.book)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.path = target
+        self.dirty.clear()
+        self.added.clear()
+        return target
+
+    def _copy_with_changes(self, tmp_path):
+        # 逐个复制源压缩包的成员，只有被修改的章节写入新内容，新增的资源项追加在最后并写入清单
+        with zipfile.ZipFile(self.path) as source:
+            opf_path = _opf_path(source)
+            opf_dir = posixpath.dirname(opf_path)
+            changed = {}
+            for chapter_index in self.dirty:
+                item = self.items[chapter_index]
+                member = posixpath.normpath(posixpath.join(opf_dir, item.file_name))
+                changed[member] = item.get_content()
+            if not set(changed) <= set(source.namelist()):
+                # 有新增的章节文件，需要同时改写书脊，交给 ebooklib 完整写出
+                return False
+            added = {}
+            for file_name in sorted(self.added):
+                item = self.book.get_item_with_href(file_name)
+                added[posixpath.normpath(posixpath.join(opf_dir, file_name))] = item
+            if added:
+                changed[opf_path] = _add_to_manifest(source.read(opf_path), added.values())
+
+            with zipfile.ZipFile(tmp_path, 'w') as output:
+                for info in source.infolist():
+                    if info.filename in changed:
+                        new_info = zipfile.ZipInfo(info.filename, info.date_time)
+                        new_info.compress_type = info.compress_type
+                        new_info.external_attr = info.external_attr
+                        output.writestr(new_info, changed[info.filename])
+                    else:
+                        _copy_member_raw(source, info, output)
+                for member, item in added.items():
+                    if member not in source.namelist():
+                        output.writestr(member, item.get_content(), compress_type=zipfile.ZIP_DEFLATED)
+        return True
+
+def _copy_member_raw(source, info, output):
+    # 原样复制成员压缩后的数据，不解压也不重新压缩，压缩方式与校验值保持不变
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    source.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+    new_info = copy.copy(info)
+    # 校验值与长度已知，直接写在本地文件头中，不再使用数据描述符
+    new_info.flag_bits &= ~0x08
+    new_info.header_offset = output.fp.tell()
+    output.fp.write(new_info.FileHeader())
+    remaining = info.compress_size
+    while remaining > 0:
+        block = source.fp.read(min(remaining, 1 << 20))
+        if not block:
+            raise zipfile.BadZipFile(f'成员数据不完整: {info.filename}')
+        output.fp.write(block)
+        remaining -= len(block)
+    output.filelist.append(new_info)
+    output.NameToInfo[new_info.filename] = new_info
+    output.start_dir = output.fp.tell()
+    output._didModify = True
+
+def _walk_toc(toc):
+    # 展开多级目录，逐个返回带有链接的目录项
+    for node in toc:
+        if isinstance(node, (tuple, list)):
+            section, children = node
+            if getattr(section, 'href', None):
+                yield section
+            yield from _walk_toc(children)
+        elif getattr(node, 'href', None):
+            yield node
+
+def _add_to_manifest(opf, items):
+    # 在 OPF 清单中登记新增的资源项，已登记的ID不重复添加
+    root = etree.fromstring(opf)
+    manifest = root.find('{*}manifest')
+    existing = {element.get('id') for element in manifest}
+    for item in items:
+        if item.id in existing:
+            continue
+        etree.SubElement(manifest, etree.QName(manifest, 'item'),
+                         {'id': item.id, 'href': item.file_name, 'media-type': item.media_type})
+    return etree.tostring(root, xml_declaration=True, encoding='utf-8')
+
+def _opf_path(source):
+    # 从 META-INF/container.xml 中找到 OPF 文件的位置
+    container = etree.fromstring(source.read('META-INF/container.xml'))
+    rootfile = container.find('.//{*}rootfile')
+    return rootfile.get('full-path')
+
+def _decode(item):
+    # 只调用一次 get_content
+    content = item.get_content()
+    return content.decode('utf-8') if isinstance(content, bytes) else content
+
+def html_to_text(content):
+    """
+    将章节的XHTML内容转换为纯文本，每个段落占一行
+
+    Args:
+        content (str | bytes): 章节内容（HTML格式）
+
+    Returns:
+        str: 去掉标签、脚本与空行后的纯文本
+    """
+    if not content or not content.strip():
+        return ''
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    root = lxml_html.fromstring(content)
+    etree.strip_elements(root, 'head', 'script', 'style', etree.Comment, with_tail=False)
+    # 在块级标签后补换行，使段落在拼接后仍然分行
+    for element in root.iter(*_BLOCK_TAGS):
+        element.tail = '\n' + (element.tail or '')
+    lines = (line.strip() for line in ''.join(root.itertext()).splitlines())
+    return '\n'.join(line for line in lines if line)
+
+def get_volume_range(volume, total=None):
+    """
+    根据 Env.LT_VOLUME_IDX 获取指定卷的章节范围
+
+    Args:
+        volume (int): 卷序号，从0开始
+        total (int): 总章节数，用于确定最后一卷的结尾
+
+    Returns:
+        tuple: (start, stop)，左闭右开；最后一卷且未给出 total 时 stop 为 None
+    """
+    bounds = Env.LT_VOLUME_IDX
+    if not 0 <= volume < len(bounds) - 1:
+        raise IndexError(f"卷序号超出范围，总卷数: {len(bounds) - 1}")
+    start = int(bounds[volume])
+    stop = int(bounds[volume + 1])
+    if stop < 0:
+        stop = total
+    return start, stop
+
+def get_volume_of(chapter_index):
+    """
+    获取章节所在的卷序号
+
+    Args:
+        chapter_index (int): 章节序号
+
+    Returns:
+        int: 卷序号
+    """
+    starts = [int(i) for i in Env.LT_VOLUME_IDX[:-1]]
+    return max(bisect.bisect_right(starts, chapter_index) - 1, 0)
+
+_default_store = None
+_book_stores = weakref.WeakKeyDictionary()
+
+def get_store(ebook=None):
+    """
+    获取电子书对应的章节仓库
+
+    Args:
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书，为 None 时使用 Env.DATA_PATH 指向的电子书
+
+    Returns:
+        ChapterStore: 章节仓库，同一本书只创建一次
+    """
+    global _default_store
+    if isinstance(ebook, ChapterStore):
+        return ebook
+    if ebook is None:
+        if _default_store is None:
+            _default_store = ChapterStore(Env.DATA_PATH)
+        return _default_store
+    store = _book_stores.get(ebook)
+    if store is None:
+        store = ChapterStore(path=None, ebook=ebook)
+        _book_stores[ebook] = store
+    return store
 
 # 操作函数
-def get_chapter_data(chapter_index=0, ebook=epub.read_epub(Env.DATA_PATH)):
+def get_chapter_data(chapter_index=0, ebook=None):
     """
     读取EPUB文件中指定章节的数据
-    
+
     Args:
-        chapter_index (int): 章节索引，默认为0（第一个章节）
-        ebook (EpubBook): 操作指向的目标电子书
-    
+        chapter_index (int | str): 章节索引，默认为0（第一个章节），也可以是章节的ID、文件名或标题
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书，默认为 Env.DATA_PATH 指向的电子书
+
     Returns:
         dict: 包含章节信息的字典，包括标题、内容、ID等
     """
     try:
-        # 读取EPUB文件
-        book = ebook
-        
-        # 获取所有文档项（HTML文件）
-        items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
-        
-        if not items:
+        store = get_store(ebook)
+
+        if not len(store):
             print("未找到任何章节内容")
             return None
-            
-        if chapter_index >= len(items):
-            print(f"章节索引超出范围，总章节数: {len(items)}")
+
+        index = store.locate(chapter_index)
+        if index is None:
+            print(f"章节索引超出范围，总章节数: {len(store)}")
             return None
-           
-        # 获取指定章节
-        chapter = items[chapter_index]
-        
-        # 提取章节信息
-        chapter_info = {
-            'id': chapter.id,
-            'title': getattr(chapter, 'title', f'Chapter {chapter_index + 1}'),
-            'content': chapter.get_content().decode('utf-8') if isinstance(chapter.get_content(), bytes) else chapter.get_content(),
-            'file_name': chapter.file_name if hasattr(chapter, 'file_name') else None,
-            'index': chapter_index
-        }
-        
-        return chapter_info
-        
+
+        return store.chapter_info(index)
+
     except Exception as e:
         print(f"读取章节数据时发生错误: {e}")
         return None
 
-def get_all_chapters(ebook=epub.read_epub(Env.DATA_PATH)):
+def get_all_chapters(ebook=None):
     """
     获取EPUB文件中所有章节的信息
 
     Args:
-        ebook (EpubBook): 操作指向的目标电子书
-    
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书，默认为 Env.DATA_PATH 指向的电子书
+
     Returns:
         list: 包含所有章节信息的列表
     """
     try:
-        book = ebook
-        items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
-        chapters = []
-        
-        for i, item in enumerate(items):
-            chapter_info = {
-                'id': item.id,
-                'title': getattr(item, 'title', f'Chapter {i + 1}'),
-                'content': item.get_content().decode('utf-8') if isinstance(item.get_content(), bytes) else item.get_content(),
-                'file_name': item.file_name if hasattr(item, 'file_name') else None,
-                'index': i
-            }
-            chapters.append(chapter_info)
-            
-        return chapters
-        
+        return list(iter_chapters(ebook=ebook))
+
     except Exception as e:
         print(f"获取所有章节时发生错误: {e}")
         return []
 
-def update_chapter_content(chapter_index, new_content, ebook=epub.read_epub(Env.DATA_PATH)):
+def iter_chapters(start=0, stop=None, fields=CHAPTER_FIELDS, as_text=False, volume=None, ebook=None):
+    """
+    逐个生成章节信息，同一时刻只持有一个章节的内容
+
+    Args:
+        start (int): 起始章节序号
+        stop (int): 结束章节序号（不包含），默认为最后一章
+        fields (tuple): 需要的字段，不含 'content' 时不读取章节内容
+        as_text (bool): 是否将内容转换为纯文本
+        volume (int): 卷序号，给出时按 Env.LT_VOLUME_IDX 取该卷的章节，忽略 start 与 stop
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书，默认为 Env.DATA_PATH 指向的电子书
+
+    Yields:
+        dict: 包含章节信息的字典
+    """
+    store = get_store(ebook)
+    total = len(store)
+    if volume is not None:
+        start, stop = get_volume_range(volume, total)
+    start, stop, _ = slice(start, stop).indices(total)
+    for i in range(start, stop):
+        yield store.chapter_info(i, fields=fields, as_text=as_text, cache=False)
+
+def update_chapter_content(chapter_index, new_content, ebook=None):
     """
     更新电子书的指定章节的内容并返回EpubBook对象
-    
+
     Args:
-        chapter_index (int): 要更新的章节索引
+        chapter_index (int | str): 要更新的章节索引，也可以是章节的ID、文件名或标题
         new_content (str): 新的章节内容（HTML格式）
-        ebook (EpubBook): 操作指向的目标电子书
-    
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书，默认为 Env.DATA_PATH 指向的电子书
+
     Returns:
         book: 更新后的电子书
     """
     try:
-        # 读取原始EPUB文件
-        book = ebook
-        items = list(book.get_items_of_type(ebooklib.ITEM_DOCUMENT))
-        
-        if chapter_index >= len(items):
-            print(f"章节索引超出范围，总章节数: {len(items)}")
+        store = get_store(ebook)
+
+        index = store.locate(chapter_index)
+        if index is None:
+            print(f"章节索引超出范围，总章节数: {len(store)}")
             return False
-            
-        # 更新章节内容
-        original_chapter = items[chapter_index]
-        if isinstance(original_chapter, EpubHtml):
-            original_chapter.set_content(new_content.encode('utf-8'))
-        else:
-            # 如果不是EpubHtml类型，创建新的EpubHtml对象
-            new_chapter = EpubHtml(
-                uid=original_chapter.id,
-                file_name=getattr(original_chapter, 'file_name', f'chapter_{chapter_index}.xhtml'),
-                content=new_content.encode('utf-8')
-            )
-            # 替换原章节
-            book.items.remove(original_chapter)
-            book.items.append(new_chapter)
-        
-        return book
-        
+
+        # 更新章节内容，只在内存中修改，调用 save_book 后才写入文件
+        store.set_content(index, new_content)
+
+        return store.book
+
     except Exception as e:
         print(f"更新章节内容时发生错误: {e}")
         return None
 
+def save_book(output_path=None, ebook=None):
+    """
+    将内存中修改过的章节写入EPUB文件
+
+    Args:
+        output_path (Path): 输出路径，默认覆盖源文件
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书，默认为 Env.DATA_PATH 指向的电子书
+
+    Returns:
+        Path: 写入的文件路径
+    """
+    return get_store(ebook).save(output_path)
+
+class ChapterEditor:
+    """
+    章节批量编辑器：先暂存所有修改，提交时统一写入内存并只保存一次文件
+
+    作为上下文管理器使用时，正常退出自动提交，发生异常则放弃全部暂存的修改
+
+    Args:
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书，默认为 Env.DATA_PATH 指向的电子书
+        output_path (Path): 提交时的输出路径，默认覆盖源文件
+    """
+    def __init__(self, ebook=None, output_path=None):
+        self.store = get_store(ebook)
+        self.output_path = output_path
+        self.staged = {}
+
+    def stage(self, chapter_index, new_content):
+        """
+        暂存一个章节的新内容，同一章节多次暂存时以最后一次为准
+
+        Args:
+            chapter_index (int | str): 章节索引，也可以是章节的ID、文件名或标题
+            new_content (str): 新的章节内容（HTML格式）
+        """
+        index = self.store.locate(chapter_index)
+        if index is None:
+            raise IndexError(f"章节索引超出范围，总章节数: {len(self.store)}")
+        self.staged[index] = new_content
+
+    def commit(self, save=True):
+        """
+        应用全部暂存的修改
+
+        Args:
+            save (bool): 是否同时写入文件
+
+        Returns:
+            Path: 写入的文件路径，未写入文件时返回 None
+        """
+        for index, new_content in self.staged.items():
+            self.store.set_content(index, new_content)
+        self.staged.clear()
+        if save:
+            return self.store.save(self.output_path)
+        return None
+
+    def rollback(self):
+        """放弃全部暂存的修改"""
+        self.staged.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
 # 示例使用
 if __name__ == "__main__":
     # 获取第一个章节的数据
@@ -130,15 +626,20 @@ if __name__ == "__main__":
     # if chapter_data:
         # print(f"章节标题: {chapter_data['title']}")
         # print(f"章节内容预览: {chapter_data['content'][:200]}...")
-    
+
     # 获取所有章节
     # all_chapters = get_all_chapters()
     # print(f"总章节数: {len(all_chapters)}")
-    
+
     # 更新章节内容示例
     # new_content = "<h1>修改后的标题</h1><p>这是修改后的内容。</p>"
     # ebook = update_chapter_content(0, new_content)
     # print(get_chapter_data(0, ebook=ebook)['content'])
     # print(get_chapter_data(0)['content'])
 
-    pass
\ No newline at end of file
+    # 批量修改并一次性保存
+    # with ChapterEditor(output_path='修改后.epub') as editor:
+        # editor.stage(0, new_content)
+        # editor.stage(1, new_content)
+
+    pass
@@ -0,0 +1,353 @@
+# %%
+# 导入第三方库
+import argparse
+import asyncio
+import hashlib
+import html
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlsplit
+import pandas as pd
+import AIUESAGENT as AT
+import cost_cube as CC
+import cost_report as CR
+import ledger_store as LS
+
+# 参数设置
+REPORT_CACHE_DIR = 'data/.cache/reports' # 已生成报告的磁盘缓存目录
+HOST = '127.0.0.1'
+PORT = 8000
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+# %%
+def charts_to_html(title, images):
+    '''
+    生成只包含图表的 HTML 页面
+
+    Args:
+        title (str): 页面标题
+        images (list): 图表的 HTML 片段
+
+    Returns:
+        str: 完整的 HTML 页面
+    '''
+    body = '\n'.join(f'<div>{image}</div>' for image in images)
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>{title}</title>
+    <script type="text/javascript" src="https://assets.pyecharts.org/assets/v5/echarts.min.js"></script>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+class ReportService:
+    '''
+    按月份提供消费报告的本地服务
+
+    报告以该月数据的哈希、模型与提示词为键缓存在内存与磁盘中；数据未变化的月份只需读取该月数据并计算哈希，
+    不再重新统计、渲染图表或请求模型；同一月份的并发请求共用一次正在进行的生成
+
+    Args:
+        data_path (str): Excel 数据文件路径
+        model (str): 使用的模型，默认为 AIUESAGENT 中的默认模型
+        ledger (LedgerStore): 可选的账本，给出时从账本按月查询数据，否则读取 data_path
+        cache_dir (str): 报告的磁盘缓存目录
+        memory_items (int): 内存中最多缓存的报告数
+        response_cache (ResponseCache): 可选的模型回复缓存
+    '''
+    def __init__(self, data_path=CR.DATA_PATH, model=None, ledger=None, cache_dir=REPORT_CACHE_DIR,
+                 memory_items=32, response_cache=None):
+        self.data_path = Path(data_path)
+        self.model = model or AT.model
+        self.ledger = ledger
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.memory_items = memory_items
+        self.agent = AT.AIUESAgent(model=self.model, cache=response_cache)
+        self._memory = OrderedDict()
+        self._inflight = {}
+        self._cube = None
+        self._source_stat = None
+        self._data_lock = threading.Lock()
+
+    # ---------- 数据 ----------
+    def _load_cube(self):
+        # 数据文件的修改时间或大小变化时重新读取（读取本身有 Parquet 缓存）
+        stat = self.data_path.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._data_lock:
+            if self._cube is None or self._source_stat != signature:
+                self._cube = CC.get_cube(CR.load_cost_data(self.data_path))
+                self._source_stat = signature
+            return self._cube
+
+    def month_data(self, year, month):
+        '''
+        获取指定年月的数据
+
+        Args:
+            year (int): 指定年份
+            month (int): 指定月份
+
+        Returns:
+            pd.DataFrame: 该月的明细数据
+        '''
+        if self.ledger is not None:
+            return self.ledger.month(year, month)
+        return self._load_cube().month(year, month)
+
+    def months(self):
+        '''
+        Returns:
+            list: 数据覆盖的全部 (年, 月)
+        '''
+        if self.ledger is not None:
+            return self.ledger.months()
+        return self._load_cube().months()
+
+    def report_key(self, data, year, month):
+        '''
+        计算报告的缓存键：该月数据的哈希、模型与提示词
+
+        Args:
+            data (DataFrame): 该月的明细数据
+            year (int): 指定年份
+            month (int): 指定月份
+
+        Returns:
+            str: 十六进制的 sha256 哈希
+        '''
+        digest = hashlib.sha256()
+        digest.update(json.dumps([year, month, self.model, CR.REPORT_SYSTEM_PROMPT, [str(col) for col in data.columns]],
+                                 ensure_ascii=False).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def _lookup(self, year, month):
+        data = self.month_data(year, month)
+        if data.empty:
+            return None, data
+        return self.report_key(data, year, month), data
+
+    # ---------- 缓存 ----------
+    def _memory_get(self, key):
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+        return entry
+
+    def _memory_put(self, entry):
+        self._memory[entry['key']] = entry
+        self._memory.move_to_end(entry['key'])
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key):
+        path = self.cache_dir / f'{key}.json'
+        if not path.exists():
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _disk_put(self, entry):
+        # 先写临时文件再替换，避免中断时留下不完整的缓存
+        path = self.cache_dir / f"{entry['key']}.json"
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    # ---------- 生成 ----------
+    def _build(self, key, data, year, month):
+        prepared = CR.prepare_report(data, year, month)
+        images = CR.render_report_charts(prepared['chart_data'])
+        reply = self.agent.get_response(prepared['report_text'], CR.REPORT_SYSTEM_PROMPT)
+        title = f"{year}年{month}月消费报告"
+        result = CR.finish_report(prepared, reply, f"{title}.html", images, save=False)
+        entry = {
+            'key': key,
+            'year': year,
+            'month': month,
+            'model': self.model,
+            'created': time.time(),
+            'report': result['html'],
+            'charts': charts_to_html(title, images)
+        }
+        self._disk_put(entry)
+        return entry
+
+    async def _generate(self, key, data, year, month):
+        loop = asyncio.get_running_loop()
+        entry = await loop.run_in_executor(None, self._disk_get, key)
+        if entry is None:
+            entry = await loop.run_in_executor(None, self._build, key, data, year, month)
+        self._memory_put(entry)
+        return entry
+
+    async def get_report(self, year, month):
+        '''
+        获取指定年月的报告，命中缓存时直接返回
+
+        Args:
+            year (int): 指定年份
+            month (int): 指定月份
+
+        Returns:
+            dict: 包含 'key'、'report'、'charts' 等的缓存项；该月无数据时返回 None
+        '''
+        loop = asyncio.get_running_loop()
+        key, data = await loop.run_in_executor(None, self._lookup, year, month)
+        if key is None:
+            return None
+        entry = self._memory_get(key)
+        if entry is not None:
+            return entry
+
+        # 同一份数据的并发请求共用一次读取磁盘缓存或生成
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate(key, data, year, month))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    # ---------- HTTP ----------
+    def _index_page(self, months):
+        links = '\n'.join(f'<li>{year}年{month}月：<a href="/report/{year}/{month}">报告</a> '
+                          f'<a href="/charts/{year}/{month}">图表</a></li>' for year, month in months)
+        return f"""<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>消费报告</title></head>
+<body>
+<h1>消费报告</h1>
+<ul>
+{links}
+</ul>
+</body>
+</html>
+"""
+
+    async def route(self, path, headers):
+        '''
+        处理一个 GET 请求
+
+        Args:
+            path (str): 请求路径，如 /report/2024/1、/charts/2024/1
+            headers (dict): 小写键的请求头
+
+        Returns:
+            tuple: (状态码, 页面内容, ETag)
+        '''
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            months = await asyncio.get_running_loop().run_in_executor(None, self.months)
+            return 200, self._index_page(months), None
+        if len(parts) != 3 or parts[0] not in ('report', 'charts'):
+            return 404, '未找到页面', None
+        try:
+            year, month = int(parts[1]), int(parts[2])
+        except ValueError:
+            return 400, '年月格式错误', None
+        if not 1 <= month <= 12:
+            return 400, '年月格式错误', None
+
+        entry = await self.get_report(year, month)
+        if entry is None:
+            return 404, f'未找到 {year}年{month}月 的消费记录。', None
+        etag = f'"{entry["key"]}-{parts[0]}"'
+        if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            return 304, '', etag
+        return 200, entry['report' if parts[0] == 'report' else 'charts'], etag
+
+    async def handle(self, reader, writer):
+        '''
+        处理一个 HTTP 连接，每个连接只处理一个请求
+        '''
+        try:
+            request_line = (await reader.readline()).decode('latin-1').strip()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            parts = request_line.split()
+            # 空请求行（如只建立连接的探测）没有方法，按格式错误处理
+            method = parts[0] if parts else ''
+            etag = None
+            if len(parts) != 3:
+                status, body = 400, '请求格式错误'
+            elif method not in ('GET', 'HEAD'):
+                status, body = 405, '只支持 GET 请求'
+            else:
+                try:
+                    status, body, etag = await self.route(urlsplit(parts[1]).path, headers)
+                except Exception as e:
+                    status, body = 500, f'生成报告失败：{html.escape(str(e))}'
+
+            payload = body.encode('utf-8')
+            response = [f'HTTP/1.1 {status} {STATUS_TEXT[status]}',
+                        'Content-Type: text/html; charset=utf-8',
+                        f'Content-Length: {len(payload) if status != 304 else 0}',
+                        'Cache-Control: no-cache',
+                        'Connection: close']
+            if etag:
+                response.append(f'ETag: {etag}')
+            writer.write(('\r\n'.join(response) + '\r\n\r\n').encode('latin-1'))
+            if status != 304 and method != 'HEAD':
+                writer.write(payload)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        '''
+        启动服务并一直运行
+
+        Args:
+            host (str): 监听地址
+            port (int): 监听端口
+        '''
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f'消费报告服务已启动: http://{host}:{port}/')
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host=HOST, port=PORT):
+        '''
+        serve 的同步入口，参数相同
+        '''
+        asyncio.run(self.serve(host, port))
+
+# %%
+# --------------------------
+# 使用示例
+# --------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='本地消费报告服务')
+    parser.add_argument('--host', default=HOST, help='监听地址')
+    parser.add_argument('--port', type=int, default=PORT, help='监听端口')
+    parser.add_argument('--model', help='使用的模型')
+    parser.add_argument('--ledger', nargs='?', const=LS.LEDGER_PATH,
+                        help='使用只追加的账本，启动时导入 Excel 中新增的行')
+    args = parser.parse_args()
+
+    ledger = None
+    if args.ledger:
+        ledger = LS.LedgerStore(args.ledger)
+        print(f'从 {CR.DATA_PATH} 导入新增记录 {ledger.import_excel(CR.DATA_PATH)} 条')
+    ReportService(model=args.model, ledger=ledger).run(args.host, args.port)
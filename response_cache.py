@@ -0,0 +1,134 @@
+# response_cache.py
+
+# 导入所需库
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# 默认缓存路径
+CACHE_PATH = Path('./cache/llm_responses.sqlite')
+
+# 模型回复的本地持久化缓存
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=256 * 1024 * 1024, ttl=None):
+        '''
+        以完整请求的哈希为键、SQLite为存储的模型回复缓存
+        :param path: 缓存数据库路径
+        :param max_bytes: 缓存内容的总大小上限，超出时按最近最少使用淘汰
+        :param ttl: 缓存有效期（秒），为 None 时永不过期
+        '''
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)')
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def make_key(**request):
+        '''
+        计算请求的键，参数完全相同的请求得到相同的键
+        :param request: 请求参数，如 model、system_prompt、prompt、temperature、max_tokens
+        :return: 十六进制的 sha256 哈希
+        '''
+        payload = json.dumps(request, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''
+        读取缓存的回复
+        :param key: 请求的键
+        :return: 缓存的回复文本，未命中或已过期时返回 None
+        '''
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT response, size, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, size, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._total_bytes -= size
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            return response
+
+    def set(self, key, response):
+        '''
+        写入回复，必要时淘汰最久未使用的条目
+        :param key: 请求的键
+        :param response: 回复文本
+        '''
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._total_bytes -= row[0]
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, response, size, now, now)
+            )
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        # 按最近访问时间从旧到新删除，直到总大小回到上限以内
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                'SELECT key, size FROM responses ORDER BY accessed LIMIT 64'
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            for key, size in rows:
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def clear(self):
+        '''清空缓存与计数'''
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        '''
+        缓存统计信息
+        :return: 包含命中数、未命中数、命中率、条目数与总大小的字典
+        '''
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': self._total_bytes
+        }
+
+    def close(self):
+        '''关闭数据库连接'''
+        self._conn.close()
@@ -0,0 +1,441 @@
+# rewrite_pipeline.py
+
+# 导入所需库
+import hashlib
+import html
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import AIUESAGENT as AT
+import Env
+import epub_writer as EW
+import operating_ebook as OE
+import scene_splitter as SS
+
+# 参数设置
+JOURNAL_PATH = Path('./cache/rewrite_journal.sqlite') # 任务日志路径
+OUTPUT_PATH = Path('./output/rewrite.epub') # 重构后的电子书路径，不覆盖源文件
+
+REWRITE_PROMPT = '''你是一名网络小说编辑，请润色下面的小说片段：保留原有的人物、情节与场景顺序，删去重复、拖沓和不合时宜的语句，让语言更加流畅、符合当下读者的口味。
+只输出润色后的正文，每个段落占一行，不要添加任何说明。'''
+IMAGE_PROMPT = '''你是一名插画师助手，请从下面的小说章节中提取生成插图所需的关键信息，以JSON格式输出：
+{"roles": [{"name": 角色名, "gender": 性别, "identity": 角色身份与性质, "ps_feature": 身体特征, "clothing": 服装与配饰, "act_an_exprs": 动作与表情}],
+ "scenes": [{"envir": 环境场景, "role_number": 角色数量, "LSandP": 光影与视角, "complete_style": 整体风格}]}
+只输出JSON，不要添加任何说明。'''
+
+def content_hash(*parts):
+    """
+    计算若干文本片段的内容哈希，用于判断阶段的输入是否变化
+
+    Args:
+        *parts (str): 参与计算的文本
+
+    Returns:
+        str: 十六进制的 sha256 哈希
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+# 任务日志
+class Journal:
+    """
+    记录每个章节每个阶段结果的本地日志，以输入内容的哈希判断结果是否仍然有效
+
+    Args:
+        path (Path): 日志数据库路径
+    """
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS stages ('
+            'chapter INTEGER NOT NULL, stage TEXT NOT NULL, input_hash TEXT NOT NULL, '
+            'output TEXT NOT NULL, finished REAL NOT NULL, PRIMARY KEY (chapter, stage))'
+        )
+
+    def get(self, chapter_index, stage, input_hash):
+        """
+        读取阶段结果
+
+        Args:
+            chapter_index (int): 章节序号
+            stage (str): 阶段名
+            input_hash (str): 本次输入的哈希
+
+        Returns:
+            结果对象，没有记录或输入已变化时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT input_hash, output FROM stages WHERE chapter = ? AND stage = ?',
+                (chapter_index, stage)
+            ).fetchone()
+        if row is None or row[0] != input_hash:
+            return None
+        return json.loads(row[1])
+
+    def put(self, chapter_index, stage, input_hash, output):
+        """
+        写入阶段结果，覆盖该章节该阶段的旧结果
+
+        Args:
+            chapter_index (int): 章节序号
+            stage (str): 阶段名
+            input_hash (str): 本次输入的哈希
+            output: 可序列化为JSON的结果
+        """
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO stages (chapter, stage, input_hash, output, finished) VALUES (?, ?, ?, ?, ?)',
+                (chapter_index, stage, input_hash, json.dumps(output, ensure_ascii=False), time.time())
+            )
+
+    def completed(self, stage):
+        """
+        获取某阶段全部已完成的结果
+
+        Args:
+            stage (str): 阶段名
+
+        Returns:
+            dict: 以章节序号为键的结果字典
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT chapter, output FROM stages WHERE stage = ?', (stage,)).fetchall()
+        return {chapter: json.loads(output) for chapter, output in rows}
+
+    def close(self):
+        """关闭数据库连接"""
+        self._conn.close()
+
+def text_to_html(title, text):
+    """
+    将纯文本章节转换为XHTML正文
+
+    Args:
+        title (str): 章节标题
+        text (str): 纯文本，每个段落占一行
+
+    Returns:
+        str: 章节内容（HTML格式）
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if lines and lines[0] == title:
+        lines = lines[1:]
+    body = ''.join(f'<p>{html.escape(line)}</p>' for line in lines)
+    return f'<h1>{html.escape(title)}</h1>{body}'
+
+def join_segments(replies):
+    """
+    拼接各片段的润色结果
+
+    Args:
+        replies (list): 按片段顺序排列的模型回复
+
+    Returns:
+        str: 整章的润色结果
+    """
+    return '\n'.join(reply.strip() for reply in replies)
+
+def parse_image_prompts(reply):
+    """
+    解析插图信息提取的回复
+
+    Args:
+        reply (str): 模型回复
+
+    Returns:
+        dict: 解析出的JSON，无法解析时为 {'raw': 回复原文}
+    """
+    try:
+        return json.loads(reply)
+    except (TypeError, ValueError):
+        return {'raw': reply}
+
+def merge_image_prompts(replies):
+    """
+    合并一章各片段的插图信息提取结果：同名角色只保留一份，缺少的字段由后面片段补齐，场景按片段顺序排列
+
+    Args:
+        replies (list): 按片段顺序排列的模型回复
+
+    Returns:
+        dict: 合并后的 {'roles': [...], 'scenes': [...]}，无法解析的回复原文以换行拼接在 'raw' 中；
+              只有一个片段时与 parse_image_prompts 的结果相同
+    """
+    replies = list(replies)
+    if len(replies) == 1:
+        return parse_image_prompts(replies[0])
+    merged = {'roles': [], 'scenes': []}
+    roles = {}
+    raw = []
+    for reply in replies:
+        parsed = parse_image_prompts(reply)
+        if not isinstance(parsed, dict) or 'raw' in parsed:
+            raw.append(str(reply))
+            continue
+        for role in parsed.get('roles') or []:
+            if not isinstance(role, dict):
+                continue
+            existing = roles.get(role.get('name'))
+            if existing is None:
+                role = dict(role)
+                merged['roles'].append(role)
+                if role.get('name'):
+                    roles[role['name']] = role
+                continue
+            for field, value in role.items():
+                if value and not existing.get(field):
+                    existing[field] = value
+        merged['scenes'].extend(scene for scene in parsed.get('scenes') or [] if isinstance(scene, dict))
+    if raw:
+        merged['raw'] = '\n'.join(raw)
+    return merged
+
+def print_progress(done, total, result, elapsed):
+    """
+    在终端输出一行处理进度，可作为 RewritePipeline 的 progress 回调
+
+    Args:
+        done (int): 已处理的章节数
+        total (int): 本次需要处理的章节数
+        result (dict): 刚处理完的章节结果
+        elapsed (float): 已用时（秒）
+    """
+    state = '跳过（已完成）' if result['cached'] else '完成'
+    if result.get('duplicate_of') is not None:
+        state = f"跳过（与第{result['duplicate_of']}章近似重复）"
+    print(f"[{done}/{total}] 第{result['index']}章 {state}，"
+          f"已用时 {elapsed:.1f}s，吞吐 {done / max(elapsed, 1e-9) * 60:.1f} 章/分钟")
+
+# 小说重构流水线
+class RewritePipeline:
+    """
+    章节 → 场景划分 → 润色 → 插图信息提取 → 写回电子书 的可续跑流水线
+
+    每个阶段的结果按输入哈希记录在日志中，重新运行时跳过输入未变化的阶段，
+    只有源文本或提示词变化的章节会被重新处理
+
+    Args:
+        agent (AsyncAIUESAgent): 请求模型的异步智能体
+        journal (Journal): 任务日志
+        ebook (EpubBook | ChapterStore): 源电子书，默认为 Env.DATA_PATH 指向的电子书
+        output_path (Path): 写回后的电子书路径
+        rewrite_prompt (str): 润色使用的系统提示词
+        image_prompt (str): 插图信息提取使用的系统提示词
+        max_tokens (int): 每次请求的最大生成长度
+        skip_volume_titles (bool): 是否跳过 Env.LT_VOLUME_IDX 中的卷名章节
+        dedup (DedupIndex): 可选的章节级近似重复索引，同一簇中只处理最靠前的章节，其余章节标记为可删去
+        memory (ContinuityMemory): 可选的前情记忆，给出时润色附上固定长度的前情上下文，每章完成后更新记忆
+        progress (callable): 可选的进度回调，run_async 每处理完一章以 (已处理章数, 总章数, 章节结果, 已用时) 调用，
+            如 print_progress；默认不输出
+    """
+    def __init__(self, agent=None, journal=None, ebook=None, output_path=OUTPUT_PATH,
+                 rewrite_prompt=REWRITE_PROMPT, image_prompt=IMAGE_PROMPT, max_tokens=4096,
+                 skip_volume_titles=True, dedup=None, memory=None, progress=None):
+        self.agent = agent if agent is not None else AT.AsyncAIUESAgent()
+        self.journal = journal if journal is not None else Journal()
+        self.store = OE.get_store(ebook)
+        self.output_path = Path(output_path)
+        self.rewrite_prompt = rewrite_prompt
+        self.image_prompt = image_prompt
+        self.max_tokens = max_tokens
+        self.skip_volume_titles = skip_volume_titles
+        self.dedup = dedup
+        self.memory = memory
+        self.progress = progress
+        # 润色结果与原文长度相近，片段不能超过最大生成长度
+        self.budget = min(SS.prompt_budget(rewrite_prompt, max_tokens), max_tokens)
+        # 插图信息提取只输出JSON，片段只受上下文长度限制
+        self.image_budget = SS.prompt_budget(image_prompt, max_tokens)
+
+    def chapter_indices(self, start=0, stop=None, volume=None):
+        """
+        获取需要处理的章节序号
+
+        Args:
+            start (int): 起始章节序号
+            stop (int): 结束章节序号（不包含）
+            volume (int): 卷序号，给出时忽略 start 与 stop
+
+        Returns:
+            list: 章节序号列表
+        """
+        total = len(self.store)
+        if volume is not None:
+            start, stop = OE.get_volume_range(volume, total)
+        start, stop, _ = slice(start, stop).indices(total)
+        skipped = {int(i) for i in Env.LT_VOLUME_IDX if i >= 0} if self.skip_volume_titles else set()
+        return [i for i in range(start, stop) if i not in skipped]
+
+    def split_chapter(self, chapter_index, text=None, segments=None):
+        """
+        场景划分阶段：读取章节并划分片段，结果记入日志
+
+        Args:
+            chapter_index (int): 章节序号
+            text (str): 已经提取好的章节纯文本，默认从电子书读取
+            segments (list): 已经按 self.budget 划分好的片段，默认在此划分
+
+        Returns:
+            tuple: (章节标题, 本阶段的输入哈希, 片段列表)
+        """
+        if text is None:
+            text = self.store.chapter_info(chapter_index, fields=('content',), as_text=True, cache=False)['content']
+        title = text.splitlines()[0] if text else f'Chapter {chapter_index + 1}'
+
+        split_hash = content_hash(text, self.budget)
+        journaled = self.journal.get(chapter_index, 'split', split_hash)
+        if journaled is not None:
+            segments = journaled
+        else:
+            if segments is None:
+                segments = SS.pack_segments(text, self.budget)
+            self.journal.put(chapter_index, 'split', split_hash, segments)
+        return title, split_hash, segments
+
+    def rewrite_hash(self, split_hash):
+        """润色阶段的输入哈希：片段、提示词、模型与生成长度"""
+        return content_hash(split_hash, self.rewrite_prompt, self.agent.model, self.max_tokens)
+
+    def image_hash(self, rewrite_hash, rewritten):
+        """插图信息提取阶段的输入哈希：润色结果、提示词、模型与片段预算"""
+        return content_hash(rewrite_hash, rewritten, self.image_prompt, self.agent.model, self.image_budget)
+
+    def image_segments(self, rewritten):
+        """
+        将润色结果按 self.image_budget 划分为插图信息提取的片段，片段尽量在场景边界处断开
+
+        Args:
+            rewritten (str): 整章的润色结果
+
+        Returns:
+            list: 片段文本列表，至少包含一个片段
+        """
+        segments = SS.pack_segments(rewritten, self.image_budget, respect_scenes=True)
+        return [segment['text'] for segment in segments] or [rewritten]
+
+    async def process_chapter(self, chapter_index, context='', text=None, segments=None):
+        """
+        处理一个章节的全部阶段，已完成且输入未变化的阶段直接读取日志
+
+        Args:
+            chapter_index (int): 章节序号
+            context (str): 附加在润色提示词前的上下文（如前文梗概），不参与输入哈希；
+                为空且给出了前情记忆时使用记忆生成的上下文
+            text (str): 已经提取好的章节纯文本，默认从电子书读取
+            segments (list): 已经按 self.budget 划分好的片段，默认在此划分
+
+        Returns:
+            dict: 包含 'index'、'title'、'rewritten'、'image_prompts' 与 'cached'（全部阶段都命中日志）的字典；
+                  近似重复的章节不请求模型，'rewritten' 为 None，'duplicate_of' 为所在簇的代表章节
+        """
+        if self.dedup is not None:
+            representative = self.dedup.duplicates().get(chapter_index)
+            if representative is not None:
+                title = self.store.chapter_info(chapter_index, fields=('title',))['title']
+                return {'index': chapter_index, 'title': title, 'rewritten': None, 'image_prompts': None,
+                        'cached': True, 'duplicate_of': representative}
+
+        # 1. 场景划分
+        title, split_hash, segments = self.split_chapter(chapter_index, text, segments)
+        cached = True
+
+        # 2. 润色
+        rewrite_hash = self.rewrite_hash(split_hash)
+        rewritten = self.journal.get(chapter_index, 'rewrite', rewrite_hash)
+        if rewritten is None:
+            cached = False
+            if not context and self.memory is not None:
+                context = await self.memory.context(chapter_index)
+            prompts = [f'{context}\n\n{segment["text"]}' if context else segment['text'] for segment in segments]
+            replies = await self.agent.map(prompts, self.rewrite_prompt, max_tokens=self.max_tokens)
+            rewritten = join_segments(replies)
+            self.journal.put(chapter_index, 'rewrite', rewrite_hash, rewritten)
+        if self.memory is not None:
+            await self.memory.update(chapter_index, rewritten)
+
+        # 3. 插图信息提取
+        image_hash = self.image_hash(rewrite_hash, rewritten)
+        image_prompts = self.journal.get(chapter_index, 'image_prompts', image_hash)
+        if image_prompts is None:
+            cached = False
+            replies = await self.agent.map(self.image_segments(rewritten), self.image_prompt, max_tokens=self.max_tokens)
+            image_prompts = merge_image_prompts(replies)
+            self.journal.put(chapter_index, 'image_prompts', image_hash, image_prompts)
+
+        return {'index': chapter_index, 'title': title, 'rewritten': rewritten,
+                'image_prompts': image_prompts, 'cached': cached}
+
+    def write_back(self, results, streaming=False):
+        """
+        将润色结果一次性写回电子书
+
+        Args:
+            results (list): process_chapter 返回的结果列表
+            streaming (bool): 是否用 epub_writer 逐章流式写出，不把整本书读入内存；需要电子书有源文件
+
+        Returns:
+            Path: 写入的文件路径
+        """
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        if streaming and self.store.path is not None:
+            overrides = {result['index']: text_to_html(result['title'], result['rewritten'])
+                         for result in results if result['rewritten'] is not None}
+            return EW.write_book(self.output_path, self.store, overrides)
+        # 在源文件的新副本上写回，保持源章节不变，重新运行时输入哈希仍然一致
+        target = OE.ChapterStore(self.store.path) if self.store.path is not None else self.store
+        editor = OE.ChapterEditor(target, output_path=self.output_path)
+        for result in results:
+            # 近似重复的章节保持原文，由 duplicate_of 标记供人工删去
+            if result['rewritten'] is not None:
+                editor.stage(result['index'], text_to_html(result['title'], result['rewritten']))
+        return editor.commit()
+
+    async def run_async(self, start=0, stop=None, volume=None, write_back=True):
+        """
+        依次处理章节范围内的全部章节，并在最后写回电子书
+
+        Args:
+            start (int): 起始章节序号
+            stop (int): 结束章节序号（不包含）
+            volume (int): 卷序号，给出时忽略 start 与 stop
+            write_back (bool): 是否写回电子书
+
+        Returns:
+            list: 每个章节的处理结果
+        """
+        indices = self.chapter_indices(start, stop, volume)
+        results = []
+        begin = time.perf_counter()
+        for done, chapter_index in enumerate(indices, 1):
+            result = await self.process_chapter(chapter_index)
+            results.append(result)
+            if self.progress is not None:
+                self.progress(done, len(indices), result, time.perf_counter() - begin)
+        if write_back and results:
+            self.write_back(results)
+        return results
+
+    def run(self, start=0, stop=None, volume=None, write_back=True):
+        """
+        run_async 的同步入口，参数相同
+        """
+        return AT.run(self.run_async(start, stop, volume, write_back))
+
+# 示例使用
+if __name__ == "__main__":
+    # 处理第二卷，中断后重新运行会跳过已完成的章节
+    # pipeline = RewritePipeline(agent=AT.AsyncAIUESAgent(concurrency=4, rpm=60), progress=print_progress)
+    # pipeline.run(volume=2)
+
+    pass
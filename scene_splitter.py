@@ -0,0 +1,182 @@
+# scene_splitter.py
+
+# 导入所需库
+import re
+
+import operating_ebook as OE
+import tokens as TK
+
+# 场景分隔行，例如 "***"、"———"、"※※※"
+_SCENE_BREAK = re.compile(r'^[\s*＊\-—─=＝~～·•※#＃]{3,}$')
+# 句末标点（含其后的引号与括号），超长段落在这里断开
+_SENTENCE_END = re.compile(r'(?<=[。！？!?…；;])[”’」』）)]*')
+# 每个段落拼接时额外占用的token（换行符）
+_JOIN_TOKENS = 1
+
+def prompt_budget(system_prompt='', max_tokens=2048, context_window=TK.context_window, reserve=256):
+    """
+    计算一次请求中可以留给正文的token数
+
+    Args:
+        system_prompt (str): 系统提示词
+        max_tokens (int): 为模型回复预留的最大生成长度
+        context_window (int): 模型上下文长度
+        reserve (int): 额外预留给提示词模板与估算误差的token数
+
+    Returns:
+        int: 正文可用的token数
+    """
+    budget = context_window - max_tokens - TK.estimate_tokens(system_prompt) - reserve
+    if budget <= 0:
+        raise ValueError(f"上下文长度不足，max_tokens={max_tokens} 与系统提示词已占满 {context_window} 个token")
+    return budget
+
+def split_scenes(text):
+    """
+    按场景分隔行将章节纯文本划分为场景，每个场景为段落列表
+
+    Args:
+        text (str): 章节纯文本，每个段落占一行
+
+    Returns:
+        list: 场景列表，每个元素为该场景的段落列表
+    """
+    scenes = [[]]
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if _SCENE_BREAK.match(line):
+            if scenes[-1]:
+                scenes.append([])
+            continue
+        scenes[-1].append(line)
+    return [scene for scene in scenes if scene]
+
+def scene_ranges(text):
+    """
+    按场景分隔行划分场景，给出每个场景在 text.splitlines() 中的行号范围
+
+    Args:
+        text (str): 章节纯文本，每个段落占一行
+
+    Returns:
+        list: (起始行号, 结束行号) 列表，结束行号不包含；与 split_scenes 的场景一一对应
+    """
+    ranges = []
+    start = stop = None
+    for line_index, line in enumerate(text.splitlines()):
+        line = line.strip()
+        if not line:
+            continue
+        if _SCENE_BREAK.match(line):
+            if start is not None:
+                ranges.append((start, stop))
+                start = None
+            continue
+        if start is None:
+            start = line_index
+        stop = line_index + 1
+    if start is not None:
+        ranges.append((start, stop))
+    return ranges
+
+def _split_sentences(paragraph):
+    # 在句末标点之后断开，保留标点
+    pieces = []
+    start = 0
+    for match in _SENTENCE_END.finditer(paragraph):
+        end = match.end()
+        if end > start:
+            pieces.append(paragraph[start:end])
+            start = end
+    if start < len(paragraph):
+        pieces.append(paragraph[start:])
+    return pieces
+
+def _split_oversized(text, budget):
+    # 单句仍超出预算时按字符硬切，保证任何片段都不会超出预算
+    pieces = []
+    for sentence in _split_sentences(text):
+        if TK.estimate_tokens(sentence) + _JOIN_TOKENS <= budget:
+            pieces.append(sentence)
+            continue
+        # 每个字符最多估为一个token，按字符数切分即可
+        width = budget - _JOIN_TOKENS
+        pieces.extend(sentence[i:i + width] for i in range(0, len(sentence), width))
+    return pieces
+
+def pack_segments(text, budget, respect_scenes=False):
+    """
+    将章节纯文本按段落贪心地装入不超过预算的片段，使请求次数尽可能少
+
+    段落按顺序依次放入当前片段，放不下时开启新片段；超出预算的段落先按句子、再按字符拆开
+
+    Args:
+        text (str): 章节纯文本，每个段落占一行
+        budget (int): 每个片段的token上限，通常由 prompt_budget 计算
+        respect_scenes (bool): 为 True 时片段只在场景边界处断开，单个场景超出预算时才在场景内部断开
+
+    Returns:
+        list: 片段列表，每个元素为包含 'text'、'tokens'、'scenes' 的字典，'scenes' 为片段覆盖的场景序号
+    """
+    # 每个字符加上换行至少占 _JOIN_TOKENS + 1 个token，更小的预算装不下任何文字
+    if budget <= _JOIN_TOKENS:
+        raise ValueError(f"预算过小，每个片段至少需要 {_JOIN_TOKENS + 1} 个token，当前为 {budget}")
+    segments = []
+    lines, tokens, scenes = [], 0, []
+
+    def flush():
+        nonlocal lines, tokens, scenes
+        if lines:
+            segments.append({'text': '\n'.join(lines), 'tokens': tokens, 'scenes': scenes})
+        lines, tokens, scenes = [], 0, []
+
+    for scene_index, scene in enumerate(split_scenes(text)):
+        units = []
+        for paragraph in scene:
+            cost = TK.estimate_tokens(paragraph) + _JOIN_TOKENS
+            if cost <= budget:
+                units.append((paragraph, cost))
+            else:
+                units.extend((piece, TK.estimate_tokens(piece) + _JOIN_TOKENS)
+                             for piece in _split_oversized(paragraph, budget))
+
+        if respect_scenes:
+            scene_cost = sum(cost for _, cost in units)
+            if tokens + scene_cost > budget:
+                flush()
+
+        for unit, cost in units:
+            if tokens + cost > budget:
+                flush()
+            lines.append(unit)
+            tokens += cost
+            if not scenes or scenes[-1] != scene_index:
+                scenes.append(scene_index)
+    flush()
+    return segments
+
+def split_chapter(chapter_index, system_prompt='', max_tokens=2048, budget=None, respect_scenes=False, ebook=None):
+    """
+    读取章节纯文本并划分为适合一次请求的片段
+
+    Args:
+        chapter_index (int | str): 章节索引，也可以是章节的ID、文件名或标题
+        system_prompt (str): 处理片段时使用的系统提示词
+        max_tokens (int): 为模型回复预留的最大生成长度
+        budget (int): 每个片段的token上限，默认由 prompt_budget 计算
+        respect_scenes (bool): 是否只在场景边界处断开
+        ebook (EpubBook | ChapterStore): 操作指向的目标电子书，默认为 Env.DATA_PATH 指向的电子书
+
+    Returns:
+        list: 片段列表，格式同 pack_segments
+    """
+    store = OE.get_store(ebook)
+    index = store.locate(chapter_index)
+    if index is None:
+        raise IndexError(f"章节索引超出范围，总章节数: {len(store)}")
+    if budget is None:
+        budget = prompt_budget(system_prompt, max_tokens)
+    text = store.chapter_info(index, fields=('content',), as_text=True, cache=False)['content']
+    return pack_segments(text, budget, respect_scenes)
@@ -0,0 +1,101 @@
+# conftest.py
+
+# 导入所需库
+import random
+
+import pandas as pd
+import pytest
+from ebooklib import epub
+
+# 参数设置
+HEADER = ['日期', '星期', '总支出/天', '总收入/天', '结余', '备注', '餐饮', '餐饮', '交通', '购物', '工资', '兼职', '理财', '其他收入']
+SUBHEADER = [None, None, None, None, None, None, '早餐', '午晚餐', None, None, None, None, None, None]
+
+def ledger_rows(days, start='2024-01-01'):
+    """
+    生成与 cost_data.xlsx 表头相同的数据行，金额由日期序号决定
+
+    Args:
+        days (int): 天数
+        start (str): 起始日期
+
+    Returns:
+        list: 数据行
+    """
+    rows = []
+    for offset, day in enumerate(pd.date_range(start, periods=days)):
+        expenses = [round(1.1 * (offset % 7), 2), 12.35, None if offset % 3 else 8.8, 0.1 * offset]
+        incomes = [8000.0 if day.day == 10 else 0.0, 0.3, 0.0, 0.0]
+        expense = round(sum(value for value in expenses if value is not None), 2)
+        income = sum(incomes)
+        rows.append([int(day.strftime('%Y%m%d')), day.dayofweek, expense, income, income - expense,
+                     '备注' if offset % 5 == 0 else (12 if offset % 5 == 1 else None)] + expenses + incomes)
+    return rows
+
+def write_ledger(path, rows):
+    """
+    写出两行表头的账本
+
+    Args:
+        path (Path): Excel 文件路径
+        rows (list): 数据行
+
+    Returns:
+        Path: Excel 文件路径
+    """
+    pd.DataFrame([SUBHEADER] + rows, columns=HEADER).to_excel(path, index=False)
+    return path
+
+@pytest.fixture
+def ledger_file(tmp_path):
+    return write_ledger(tmp_path / 'cost_data.xlsx', ledger_rows(70))
+
+def random_text(seed, chars=600, paragraph=60):
+    """
+    生成可复现的随机中文文本，每段一行
+
+    Args:
+        seed (int): 随机种子
+        chars (int): 字数
+        paragraph (int): 每段字数
+
+    Returns:
+        str: 文本
+    """
+    rng = random.Random(seed)
+    alphabet = [chr(code) for code in range(0x4e00, 0x4e00 + 2000)]
+    text = ''.join(rng.choice(alphabet) for _ in range(chars))
+    return '\n'.join(text[i:i + paragraph] for i in range(0, len(text), paragraph))
+
+def write_book(path, texts, nav_first=False):
+    """
+    用 ebooklib 写出每个文本一章的电子书
+
+    Args:
+        path (Path): 电子书路径
+        texts (list): 各章节的纯文本，每段一行
+        nav_first (bool): 为 True 时目录页在清单中排在各章节之前
+
+    Returns:
+        Path: 电子书路径
+    """
+    book = epub.EpubBook()
+    book.set_identifier('test-book')
+    book.set_title('测试')
+    book.set_language('zh')
+    nav = epub.EpubNav()
+    if nav_first:
+        book.add_item(nav)
+    chapters = []
+    for number, text in enumerate(texts, 1):
+        chapter = epub.EpubHtml(title=f'第{number}章', file_name=f'chapter_{number}.xhtml', lang='zh')
+        chapter.content = f'<h2>第{number}章</h2>' + ''.join(f'<p>{line}</p>' for line in text.splitlines())
+        book.add_item(chapter)
+        chapters.append(chapter)
+    book.toc = chapters
+    book.add_item(epub.EpubNcx())
+    if not nav_first:
+        book.add_item(nav)
+    book.spine = ['nav'] + chapters
+    epub.write_epub(str(path), book)
+    return path
@@ -0,0 +1,247 @@
+# test_aiuesagent.py
+
+# 导入所需库
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import AIUESAGENT as AT
+import response_cache as RC
+from llm_metrics import MetricsRecorder
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(AT.time, 'monotonic', clock)
+    return clock
+
+def test_rate_limiter_queues_requests_in_order(clock):
+    limiter = AT.RateLimiter(rpm=60)
+    assert [limiter.reserve() for _ in range(60)] == [0.0] * 60
+    # 额度用完后按到达顺序排队，每次请求多等一秒
+    assert [limiter.reserve() for _ in range(3)] == pytest.approx([1.0, 2.0, 3.0])
+    clock.now += 3.0
+    assert limiter.reserve() == pytest.approx(1.0)
+
+def test_rate_limiter_tokens_and_refund(clock):
+    limiter = AT.RateLimiter(tpm=600)
+    assert limiter.reserve(600) == 0.0
+    assert limiter.reserve(300) == pytest.approx(30.0)
+    # 实际用量少于预扣时退还多扣的部分
+    limiter.refund(450)
+    assert limiter.reserve(100) == pytest.approx(0.0)
+    clock.now += 60.0
+    # 额度最多补充到一分钟的上限
+    assert limiter.reserve(600) == 0.0
+    assert limiter.reserve(60) == pytest.approx(6.0)
+
+def test_rate_limiter_unlimited():
+    limiter = AT.RateLimiter()
+    assert limiter.reserve(10 ** 9) == 0.0
+    asyncio.run(limiter.acquire(10 ** 9))
+
+def test_rate_limiter_waits_outside_lock_and_refunds_on_cancel():
+    limiter = AT.RateLimiter(rpm=60)
+    for _ in range(60):
+        limiter.reserve()
+
+    async def run():
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.05)
+        # 等待中的请求不持有锁，其他请求可以立即预扣
+        assert not limiter._lock.locked()
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(run())
+    # 被取消的请求退还了额度，下一次请求不必排在它之后
+    assert limiter.reserve() == pytest.approx(1.0, abs=0.1)
+
+def test_run_closes_async_clients():
+    agent = AT.AsyncAIUESAgent(api_key='test', base_url='http://127.0.0.1:9')
+
+    async def use():
+        client = agent.client
+        assert agent.client is client
+        return client
+
+    client = AT.run(use())
+    assert client.is_closed()
+
+    async def reopen():
+        first = agent.client
+        await agent.aclose()
+        return first, agent.client
+
+    first, second = AT.run(reopen())
+    assert first.is_closed() and second.is_closed()
+    assert first is not second
+
+def test_route_model_prefers_requested_then_reasoning():
+    assert AT.route_model('m', True, 'default', 'think') == 'm'
+    assert AT.route_model(None, True, 'default', 'think') == 'think'
+    assert AT.route_model('', False, 'default', 'think') == 'default'
+    assert AT.route_model() == AT.model
+
+def test_sync_clients_are_shared_across_agents_and_threads():
+    AT.close_clients()
+    first = AT.AIUESAgent(api_key='test', base_url='http://127.0.0.1:9')
+    second = AT.AIUESAgent(api_key='test', base_url='http://127.0.0.1:9', model='other')
+    assert first.client is second.client
+    with ThreadPoolExecutor(4) as pool:
+        clients = set(pool.map(lambda _: AT.get_client('test', 'http://127.0.0.1:9'), range(8)))
+    assert clients == {first.client}
+    assert AT.get_client('test', 'http://127.0.0.1:9', timeout=5) is not first.client
+    assert AT.get_client('other', 'http://127.0.0.1:9') is not first.client
+
+    AT.close_clients()
+    assert first.client.is_closed()
+    assert AT.get_client('test', 'http://127.0.0.1:9') is not first.client
+    AT.close_clients()
+
+def test_async_clients_are_per_event_loop():
+    async def clients():
+        return AT.get_async_client('test', 'http://127.0.0.1:9'), AT.get_async_client('test', 'http://127.0.0.1:9')
+
+    first, same = AT.run(clients())
+    second, _ = AT.run(clients())
+    assert first is same
+    assert first is not second
+
+class FakeCompletions:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.models = []
+
+    def create(self, model, **kwargs):
+        self.models.append(model)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        if kwargs.get('stream'):
+            return FakeStream(outcome)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))],
+                               usage=SimpleNamespace(prompt_tokens=3, completion_tokens=5))
+
+class FakeStream:
+    # 每个片段一个字，最后一个片段只携带用量
+    def __init__(self, text):
+        self.text = text
+        self.closed = False
+
+    def __iter__(self):
+        for char in self.text:
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=char))])
+        yield SimpleNamespace(usage=SimpleNamespace(prompt_tokens=3, completion_tokens=len(self.text)), choices=[])
+
+    def close(self):
+        self.closed = True
+
+class FakeClient:
+    max_retries = 2
+
+    def __init__(self, outcomes):
+        self.chat = SimpleNamespace(completions=FakeCompletions(outcomes))
+
+    def with_options(self, **options):
+        return self
+
+REQUEST = SimpleNamespace(method='POST', url='http://test/chat/completions')
+
+def rate_limited():
+    response = SimpleNamespace(request=REQUEST, status_code=429, headers={'retry-after': '0'})
+    return openai.RateLimitError('rate limited', response=response, body=None)
+
+def timed_out():
+    return openai.APITimeoutError(request=REQUEST)
+
+@pytest.mark.parametrize('fallback_model', [None, 'fast'])
+def test_sync_metrics_record_retries_without_ttft(fallback_model):
+    metrics = MetricsRecorder()
+    agent = AT.AIUESAgent(api_key='test', base_url='http://test', model='slow', fallback_model=fallback_model,
+                          metrics=metrics)
+    agent.client = FakeClient([rate_limited(), '回复'])
+    assert agent.get_response('你好') == '回复'
+    record, = metrics.records
+    assert record['retries'] == 1
+    assert record['ttft'] is None and record['latency'] is not None
+    assert (record['prompt_tokens'], record['completion_tokens']) == (3, 5)
+
+def test_sync_timeout_falls_back_and_counts_attempt():
+    metrics = MetricsRecorder()
+    agent = AT.AIUESAgent(api_key='test', base_url='http://test', model='slow', fallback_model='fast',
+                          metrics=metrics)
+    agent.client = FakeClient([timed_out(), '回复'])
+    assert agent.get_response('你好') == '回复'
+    assert agent.client.chat.completions.models == ['slow', 'fast']
+    assert metrics.records[0]['model'] == 'fast'
+    assert metrics.records[0]['retries'] == 1
+
+def test_sync_gives_up_after_client_retries():
+    agent = AT.AIUESAgent(api_key='test', base_url='http://test', model='slow', fallback_model=None)
+    agent.client = FakeClient([rate_limited()] * 3)
+    with pytest.raises(openai.RateLimitError):
+        agent.get_response('你好')
+    assert len(agent.client.chat.completions.models) == 3
+
+def test_async_failed_attempts_return_reserved_tokens(clock, monkeypatch):
+    class FakeAsyncCompletions:
+        def __init__(self):
+            self.outcomes = [rate_limited(), rate_limited(), '回复']
+
+        async def create(self, model, **kwargs):
+            outcome = self.outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))],
+                                   usage=SimpleNamespace(prompt_tokens=2, completion_tokens=8, total_tokens=10))
+
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=FakeAsyncCompletions()))
+    monkeypatch.setattr(AT.AsyncAIUESAgent, 'client', property(lambda self: fake))
+    agent = AT.AsyncAIUESAgent(api_key='test', base_url='http://test', tpm=300, model='fake')
+    assert asyncio.run(agent.get_response('你好', max_tokens=100)) == '回复'
+    # 两次失败的预扣全部退还，只扣除成功请求的实际用量
+    assert agent.limiter._tokens == pytest.approx(290)
+
+def test_stream_replays_cache_and_records_early_stop(tmp_path):
+    metrics = MetricsRecorder()
+    agent = AT.AIUESAgent(api_key='test', base_url='http://test', model='slow', fallback_model=None,
+                          cache=RC.ResponseCache(tmp_path / 'cache.sqlite'), metrics=metrics)
+    agent.client = FakeClient(['一二三', '四五六'])
+    assert ''.join(agent.stream_response('你好')) == '一二三'
+    assert list(agent.stream_response('你好')) == ['一二三']
+    assert agent.client.chat.completions.models == ['slow']
+    assert [record['cached'] for record in metrics.records] == [False, True]
+
+    # 提前停止迭代：记录已生成的部分并关闭连接，不完整的回复不写入缓存
+    stream = agent.stream_response('再见')
+    assert next(stream) == '四'
+    stream.close()
+    record = metrics.records[-1]
+    assert record['stream'] and not record['cached'] and record['ttft'] is not None
+    assert record['completion_tokens'] == AT.estimate_tokens('四')
+    assert agent.cache.get(agent.cache.make_key(model='slow', system_prompt='', prompt='再见',
+                                                temperature=0.7, max_tokens=2048)) is None
+
+def test_calls_route_between_default_and_reasoning_models():
+    agent = AT.AIUESAgent(api_key='test', base_url='http://test', model='default', reasoning_model='think',
+                          fallback_model='default')
+    agent.client = FakeClient(['一', '二', '三', timed_out(), '四'])
+    agent.get_response('你好')
+    agent.get_response('你好', reasoning=True)
+    agent.get_response('你好', reasoning=True, model='chosen')
+    # 推理模型超时后回退到较快的默认模型
+    assert agent.get_response('你好', reasoning=True) == '四'
+    assert agent.client.chat.completions.models == ['default', 'think', 'chosen', 'think', 'default']
+    assert agent.batch_request('id', '你好', reasoning=True)['body']['model'] == 'think'
@@ -0,0 +1,64 @@
+# test_batch_jobs.py
+
+# 导入所需库
+import asyncio
+import json
+
+import AIUESAGENT as AT
+import Env
+import operating_ebook as OE
+import rewrite_pipeline as RP
+from batch_jobs import RewriteBatch, parse_custom_id
+from tests.conftest import random_text, write_book
+
+def rewrite_reply(body):
+    return '润色' + body['messages'][-1]['content']
+
+def image_reply(body):
+    return json.dumps({'roles': [{'name': body['messages'][-1]['content'][:2]}], 'scenes': []}, ensure_ascii=False)
+
+def test_export_fixture_ingest_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(Env, 'LT_VOLUME_IDX', [0, -1])
+    store = OE.ChapterStore(write_book(tmp_path / 'book.epub', [random_text(seed, 120, 30) for seed in range(3)],
+                                       nav_first=True))
+    agent = AT.AsyncAIUESAgent(api_key='test', base_url='http://127.0.0.1:9', model='fake')
+    pipeline = RP.RewritePipeline(agent=agent, journal=RP.Journal(tmp_path / 'journal.sqlite'), ebook=store)
+    # 标题与各段落分别装入4个片段，每章对应多个请求
+    pipeline.budget = 40
+    batch = RewriteBatch(pipeline)
+
+    requests_path, count = batch.export(tmp_path / 'rewrite.jsonl')
+    AT.fixture_batch_results(requests_path, tmp_path / 'results.jsonl', rewrite_reply)
+    with open(tmp_path / 'results.jsonl', encoding='utf-8') as f:
+        results = f.readlines()
+    parts = [parse_custom_id(json.loads(line)['custom_id']) for line in results]
+    assert count == len(results) == 12
+    assert sorted({chapter for chapter, _, _, _ in parts}) == [1, 2, 3]
+    # 第3章缺少一个片段，第2章在导出后被修改
+    missing = next(line for line in results if parse_custom_id(json.loads(line)['custom_id'])[0] == 3)
+    with open(tmp_path / 'results.jsonl', 'w', encoding='utf-8') as f:
+        f.writelines(line for line in results if line is not missing)
+    store.set_content(2, '<html><body><h2>第2章</h2><p>导出后修改的内容</p></body></html>')
+
+    summary = batch.ingest(tmp_path / 'results.jsonl')
+    assert summary == {'done': [1], 'incomplete': [3], 'stale': [2], 'errors': {}}
+    _, split_hash, segments = pipeline.split_chapter(1)
+    assert pipeline.journal.get(1, 'rewrite', pipeline.rewrite_hash(split_hash)) == \
+        '\n'.join('润色' + segment['text'] for segment in segments)
+    # 再次导出时只包含未完成的章节
+    assert sorted({parse_custom_id(request['custom_id'])[0] for request in batch.requests()}) == [2, 3]
+
+    # 插图信息提取阶段只导出润色已完成的章节
+    requests_path, _ = batch.export(tmp_path / 'images.jsonl', stage='image_prompts')
+    AT.fixture_batch_results(requests_path, tmp_path / 'image_results.jsonl', image_reply)
+    assert batch.ingest(tmp_path / 'image_results.jsonl')['done'] == [1]
+
+    # 导入的结果与流水线按输入哈希记录的一致，处理第1章不再请求模型
+    async def unexpected(*args, **kwargs):
+        raise AssertionError('不应请求模型')
+
+    monkeypatch.setattr(agent, 'map', unexpected)
+    monkeypatch.setattr(agent, 'get_response', unexpected)
+    result = asyncio.run(pipeline.process_chapter(1))
+    assert result['cached']
+    assert result['image_prompts'] == {'roles': [{'name': '润色'}], 'scenes': []}
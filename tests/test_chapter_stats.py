@@ -0,0 +1,40 @@
+# test_chapter_stats.py
+
+# 导入所需库
+import sqlite3
+import threading
+
+from ebooklib import epub
+
+import chapter_stats as ST
+import operating_ebook as OE
+from tests.conftest import random_text, write_book
+
+def test_stats_are_incremental_and_usable_from_other_threads(tmp_path):
+    path = write_book(tmp_path / 'book.epub', [random_text(seed) for seed in range(3)])
+    index = ST.ChapterStatsIndex(OE.ChapterStore(path), tmp_path / 'stats.sqlite')
+    built = []
+    thread = threading.Thread(target=lambda: built.append(index.build()))
+    thread.start()
+    thread.join()
+    assert built == [len(index.store)]
+    assert index.get(1) == {**ST.text_stats(index.store.chapter_info(1, fields=('content',), as_text=True)['content']),
+                            'content_hash': index.get(1)['content_hash']}
+    index.close()
+
+    reopened = ST.ChapterStatsIndex(OE.ChapterStore(path), tmp_path / 'stats.sqlite')
+    assert reopened.build() == 0
+    OE.update_chapter_content(1, '<html><body><p>新的内容</p></body></html>', ebook=reopened.store)
+    assert reopened.get(1)['chars'] == 4
+    reopened.close()
+
+def test_in_memory_books_are_not_persisted(tmp_path):
+    book = epub.read_epub(str(write_book(tmp_path / 'book.epub', [random_text(seed) for seed in range(2)])))
+    index = ST.ChapterStatsIndex(book, tmp_path / 'stats.sqlite')
+    assert index.book is None
+    assert index.build() == len(index.store)
+    assert index.total('chars') > 0
+    index.close()
+    with sqlite3.connect(tmp_path / 'stats.sqlite') as conn:
+        assert conn.execute('SELECT COUNT(*) FROM chapter_stats').fetchone() == (0,)
+        assert conn.execute('SELECT COUNT(*) FROM chapter_books').fetchone() == (0,)
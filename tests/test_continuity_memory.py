@@ -0,0 +1,60 @@
+# test_continuity_memory.py
+
+# 导入所需库
+import asyncio
+
+import pytest
+
+import Env
+from continuity_memory import ContinuityMemory
+from rewrite_pipeline import Journal
+
+class FakeAgent:
+    model = 'fake'
+
+    def __init__(self):
+        self.prompts = []
+
+    async def get_response(self, prompt, system_prompt='', max_tokens=2048):
+        self.prompts.append(prompt)
+        return f'梗概{len(self.prompts)}'
+
+@pytest.fixture
+def memory(tmp_path, monkeypatch):
+    # 三卷，卷名位于 0、4、8，最后一卷到全书结尾
+    monkeypatch.setattr(Env, 'LT_VOLUME_IDX', [0, 4, 8, -1])
+    return ContinuityMemory(FakeAgent(), Journal(tmp_path / 'memory.sqlite'))
+
+def test_snapshot_fixes_book_summary_while_volumes_progress(memory):
+    async def run():
+        for chapter_index in (1, 2):
+            await memory.update(chapter_index, f'第{chapter_index}章')
+        frozen = await memory.snapshot([1, 2])
+        assert frozen == {1: memory.volume_summary(0), 2: memory.volume_summary(0)}
+        first = await memory.context(9)
+        calls = len(memory.agent.prompts)
+        # 第1卷的进度变化不影响第2卷的前情，也不引发全书梗概的合并请求
+        for chapter_index in (5, 6):
+            await memory.update(chapter_index, f'第{chapter_index}章')
+        calls_after_update = len(memory.agent.prompts)
+        assert await memory.context(9) == first
+        assert len(memory.agent.prompts) == calls_after_update > calls
+        memory.release()
+        return first, await memory.context(9)
+
+    frozen_context, released_context = asyncio.run(run())
+    # 第0卷两章的概括为梗概1、梗概2，卷内合并结果为梗概3
+    assert frozen_context == '前几卷梗概：梗概3'
+    # 取消固定后重新并入第1卷
+    assert released_context != frozen_context
+
+def test_snapshot_excludes_running_volumes(memory):
+    async def run():
+        for chapter_index in (1, 5):
+            await memory.update(chapter_index, f'第{chapter_index}章')
+        return await memory.snapshot([1, 2])
+
+    frozen = asyncio.run(run())
+    # 第1卷在本次处理范围内，其旧梗概不进入第2卷的前情
+    assert frozen[2] == frozen[1]
+    assert frozen[2] == '梗概1'
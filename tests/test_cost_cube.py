@@ -0,0 +1,120 @@
+# test_cost_cube.py
+
+# 导入所需库
+import numpy as np
+import pandas as pd
+import pytest
+
+import cost_cube as CC
+import cost_report as CR
+import cost_stats as CS
+
+PERIODS = [(2024, 1), (2024, 2), (2024, 3)]
+
+def baseline_frame(path):
+    # 原先的清洗方式：两行表头合并，金额保持读入时的 float64
+    df = pd.read_excel(path)
+    columns = [low if isinstance(low, str) else up for up, low in zip(df.columns, df.iloc[0, :])]
+    df = df.iloc[1:, :]
+    df.columns = columns
+    df['日期'] = pd.to_datetime(df['日期'], format='%Y%m%d')
+    for i in range(len(df.columns)):
+        if df.columns[i] not in ('日期', '备注'):
+            df.iloc[:, i] = pd.to_numeric(df.iloc[:, i])
+    return df
+
+def baseline_month(df, year, month):
+    # 原先的 extract_monthly_expenses 与 analyze_and_generate_report 中的汇总
+    mask = (df['日期'].dt.year == year) & (df['日期'].dt.month == month)
+    data = df[mask].infer_objects().fillna(0).sort_values('日期').reset_index(drop=True)
+    days = len(data['日期'].dt.date.unique())
+    expense = data['总支出/天'].astype('float64')
+    income = data['总收入/天'].astype('float64')
+    categories = {}
+    for i in range(6, len(df.columns)):
+        values = data.iloc[:, i].astype('float64')
+        categories[df.columns[i]] = categories.get(df.columns[i], 0) + values.sum()
+    total_expense = round(expense.sum(), 2)
+    total_income = round(income.sum(), 2)
+    total_benefit = round(income.sum() - expense.sum(), 2)
+    return {
+        'total_expense': total_expense,
+        'total_income': total_income,
+        'total_benefit': total_benefit,
+        'average_daily_expense': round(total_expense / days, 2),
+        'average_daily_income': round(total_income / days, 2),
+        'average_daily_benefit': round(total_benefit / days, 2),
+        'days': days,
+        'categories': categories,
+        # 饼图中的占比：分类为 df.columns[6:-4]，收入项为 df.columns[-4:]
+        'category_shares': {col: round(categories[col] / total_expense * 100, 2) if total_expense > 0 else 0
+                            for col in df.columns[6:-4]},
+        'income_shares': {col: round(categories[col] / total_income * 100, 2) if total_income > 0 else 0
+                          for col in df.columns[-4:]},
+        'describe': [round(value, 2) for value in (expense.mean(), expense.median(), expense.mode().values[0],
+                                                   expense.max(), expense.min(), expense.var(), expense.std())],
+        'describe_income': [round(value, 2) for value in (income.mean(), income.median(), income.mode().values[0],
+                                                          income.max(), income.min(), income.var(), income.std())],
+    }
+
+def test_statistics_match_baseline(ledger_file):
+    df = CR.proc_washing_data(ledger_file)
+    baseline = baseline_frame(ledger_file)
+    statistics = CS.compute_statistics(df, PERIODS)
+    for period in PERIODS:
+        expected = baseline_month(baseline, *period)
+        totals = statistics['totals'].loc[period]
+        assert totals['总支出金额'] == pytest.approx(expected['total_expense'], abs=1e-6)
+        assert totals['总收入金额'] == pytest.approx(expected['total_income'], abs=1e-6)
+        assert totals['日均支出金额'] == pytest.approx(expected['average_daily_expense'], abs=1e-6)
+        assert totals[CC.DAYS_COLUMN] == expected['days']
+        for column, amount in statistics['category_stats'].loc[period].items():
+            assert amount == pytest.approx(expected['categories'][column], abs=1e-4)
+        assert list(CS.describe_table(statistics, period).loc['消费金额']) == pytest.approx(expected['describe'], abs=0.011)
+
+def test_aggregates_accumulate_in_float64(ledger_file):
+    df = CR.proc_washing_data(ledger_file)
+    assert df[CC.EXPENSE_COLUMN].dtype == np.float32
+    cube = CC.get_cube(df)
+    assert set(cube.daily.dtypes) == {np.dtype('float64')}
+    assert set(cube.monthly.drop(columns=CC.DAYS_COLUMN).dtypes) == {np.dtype('float64')}
+    statistics = CS.compute_statistics(cube, PERIODS)
+    assert set(statistics['category_stats'].dtypes) == {np.dtype('float64')}
+    assert cube.range_totals((2024, 1), (2024, 3))[CC.EXPENSE_COLUMN] == pytest.approx(
+        df[CC.EXPENSE_COLUMN].astype('float64').sum(), abs=1e-9)
+
+def test_cube_rebuilds_for_new_version(ledger_file):
+    df = CR.proc_washing_data(ledger_file)
+    cube = CC.get_cube(df)
+    assert CC.get_cube(df) is cube
+    before = cube.totals(2024, 1)[CC.EXPENSE_COLUMN]
+    df[CC.EXPENSE_COLUMN] += 1
+    # 原地修改后不更换版本时仍是修改前的汇总
+    assert CC.get_cube(df).totals(2024, 1)[CC.EXPENSE_COLUMN] == before
+    rebuilt = CC.get_cube(df, version=1)
+    assert rebuilt is not cube
+    assert rebuilt.totals(2024, 1)[CC.EXPENSE_COLUMN] == pytest.approx(before + 31, abs=1e-3)
+    assert CC.get_cube(df, version=1) is rebuilt
+    CC.invalidate(df)
+    assert CC.get_cube(df, version=1) is not rebuilt
+
+def test_statistics_match_baseline_income_and_shares(ledger_file):
+    df = CR.proc_washing_data(ledger_file)
+    baseline = baseline_frame(ledger_file)
+    # 一次计算多个年月，其中一个年月没有记录
+    statistics = CS.compute_statistics(df, PERIODS + [(2024, 6)])
+    for period in PERIODS:
+        expected = baseline_month(baseline, *period)
+        totals = statistics['totals'].loc[period]
+        assert totals['总净收入'] == pytest.approx(expected['total_benefit'], abs=1e-6)
+        assert totals['日均收入金额'] == pytest.approx(expected['average_daily_income'], abs=1e-6)
+        assert totals['日均净收入'] == pytest.approx(expected['average_daily_benefit'], abs=1e-6)
+        for column, amount in statistics['income_stats'].loc[period].items():
+            assert amount == pytest.approx(expected['categories'][column], abs=1e-4)
+        assert dict(statistics['category_shares'].loc[period]) == pytest.approx(expected['category_shares'], abs=0.011)
+        assert dict(statistics['income_shares'].loc[period]) == pytest.approx(expected['income_shares'], abs=0.011)
+        assert list(CS.describe_table(statistics, period).loc['收入金额']) == pytest.approx(expected['describe_income'], abs=0.011)
+    assert list(statistics['totals'].index) == PERIODS + [(2024, 6)]
+    assert statistics['describe']['消费金额'].loc[(2024, 6)].isna().all()
+    compared = CS.compare_table(statistics)
+    assert list(compared['总支出金额'][:3]) == pytest.approx([baseline_month(baseline, *p)['total_expense'] for p in PERIODS])
@@ -0,0 +1,50 @@
+# test_cost_report.py
+
+# 导入所需库
+import pandas as pd
+
+import cost_report as CR
+
+def test_cost_cache_round_trip_with_mixed_remarks(tmp_path, ledger_file):
+    cache_dir = tmp_path / 'cache'
+    fresh = CR.load_cost_data(ledger_file, cache_dir)
+    assert set(fresh['备注'].dropna()) == {'备注', '12'}
+    cached = CR.load_cost_data(ledger_file, cache_dir)
+    pd.testing.assert_frame_equal(cached, fresh)
+    assert not list(cache_dir.glob('*.tmp'))
+
+def test_cost_cache_falls_back_to_pickle(tmp_path, ledger_file, monkeypatch):
+    def fail(self, path, *args, **kwargs):
+        raise TypeError('Conversion failed for column 备注')
+
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', fail)
+    cache_dir = tmp_path / 'cache'
+    fresh = CR.load_cost_data(ledger_file, cache_dir)
+    assert (cache_dir / 'cost_data.pkl').exists()
+    assert not list(cache_dir.glob('*.parquet*'))
+    pd.testing.assert_frame_equal(CR.load_cost_data(ledger_file, cache_dir), fresh)
+
+def test_generate_reports_finishes_other_months_on_failure(tmp_path, ledger_file, monkeypatch):
+    df = CR.load_cost_data(ledger_file, tmp_path / 'cache')
+    failing = CR.prepare_report(df, 2024, 2)['report_text']
+
+    class FakeAgent:
+        def __init__(self, model=None, cache=None):
+            pass
+
+        def get_response(self, prompt, system_prompt=''):
+            if prompt == failing:
+                raise RuntimeError('请求超时')
+            return '报告正文'
+
+    monkeypatch.setattr(CR.AT, 'AIUESAgent', FakeAgent)
+    periods = [(2024, 1), (2024, 2), (2024, 3), (2024, 4)]
+    results = CR.generate_reports(df, periods, 'fake', output_dir=tmp_path / 'out')
+    assert list(results) == periods
+    assert isinstance(results[(2024, 2)]['error'], RuntimeError)
+    assert results[(2024, 2)]['report'] == ''
+    for period in [(2024, 1), (2024, 3)]:
+        assert 'error' not in results[period]
+        assert '报告正文' in results[period]['html']
+    assert results[(2024, 4)]['statistics'] is None
+    assert sorted(path.name for path in (tmp_path / 'out').iterdir()) == ['2024年1月消费报告.html', '2024年3月消费报告.html']
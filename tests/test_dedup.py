@@ -0,0 +1,71 @@
+# test_dedup.py
+
+# 导入所需库
+import hashlib
+import zipfile
+
+import numpy as np
+from ebooklib import epub
+
+import dedup as DD
+import operating_ebook as OE
+from tests.conftest import random_text, write_book
+
+def exact_jaccard(a, b, shingle=5):
+    a, b = set(DD.shingle_hashes(a, shingle).tolist()), set(DD.shingle_hashes(b, shingle).tolist())
+    return len(a & b) / len(a | b)
+
+def test_signature_estimates_jaccard():
+    index = DD.DedupIndex(num_perm=256, bands=32)
+    base = random_text(1, 2000)
+    edited = base[:1500] + random_text(2, 500)
+    estimate = float(np.mean(index.signature(base) == index.signature(edited)))
+    assert abs(estimate - exact_jaccard(base, edited)) < 0.1
+    assert np.array_equal(index.signature(base), index.signature(base.replace('\n', ' ')))
+
+def test_clusters_near_duplicates_only():
+    index = DD.DedupIndex()
+    base = random_text(1, 1500)
+    index.add(0, base)
+    index.add(1, random_text(3, 1500))
+    index.add(2, base[:1400] + random_text(4, 100))
+    index.add(3, random_text(5, 1500))
+    assert index.clusters() == [[0, 2]]
+    assert index.duplicates() == {2: 0}
+    assert [key for key, _ in index.query(key=2)] == [0]
+    index.remove(0)
+    assert index.clusters() == []
+
+def test_index_book_is_incremental_and_does_not_cache(tmp_path, monkeypatch):
+    base = random_text(1, 1500)
+    path = write_book(tmp_path / 'book.epub', [base, random_text(2, 1500), base[:1450] + random_text(3, 50)])
+    store = OE.ChapterStore(path)
+    index = DD.index_book(ebook=store)
+    assert not store._contents
+    assert [0, 2] in index.clusters()
+
+    signature = index.signatures[1]
+    # 未变化的章节只对原始字节取哈希，不解析章节
+    parsed = []
+    get_content = epub.EpubHtml.get_content
+    monkeypatch.setattr(epub.EpubHtml, 'get_content', lambda item, *args: parsed.append(item) or get_content(item, *args))
+    DD.index_book(index, ebook=store)
+    assert index.signatures[1] is signature
+    assert parsed == []
+    with zipfile.ZipFile(path) as archive:
+        assert DD._raw_hash(store, 1) == hashlib.sha256(archive.read('EPUB/chapter_2.xhtml')).hexdigest()
+
+    store.set_content(1, '<p>' + base + '</p>')
+    DD.index_book(index, ebook=store)
+    assert [0, 1, 2] in index.clusters()
+
+def test_scene_level_index(tmp_path):
+    scene = random_text(1, 600)
+    path = write_book(tmp_path / 'book.epub', [scene + '\n***\n' + random_text(2, 600), random_text(3, 600) + '\n***\n' + scene])
+    store = OE.ChapterStore(path)
+    index = DD.index_book(ebook=store, level='scene')
+    assert all(isinstance(key, tuple) for key in index.signatures)
+    assert any(group[0][0] == 0 and group[-1][0] == 1 for group in index.clusters())
+    count = len(index)
+    DD.index_book(index, ebook=store, level='scene')
+    assert len(index) == count
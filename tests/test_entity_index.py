@@ -0,0 +1,100 @@
+# test_entity_index.py
+
+# 导入所需库
+import asyncio
+import json
+import random
+
+from ebooklib import epub
+
+import entity_index as EI
+import operating_ebook as OE
+from tests.conftest import write_book
+
+NAMES = {'林风': ['小林', '林师兄'], '苏晴': ['晴儿'], '林': []}
+PLACES = {'青云山': ['青云'], '落霞镇': []}
+
+class FakeAgent:
+    model = 'fake'
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    async def get_response(self, prompt, system_prompt='', max_tokens=2048):
+        self.prompts.append(prompt)
+        reply = self.replies.pop(0)
+        return reply if isinstance(reply, str) else json.dumps(reply, ensure_ascii=False)
+
+def brute_force(patterns, text):
+    return sorted((start, start + len(pattern), value) for pattern, value in patterns.items()
+                  for start in range(len(text)) if text.startswith(pattern, start))
+
+def test_automaton_matches_brute_force():
+    rng = random.Random(0)
+    alphabet = 'abcd'
+    patterns = {''.join(rng.choices(alphabet, k=rng.randint(1, 4))): i for i in range(30)}
+    automaton = EI.Automaton(patterns)
+    for _ in range(50):
+        text = ''.join(rng.choices(alphabet, k=60))
+        assert sorted(automaton.iter(text)) == brute_force(patterns, text)
+
+def test_find_prefers_leftmost_longest():
+    automaton = EI.Automaton({'林': '林', '林风': '林风', '风雨': '风雨'})
+    assert automaton.find('林风雨') == [(0, 2, '林风')]
+    assert automaton.find('林 风雨') == [(0, 1, '林'), (2, 4, '风雨')]
+
+def test_index_roles_places_and_scenes(tmp_path, monkeypatch):
+    path = write_book(tmp_path / 'book.epub', [
+        '小林来到青云山。\n晴儿在山门等他。\n***\n林师兄独自下山。',
+        '落霞镇的集市很热闹。\n苏晴买了一把剑。'])
+    store = OE.ChapterStore(path)
+    index = EI.index_book(EI.EntityIndex(NAMES, PLACES), ebook=store)
+    assert not store._contents
+    assert index.locations('林师兄') == [(0, 1), (0, 4)]
+    assert index.first_chapter('青云') == 0
+    assert index.first_chapter('落霞镇') == 1
+    assert index.scenes[0][0] == {'paragraphs': (0, 3), 'roles': ['林风', '苏晴'], 'places': ['青云山']}
+    assert index.scenes[0][1]['roles'] == ['林风'] and index.scenes[0][1]['places'] == []
+    assert index.scenes_with('晴儿') == [(0, 0), (1, 0)]
+    assert index.scenes_with('青云山') == [(0, 0)]
+    assert index.canonical('青云', 'role') is None
+
+    # 章节未变化时只比较原始字节的哈希，不重新解析章节
+    parsed = []
+    get_content = epub.EpubHtml.get_content
+    monkeypatch.setattr(epub.EpubHtml, 'get_content', lambda item, *args: parsed.append(item) or get_content(item, *args))
+    chapters = dict(index.chapters)
+    EI.index_book(index, ebook=store)
+    assert parsed == [] and index.chapters == chapters
+
+    index.save(tmp_path / 'index.pkl')
+    restored = EI.EntityIndex.load(tmp_path / 'index.pkl')
+    assert restored.locations('小林') == index.locations('小林')
+    assert not restored.set_names(NAMES)
+    assert restored.set_names(NAMES, {})
+    assert restored.chapters == {}
+
+def test_extractor_merges_profiles_and_tolerates_bad_replies(tmp_path):
+    path = write_book(tmp_path / 'book.epub', ['小林来到青云山。\n无关的段落。', '晴儿说话。', '林师兄。'])
+    store = OE.ChapterStore(path)
+    index = EI.index_book(EI.EntityIndex(NAMES, PLACES), ebook=store)
+    profiles = EI.ProfileStore(tmp_path / 'profiles.sqlite')
+    agent = FakeAgent([
+        {'roles': [{'name': '小林', 'gender': '男'}], 'places': [{'name': '青云', 'envir': '云海山门'}]},
+        {'roles': None},
+        ['not', 'a', 'dict'],
+    ])
+    extractor = EI.ProfileExtractor(index, profiles, agent, store)
+    results = asyncio.run(extractor.run_async(0, 3))
+    assert results[0] == {'林风': 1, '青云山': 1}
+    assert results[1] == {} and results[2] == {}
+    # 提示词只包含相关段落
+    assert '无关的段落' not in agent.prompts[0]
+    assert profiles.get('林风') == {'gender': '男'}
+    assert extractor.scene_style(0, 0) == {
+        'roles': [{'name': '林风', 'gender': '男'}],
+        'photo_style': {'envir': '云海山门', 'role_number': 1, 'LSandP': '', 'complete_style': ''}}
+    # 输入未变化时不再请求模型
+    asyncio.run(extractor.run_async(0, 3))
+    assert len(agent.prompts) == 3
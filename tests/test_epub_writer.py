@@ -0,0 +1,84 @@
+# test_epub_writer.py
+
+# 导入所需库
+import zipfile
+
+import ebooklib
+from ebooklib import epub
+
+import Env
+import epub_writer as EW
+import operating_ebook as OE
+from tests.conftest import random_text, write_book
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+def toc_titles(toc):
+    # 展开多级目录，依次返回 (标题, 级别)
+    for node in toc:
+        if isinstance(node, (tuple, list)):
+            section, children = node
+            yield section.title, 0
+            yield from ((title, level + 1) for title, level in toc_titles(children))
+        else:
+            yield node.title, 0
+
+def test_streaming_writer_output_opens_in_ebooklib(tmp_path):
+    image_path = tmp_path / 'cover.png'
+    image_path.write_bytes(PNG)
+    with EW.StreamingEpubWriter(tmp_path / 'out.epub', '测试', identifier='test-id') as writer:
+        writer.add_chapter('volume_1.xhtml', '<h1>第一卷</h1>', '第一卷', level=0)
+        writer.add_chapter('chapter_1.xhtml', '<h2>第一章</h2><p>正文一</p>', '第一章')
+        writer.add_chapter('chapter_2.xhtml', '<h2>第二章</h2><p>正文二</p>', '第二章')
+        writer.add_file('images/cover.png', image_path)
+        writer.add_file('images/inline.png', PNG)
+
+    with zipfile.ZipFile(tmp_path / 'out.epub') as archive:
+        assert archive.testzip() is None
+        first = archive.infolist()[0]
+        assert (first.filename, first.compress_type) == ('mimetype', zipfile.ZIP_STORED)
+
+    book = epub.read_epub(str(tmp_path / 'out.epub'))
+    assert book.get_metadata('DC', 'title')[0][0] == '测试'
+    documents = [item.file_name for item in book.get_items_of_type(ebooklib.ITEM_DOCUMENT)
+                 if not isinstance(item, epub.EpubNav)]
+    assert documents == ['volume_1.xhtml', 'chapter_1.xhtml', 'chapter_2.xhtml']
+    assert [book.get_item_with_id(item_id).file_name for item_id, _ in book.spine] == documents
+    assert list(toc_titles(book.toc)) == [('第一卷', 0), ('第一章', 1), ('第二章', 1)]
+    assert book.get_item_with_href('images/cover.png').get_content() == PNG
+    assert '正文二' in OE.html_to_text(book.get_item_with_href('chapter_2.xhtml').get_content())
+
+def test_write_book_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(Env, 'LT_VOLUME_IDX', [0, -1])
+    texts = [random_text(seed, 240) for seed in range(3)]
+    store = OE.ChapterStore(write_book(tmp_path / 'book.epub', texts))
+    image_path = tmp_path / 'scene.png'
+    image_path.write_bytes(PNG)
+    overrides = {1: '<h2>第2章</h2><p>润色后的内容</p><img src="images/scene.png"/>'}
+    output = EW.write_book(tmp_path / 'final.epub', store, overrides, {'images/scene.png': image_path})
+
+    reopened = OE.ChapterStore(output)
+    assert [item.file_name for item in reopened.items[:3]] == ['chapter_1.xhtml', 'chapter_2.xhtml', 'chapter_3.xhtml']
+    assert OE.html_to_text(reopened.get_content(1)) == '第2章\n润色后的内容'
+    for index in (0, 2):
+        assert OE.html_to_text(reopened.get_content(index)) == OE.html_to_text(store.get_content(index))
+    assert reopened.book.get_item_with_href('images/scene.png').get_content() == PNG
+    assert list(toc_titles(reopened.book.toc)) == [('第1章', 0), ('第2章', 1), ('第3章', 1)]
+
+def test_write_book_keeps_indices_with_nav_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(Env, 'LT_VOLUME_IDX', [1, -1])
+    texts = [random_text(seed, 240) for seed in range(3)]
+    store = OE.ChapterStore(write_book(tmp_path / 'book.epub', texts, nav_first=True))
+    names = [item.file_name for item in store.items]
+    assert names == ['nav.xhtml', 'chapter_1.xhtml', 'chapter_2.xhtml', 'chapter_3.xhtml']
+    store.set_content(3, '<html><body><h2>第3章</h2><p>未保存的修改</p></body></html>')
+    output = EW.write_book(tmp_path / 'final.epub', store, {1: '<h2>第1章</h2><p>润色后的内容</p>'})
+
+    reopened = OE.ChapterStore(output)
+    assert [item.file_name for item in reopened.items] == names
+    assert isinstance(reopened.items[0], epub.EpubNav)
+    assert OE.html_to_text(reopened.get_content(1)) == '第1章\n润色后的内容'
+    assert OE.html_to_text(reopened.get_content(2)) == OE.html_to_text(store.get_content(2))
+    assert OE.html_to_text(reopened.get_content(3)) == '第3章\n未保存的修改'
+    # 卷名在序号1，其后的章节为卷内章节
+    assert list(toc_titles(reopened.book.toc)) == [('第1章', 0), ('第2章', 1), ('第3章', 1)]
@@ -0,0 +1,47 @@
+# test_image_queue.py
+
+# 导入所需库
+import asyncio
+
+import pytest
+
+import image_queue as IQ
+
+class FlakyBackend(IQ.ImageBackend):
+    def __init__(self, failing):
+        self.failing = failing
+        self.prompts = []
+
+    async def generate(self, prompt):
+        self.prompts.append(prompt)
+        await asyncio.sleep(0.01)
+        if prompt in self.failing:
+            raise ValueError(f'无法生成: {prompt}')
+        return prompt.encode('utf-8')
+
+def test_backend_must_implement_generate():
+    with pytest.raises(TypeError):
+        IQ.ImageBackend()
+
+    class Incomplete(IQ.ImageBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_map_deduplicates_caches_and_collects_failures(tmp_path, capsys):
+    backend = FlakyBackend({'c'})
+    queue = IQ.ImageQueue(backend, IQ.ImageCache(tmp_path / 'images'), max_retries=0)
+    first = asyncio.run(queue.map(['A, b', 'b,a', 'c']))
+    assert first[0] == first[1] and first[0]['prompt'] == 'a, b'
+    assert first[2] is None
+    assert backend.prompts == ['a, b', 'c']
+    assert [failure['prompt'] for failure in queue.failures] == ['c']
+    assert isinstance(queue.failures[0]['error'], ValueError)
+    assert capsys.readouterr().out == ''
+
+    second = asyncio.run(queue.map(['b, a']))
+    assert second[0]['digest'] == first[0]['digest']
+    assert backend.prompts == ['a, b', 'c']
+    assert queue.stats == {'requested': 4, 'cached': 1, 'deduplicated': 1, 'generated': 1, 'retries': 0, 'failed': 1}
+    assert queue.cache.read(first[0]['digest']) == b'a, b'
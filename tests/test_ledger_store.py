@@ -0,0 +1,63 @@
+# test_ledger_store.py
+
+# 导入所需库
+import os
+
+import pandas as pd
+import pytest
+
+import cost_report as CR
+import ledger_store as LS
+from tests.conftest import ledger_rows, write_ledger
+
+def cleaned(path):
+    # 账本中的文本列按字符串保存，备注中的数字读回时为字符串
+    df = CR.proc_washing_data(path).reset_index(drop=True)
+    df['备注'] = df['备注'].map(lambda value: value if pd.isna(value) else str(value))
+    return df
+
+def test_import_matches_full_cleaning(tmp_path, ledger_file):
+    ledger = LS.LedgerStore(tmp_path / 'ledger.sqlite')
+    assert ledger.import_excel(ledger_file) == 70
+    expected = cleaned(ledger_file)
+    actual = ledger.to_frame()
+    assert list(actual.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+def test_incremental_import_reads_only_new_rows(tmp_path):
+    path = write_ledger(tmp_path / 'cost_data.xlsx', ledger_rows(40))
+    ledger = LS.LedgerStore(tmp_path / 'ledger.sqlite')
+    assert ledger.import_excel(path) == 40
+    # 文件未变化时不再读取
+    assert ledger.import_excel(path) == 0
+
+    write_ledger(path, ledger_rows(55))
+    assert ledger.import_excel(path) == 15
+    assert len(ledger) == 55
+    pd.testing.assert_frame_equal(ledger.to_frame(), cleaned(path),
+                                  check_dtype=False)
+
+def test_touched_file_is_skipped_by_hash(tmp_path, ledger_file, monkeypatch):
+    ledger = LS.LedgerStore(tmp_path / 'ledger.sqlite')
+    ledger.import_excel(ledger_file)
+    stat = ledger_file.stat()
+    os.utime(ledger_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    monkeypatch.setattr(LS.openpyxl, 'load_workbook', lambda *args, **kwargs: pytest.fail('不应读取文件'))
+    assert ledger.import_excel(ledger_file) == 0
+
+def test_shrunk_file_requires_rebuild(tmp_path):
+    path = write_ledger(tmp_path / 'cost_data.xlsx', ledger_rows(30))
+    ledger = LS.LedgerStore(tmp_path / 'ledger.sqlite')
+    ledger.import_excel(path)
+    write_ledger(path, ledger_rows(20))
+    with pytest.raises(ValueError):
+        ledger.import_excel(path)
+    assert ledger.rebuild(path) == 20
+
+def test_month_query(tmp_path, ledger_file):
+    ledger = LS.LedgerStore(tmp_path / 'ledger.sqlite')
+    ledger.import_excel(ledger_file)
+    assert ledger.months() == [(2024, 1), (2024, 2), (2024, 3)]
+    february = ledger.month(2024, 2)
+    assert len(february) == 29
+    assert (february[LS.DATE_COLUMN].dt.month == 2).all()
@@ -0,0 +1,93 @@
+# test_operating_ebook.py
+
+# 导入所需库
+import struct
+import zipfile
+
+import pytest
+from ebooklib import epub
+
+import operating_ebook as OE
+from tests.conftest import random_text, write_book
+
+def members(path):
+    # 各成员的压缩方式、校验值与压缩后的原始数据
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+        result = {}
+        for info in archive.infolist():
+            archive.fp.seek(info.header_offset)
+            header = archive.fp.read(zipfile.sizeFileHeader)
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            archive.fp.seek(name_length + extra_length, 1)
+            result[info.filename] = (info.compress_type, info.CRC, archive.fp.read(info.compress_size))
+        return result
+
+def test_save_round_trip_copies_unchanged_members(tmp_path):
+    path = write_book(tmp_path / 'book.epub', [random_text(seed) for seed in range(3)])
+    before = members(path)
+    store = OE.ChapterStore(path)
+    index = store.locate('chapter_2.xhtml')
+    store.set_content(index, '<html><body><h2>第2章</h2><p>新的内容</p></body></html>')
+    image = epub.EpubItem(uid='image_1', file_name='images/1.png', media_type='image/png', content=b'\x89PNG')
+    store.add_item(image)
+    assert store.save() == path
+    assert not list(tmp_path.glob('*.tmp'))
+
+    after = members(path)
+    changed = [name for name in before if before[name] != after[name]]
+    assert sorted(changed) == ['EPUB/chapter_2.xhtml', 'EPUB/content.opf']
+    assert after['mimetype'][0] == zipfile.ZIP_STORED
+    assert after['EPUB/images/1.png'][0] == zipfile.ZIP_DEFLATED
+
+    reopened = OE.ChapterStore(path)
+    assert OE.html_to_text(reopened.get_content(index)) == '第2章\n新的内容'
+    for number in (1, 3):
+        chapter = reopened.locate(f'chapter_{number}.xhtml')
+        assert OE.html_to_text(reopened.get_content(chapter)).splitlines()[1:] == random_text(number - 1).splitlines()
+    assert reopened.book.get_item_with_href('images/1.png').get_content() == b'\x89PNG'
+
+def test_failed_save_keeps_original(tmp_path, monkeypatch):
+    path = write_book(tmp_path / 'book.epub', [random_text(0)])
+    original = path.read_bytes()
+    store = OE.ChapterStore(path)
+    store.set_content(store.locate('chapter_1.xhtml'), '<html><body><p>新的内容</p></body></html>')
+
+    def fail(self, tmp_path):
+        raise OSError('磁盘已满')
+
+    monkeypatch.setattr(OE.ChapterStore, '_copy_with_changes', fail)
+    with pytest.raises(OSError):
+        store.save()
+    assert path.read_bytes() == original
+    assert not list(tmp_path.glob('*.tmp'))
+
+def test_default_store_shares_cache_with_returned_book(tmp_path, monkeypatch):
+    path = write_book(tmp_path / 'book.epub', [random_text(seed) for seed in range(2)])
+    monkeypatch.setattr(OE.Env, 'DATA_PATH', path)
+    monkeypatch.setattr(OE, '_default_store', None)
+    book = OE.update_chapter_content(1, '<p>ONE</p>')
+    assert OE.get_store(book) is OE.get_store()
+    assert OE.html_to_text(OE.get_chapter_data(1, ebook=book)['content']) == 'ONE'
+    OE.update_chapter_content(1, '<p>TWO</p>')
+    assert OE.html_to_text(OE.get_chapter_data(1, ebook=book)['content']) == 'TWO'
+    assert OE.get_store(book).dirty == {1}
+
+def test_iter_chapters_extracts_text_by_volume_without_caching(tmp_path, monkeypatch):
+    texts = ['第一段<b>加粗</b>的文字\n<span>行内</span>与&amp;符号<br/>换行之后\n<script>var hidden = 1;</script>可见',
+             random_text(1, 120), random_text(2, 120), random_text(3, 120)]
+    store = OE.ChapterStore(write_book(tmp_path / 'book.epub', texts, nav_first=True))
+    monkeypatch.setattr(OE.Env, 'LT_VOLUME_IDX', [1, 3, -1])
+
+    first, second = OE.iter_chapters(fields=('index', 'content'), as_text=True, volume=0, ebook=store)
+    assert first == {'index': 1, 'content': '第1章\n第一段加粗的文字\n行内与&符号\n换行之后\n可见'}
+    assert second['content'] == '第2章\n' + random_text(1, 120)
+    assert [chapter['index'] for chapter in OE.iter_chapters(fields=('index',), volume=1, ebook=store)] == [3, 4]
+    assert [chapter['file_name'] for chapter in OE.iter_chapters(3, fields=('file_name',), ebook=store)] == [
+        'chapter_3.xhtml', 'chapter_4.xhtml']
+    # 遍历时不缓存章节内容，与按需解码、缓存后的转换结果一致
+    assert not store._contents
+    html = next(OE.iter_chapters(1, 2, fields=('content',), ebook=store))['content']
+    assert OE.html_to_text(html) == first['content']
+    assert not store._contents
+    assert OE.html_to_text(store.get_content(1)) == first['content']
@@ -0,0 +1,90 @@
+# test_report_server.py
+
+# 导入所需库
+import asyncio
+
+import report_server as RS
+
+class FakeAgent:
+    def __init__(self):
+        self.calls = 0
+
+    def get_response(self, prompt, system_prompt=''):
+        self.calls += 1
+        return '<p>测试报告</p>'
+
+async def request(port, raw):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(raw)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, body
+
+def serve(service, scenario):
+    async def main():
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        async with server:
+            return await scenario(server.sockets[0].getsockname()[1])
+    return asyncio.run(main())
+
+def make_service(tmp_path, ledger_file):
+    service = RS.ReportService(data_path=ledger_file, model='test-model', cache_dir=tmp_path / 'reports')
+    service.agent = FakeAgent()
+    return service
+
+def test_etag_and_not_modified(tmp_path, ledger_file):
+    service = make_service(tmp_path, ledger_file)
+
+    async def scenario(port):
+        status, headers, body = await request(port, b'GET /report/2024/1 HTTP/1.1\r\nHost: x\r\n\r\n')
+        assert status == 200 and '测试报告' in body.decode('utf-8')
+        etag = headers['ETag']
+        status, headers, body = await request(
+            port, f'GET /report/2024/1 HTTP/1.1\r\nIf-None-Match: {etag}\r\n\r\n'.encode('latin-1'))
+        assert status == 304 and body == b'' and headers['ETag'] == etag
+        status, headers, body = await request(port, b'HEAD /charts/2024/1 HTTP/1.1\r\n\r\n')
+        assert status == 200 and body == b'' and headers['ETag'] != etag
+        status, _, _ = await request(port, b'GET /report/2030/1 HTTP/1.1\r\n\r\n')
+        assert status == 404
+
+    serve(service, scenario)
+    # 同一个月的报告只请求一次模型
+    assert service.agent.calls == 1
+
+def test_disk_cache_survives_restart(tmp_path, ledger_file):
+    first = make_service(tmp_path, ledger_file)
+    second = make_service(tmp_path, ledger_file)
+
+    async def scenario(port):
+        return await request(port, b'GET /report/2024/2 HTTP/1.1\r\n\r\n')
+
+    etag = serve(first, scenario)[1]['ETag']
+    assert serve(second, scenario)[1]['ETag'] == etag
+    assert second.agent.calls == 0
+
+def test_blank_and_bad_requests(tmp_path, ledger_file):
+    service = make_service(tmp_path, ledger_file)
+
+    async def scenario(port):
+        assert (await request(port, b'\r\n\r\n'))[0] == 400
+        assert (await request(port, b'POST /report/2024/1 HTTP/1.1\r\n\r\n'))[0] == 405
+        assert (await request(port, b'GET /report/2024/13 HTTP/1.1\r\n\r\n'))[0] == 400
+        # 只建立连接就关闭的探测不应产生未处理的异常
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.close()
+        await asyncio.sleep(0.05)
+
+    errors = []
+
+    async def run():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        async with server:
+            await scenario(server.sockets[0].getsockname()[1])
+
+    asyncio.run(run())
+    assert not errors
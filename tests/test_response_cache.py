@@ -0,0 +1,60 @@
+# test_response_cache.py
+
+# 导入所需库
+import asyncio
+
+import pytest
+
+import AIUESAGENT as AT
+import response_cache as RC
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(RC.time, 'time', lambda: now[0])
+    return now
+
+def test_ttl_expires_entries(tmp_path, clock):
+    cache = RC.ResponseCache(tmp_path / 'cache.sqlite', ttl=60)
+    cache.set('a', '回复')
+    clock[0] += 60
+    assert cache.get('a') == '回复'
+    clock[0] += 1
+    assert cache.get('a') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 0, 'bytes': 0}
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    cache = RC.ResponseCache(tmp_path / 'cache.sqlite', max_bytes=10)
+    cache.set('a', 'aaaa')
+    clock[0] += 1
+    cache.set('b', 'bbbb')
+    clock[0] += 1
+    assert cache.get('a') == 'aaaa'
+    clock[0] += 1
+    cache.set('c', 'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'aaaa' and cache.get('c') == 'cccc'
+    assert cache.stats()['bytes'] == 8
+    # 超过上限的回复不写入
+    cache.set('d', 'd' * 11)
+    assert cache.get('d') is None
+    cache.close()
+
+    reopened = RC.ResponseCache(tmp_path / 'cache.sqlite', max_bytes=10)
+    assert reopened.stats()['bytes'] == 8
+    assert reopened.get('c') == 'cccc'
+
+def test_async_agent_reads_cache_off_the_event_loop(tmp_path, monkeypatch):
+    cache = RC.ResponseCache(tmp_path / 'cache.sqlite')
+    agent = AT.AsyncAIUESAgent(api_key='test', base_url='http://127.0.0.1:9', cache=cache, model='fake')
+    cache.set(cache.make_key(model='fake', system_prompt='', prompt='你好', temperature=0.7, max_tokens=2048), '缓存')
+    calls = []
+    to_thread = asyncio.to_thread
+
+    async def record(func, *args, **kwargs):
+        calls.append(func)
+        return await to_thread(func, *args, **kwargs)
+
+    monkeypatch.setattr(AT.asyncio, 'to_thread', record)
+    assert asyncio.run(agent.get_response('你好')) == '缓存'
+    assert calls == [cache.get]
@@ -0,0 +1,57 @@
+# test_rewrite_pipeline.py
+
+# 导入所需库
+import asyncio
+import json
+
+import operating_ebook as OE
+import rewrite_pipeline as RP
+import tokens as TK
+from tests.conftest import write_book
+
+class FakeAgent:
+    model = 'fake'
+
+    def __init__(self):
+        self.image_requests = []
+
+    async def map(self, prompts, system_prompt='', max_tokens=2048):
+        if system_prompt != RP.IMAGE_PROMPT:
+            return list(prompts)
+        self.image_requests.extend(prompts)
+        replies = []
+        for prompt in prompts:
+            name = '林风' if '林风' in prompt else '苏晴'
+            replies.append(json.dumps({'roles': [{'name': name, 'clothing': prompt[:2]}, {'name': '林风', 'gender': '男'}],
+                                       'scenes': [{'envir': prompt[:4]}]}, ensure_ascii=False))
+        return replies
+
+def test_image_prompts_are_packed_within_budget_and_merged(tmp_path, capsys):
+    text = '\n'.join(['林风站在山门前，望着远处的云海。' * 3] * 4 + ['***'] + ['苏晴在集市上挑选了一把长剑。' * 3] * 4)
+    store = OE.ChapterStore(write_book(tmp_path / 'book.epub', [text]))
+    progress = []
+    pipeline = RP.RewritePipeline(agent=FakeAgent(), journal=RP.Journal(tmp_path / 'journal.sqlite'), ebook=store,
+                                  skip_volume_titles=False, progress=lambda *args: progress.append(args))
+    pipeline.image_budget = 120
+    results = asyncio.run(pipeline.run_async(0, 1, write_back=False))
+
+    requests = pipeline.agent.image_requests
+    assert len(requests) > 1
+    assert all(TK.estimate_tokens(request) <= pipeline.image_budget for request in requests)
+    assert '\n'.join(requests) == results[0]['rewritten']
+    image_prompts = results[0]['image_prompts']
+    assert [role['name'] for role in image_prompts['roles']] == ['林风', '苏晴']
+    assert image_prompts['roles'][0]['gender'] == '男'
+    assert len(image_prompts['scenes']) == len(requests)
+    assert [(done, total, result['index']) for done, total, result, _ in progress] == [(1, 1, 0)]
+    assert capsys.readouterr().out == ''
+
+    # 输入未变化时直接读取日志
+    pipeline.agent.image_requests.clear()
+    assert asyncio.run(pipeline.run_async(0, 1, write_back=False))[0]['cached']
+    assert pipeline.agent.image_requests == []
+
+def test_merge_image_prompts_keeps_single_reply_and_raw_text():
+    assert RP.merge_image_prompts(['不是JSON']) == {'raw': '不是JSON'}
+    merged = RP.merge_image_prompts(['{"roles": [{"name": "林风"}], "scenes": []}', '不是JSON'])
+    assert merged == {'roles': [{'name': '林风'}], 'scenes': [], 'raw': '不是JSON'}
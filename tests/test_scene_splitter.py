@@ -0,0 +1,61 @@
+# test_scene_splitter.py
+
+# 导入所需库
+import random
+
+import pytest
+
+import scene_splitter as SS
+import tokens as TK
+from tests.conftest import random_text
+
+def mixed_text(seed):
+    # 中英文混排的段落，夹有场景分隔行与不带句末标点的超长段落
+    rng = random.Random(seed)
+    lines = []
+    for paragraph in range(12):
+        if paragraph % 5 == 4:
+            lines.append(rng.choice(['***', '———', '※※※']))
+        elif paragraph % 4 == 3:
+            lines.append(''.join(rng.choice('abcdefg xyz') for _ in range(rng.randint(40, 200))))
+        else:
+            sentences = random_text(seed * 100 + paragraph, rng.randint(10, 160), 20).splitlines()
+            lines.append('。'.join(sentences) + '！')
+    return '\n'.join(lines)
+
+def test_split_scenes_drops_break_lines_and_blank_scenes():
+    text = '***\n甲\n\n乙\n———\n※※※\n丙\n***'
+    assert SS.split_scenes(text) == [['甲', '乙'], ['丙']]
+    assert SS.scene_ranges(text) == [(1, 4), (6, 7)]
+
+@pytest.mark.parametrize('budget', [2, 3, 7, 40, 500])
+@pytest.mark.parametrize('respect_scenes', [False, True])
+def test_pack_segments_never_exceeds_budget(budget, respect_scenes):
+    for seed in range(5):
+        text = mixed_text(seed)
+        segments = SS.pack_segments(text, budget, respect_scenes)
+        for segment in segments:
+            assert TK.estimate_tokens(segment['text']) <= segment['tokens'] <= budget
+        # 片段按顺序拼接后与各场景的文字一致，没有丢失或重复
+        expected = ''.join(''.join(scene) for scene in SS.split_scenes(text))
+        assert ''.join(segment['text'].replace('\n', '') for segment in segments) == expected
+        if not respect_scenes:
+            # 贪心装箱：相邻片段无法合并为一个请求
+            for first, second in zip(segments, segments[1:]):
+                assert first['tokens'] + second['tokens'] > budget
+
+def test_pack_segments_breaks_at_scenes_when_they_fit():
+    scenes = ['\n'.join(random_text(seed, 90, 30).splitlines()) for seed in range(4)]
+    text = '\n***\n'.join(scenes)
+    segments = SS.pack_segments(text, 200, respect_scenes=True)
+    assert [segment['scenes'] for segment in segments] == [[0, 1], [2, 3]]
+    assert len(SS.pack_segments(text, 200)) == 2
+
+def test_pack_segments_rejects_budget_too_small_for_any_text():
+    with pytest.raises(ValueError):
+        SS.pack_segments('甲', 1)
+
+def test_prompt_budget_leaves_room_for_reply():
+    assert SS.prompt_budget('提示词', 1024, context_window=4096, reserve=100) == 4096 - 1024 - 3 - 100
+    with pytest.raises(ValueError):
+        SS.prompt_budget('', 4096, context_window=4096)
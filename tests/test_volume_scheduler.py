@@ -0,0 +1,83 @@
+# test_volume_scheduler.py
+
+# 导入所需库
+import asyncio
+import re
+
+import pytest
+from ebooklib import epub
+
+import Env
+import operating_ebook as OE
+import rewrite_pipeline as RP
+import volume_scheduler as VS
+from tests.conftest import random_text, write_book
+
+class FakeAgent:
+    model = 'fake'
+
+    def __init__(self):
+        self.prompts = []
+        self._started = set()
+        self._both = asyncio.Event()
+
+    async def map(self, prompts, system_prompt='', max_tokens=2048):
+        if system_prompt != RP.REWRITE_PROMPT:
+            return ['{}' for _ in prompts]
+        replies = []
+        for prompt in prompts:
+            text = prompt.split('\n\n')[-1]
+            number = int(re.search(r'第(\d+)章', text).group(1))
+            self.prompts.append((number, prompt))
+            # 两卷都发出请求之前不返回：卷之间不并行时会超时
+            self._started.add(OE.get_volume_of(number))
+            if len(self._started) == 2:
+                self._both.set()
+            await asyncio.wait_for(self._both.wait(), 5)
+            replies.append(f'润色{text}')
+        return replies
+
+@pytest.mark.parametrize('from_file', [False, True])
+def test_volumes_run_in_parallel_with_ordered_context(tmp_path, monkeypatch, from_file):
+    # 目录页在序号0，两卷的卷名章节分别在0与3
+    monkeypatch.setattr(Env, 'LT_VOLUME_IDX', [0, 3, -1])
+    path = write_book(tmp_path / 'book.epub', [random_text(seed, 60, 30) for seed in range(6)], nav_first=True)
+    ebook = OE.ChapterStore(path) if from_file else epub.read_epub(str(path))
+    pipeline = RP.RewritePipeline(agent=FakeAgent(), journal=RP.Journal(tmp_path / 'journal.sqlite'), ebook=ebook)
+    scheduler = VS.VolumeScheduler(pipeline, processes=2, context_chars=10)
+    results = asyncio.run(scheduler.run_async(write_back=False))
+
+    assert [result['index'] for result in results] == [1, 2, 4, 5, 6]
+    rewritten = {result['index']: result['rewritten'] for result in results}
+    prompts = pipeline.agent.prompts
+    for volume in (0, 1):
+        chapters = [(number, prompt) for number, prompt in prompts if OE.get_volume_of(number) == volume]
+        # 卷内按章节顺序处理，上一章润色结果的结尾作为下一章的上下文
+        assert [number for number, _ in chapters] == sorted(number for number, _ in chapters)
+        assert '\n\n' not in chapters[0][1]
+        for (previous, _), (_, prompt) in zip(chapters, chapters[1:]):
+            assert prompt.startswith(f'上一章结尾：{rewritten[previous][-10:]}\n\n')
+
+class FakeStats:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def total(self, chapter_indices=None):
+        return sum(self.tokens[i] for i in chapter_indices)
+
+def test_heavier_volumes_start_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(Env, 'LT_VOLUME_IDX', [0, 3, -1])
+    path = write_book(tmp_path / 'book.epub', [random_text(seed, 60, 30) for seed in range(6)], nav_first=True)
+    pipeline = RP.RewritePipeline(agent=FakeAgent(), journal=RP.Journal(tmp_path / 'journal.sqlite'),
+                                  ebook=epub.read_epub(str(path)))
+    started = []
+
+    async def run_volume(volume, prepared):
+        started.append(volume)
+        await prepared
+        return []
+
+    scheduler = VS.VolumeScheduler(pipeline, stats=FakeStats({1: 1, 2: 1, 4: 10, 5: 1, 6: 1}))
+    monkeypatch.setattr(scheduler, '_run_volume', run_volume)
+    asyncio.run(scheduler.run_async(write_back=False))
+    assert started == [1, 0]
@@ -0,0 +1,21 @@
+# tokens.py
+
+# 导入所需库
+import math
+import re
+
+# 参数设置
+context_window=32*1024 # 模型上下文长度（token）
+# 中日韩文字及全角标点，大致一个字符对应一个token
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+def estimate_tokens(text):
+    '''
+    在本地粗略估算文本的token数
+    :param text: 文本
+    :return: 估算的token数，中文按每字一个token，其余按每4个字符一个token
+    '''
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
@@ -0,0 +1,155 @@
+# volume_scheduler.py
+
+# 导入所需库
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import AIUESAGENT as AT
+import Env
+import operating_ebook as OE
+import scene_splitter as SS
+from rewrite_pipeline import RewritePipeline
+
+# 每个进程各自打开的电子书，同一进程处理多个卷时只解析一次
+_process_stores = {}
+
+def prepare_chapters(ebook_path, chapter_indices, budget):
+    """
+    提取章节纯文本并划分片段，在进程池中运行
+
+    Args:
+        ebook_path (str): 电子书路径
+        chapter_indices (list): 章节序号列表
+        budget (int): 每个片段的token上限
+
+    Returns:
+        list: 每个章节一个字典，包含 'index'、'text'、'segments'
+    """
+    store = _process_stores.get(ebook_path)
+    if store is None:
+        store = OE.ChapterStore(ebook_path)
+        _process_stores[ebook_path] = store
+    return _prepare(store, chapter_indices, budget)
+
+def _prepare(store, chapter_indices, budget):
+    prepared = []
+    for chapter_index in chapter_indices:
+        text = store.chapter_info(chapter_index, fields=('content',), as_text=True, cache=False)['content']
+        prepared.append({'index': chapter_index, 'text': text, 'segments': SS.pack_segments(text, budget)})
+    return prepared
+
+# 按卷并行的调度器
+class VolumeScheduler:
+    """
+    按 Env.LT_VOLUME_IDX 将全书划分为卷，各卷并行处理
+
+    文本清洗与场景划分在进程池中进行，模型请求共用流水线中的异步智能体（其并发数即全局并发上限）；
+    同一卷内的章节按顺序处理，上一章润色结果的结尾作为下一章的上下文。
+    流水线带有前情记忆时，各卷的前几卷梗概在启动前固定，不依赖其他卷的处理进度
+
+    Args:
+        pipeline (RewritePipeline): 重构流水线，负责日志、模型请求与写回
+        processes (int): 进程池大小，默认为CPU核数与卷数中的较小值
+        context_chars (int): 传给下一章的上文字数，为0时不传递上下文；流水线带有前情记忆时不使用
+        stats (ChapterStatsIndex): 可选的章节统计索引，给出时按估算token数从多到少启动各卷
+    """
+    def __init__(self, pipeline=None, processes=None, context_chars=300, stats=None):
+        self.pipeline = pipeline if pipeline is not None else RewritePipeline()
+        self.processes = processes
+        self.context_chars = context_chars
+        self.stats = stats
+
+    def volumes(self):
+        """
+        获取全部卷序号
+
+        Returns:
+            list: 卷序号列表
+        """
+        return list(range(len(Env.LT_VOLUME_IDX) - 1))
+
+    async def _run_volume(self, volume, prepared):
+        pipeline = self.pipeline
+        results = []
+        context = ''
+        for chapter in await prepared:
+            result = await pipeline.process_chapter(chapter['index'], context=context,
+                                                    text=chapter['text'], segments=chapter['segments'])
+            results.append(result)
+            # 流水线带有前情记忆时由记忆提供上下文
+            if self.context_chars and result['rewritten'] and pipeline.memory is None:
+                context = f"上一章结尾：{result['rewritten'][-self.context_chars:]}"
+            state = '跳过（已完成）' if result['cached'] else '完成'
+            if result.get('duplicate_of') is not None:
+                state = f"跳过（与第{result['duplicate_of']}章近似重复）"
+            print(f"[第{volume}卷] 第{chapter['index']}章 {state}")
+        return results
+
+    async def run_async(self, volumes=None, write_back=True):
+        """
+        并行处理指定的卷，全部完成后一次性写回电子书
+
+        Args:
+            volumes (list): 卷序号列表，默认为全部卷
+            write_back (bool): 是否写回电子书
+
+        Returns:
+            list: 按章节顺序排列的处理结果
+        """
+        pipeline = self.pipeline
+        volumes = self.volumes() if volumes is None else list(volumes)
+        shards = {volume: pipeline.chapter_indices(volume=volume) for volume in volumes}
+        shards = {volume: indices for volume, indices in shards.items() if indices}
+        if not shards:
+            return []
+        if self.stats is not None:
+            # 工作量大的卷先启动，进程池中各进程的负载更均衡
+            tokens = {volume: self.stats.total(chapter_indices=indices) for volume, indices in shards.items()}
+            shards = dict(sorted(shards.items(), key=lambda item: -tokens[item[0]]))
+            print(f"共 {len(shards)} 卷，估算 {sum(tokens.values())} token")
+
+        loop = asyncio.get_running_loop()
+        begin = time.perf_counter()
+        if pipeline.memory is not None:
+            await pipeline.memory.snapshot(shards)
+        try:
+            ebook_path = pipeline.store.path
+            if ebook_path is not None:
+                processes = self.processes or min(os.cpu_count() or 1, len(shards))
+                with ProcessPoolExecutor(max_workers=processes) as pool:
+                    prepared = {volume: loop.run_in_executor(pool, prepare_chapters, str(ebook_path), indices, pipeline.budget)
+                                for volume, indices in shards.items()}
+                    volume_results = await asyncio.gather(*(self._run_volume(volume, prepared[volume]) for volume in shards))
+            else:
+                # 电子书只在内存中时无法交给子进程，改在线程中准备
+                prepared = {volume: loop.run_in_executor(None, _prepare, pipeline.store, indices, pipeline.budget)
+                            for volume, indices in shards.items()}
+                volume_results = await asyncio.gather(*(self._run_volume(volume, prepared[volume]) for volume in shards))
+        finally:
+            if pipeline.memory is not None:
+                pipeline.memory.release()
+
+        results = sorted((result for group in volume_results for result in group), key=lambda r: r['index'])
+        elapsed = time.perf_counter() - begin
+        print(f"共处理 {len(shards)} 卷 {len(results)} 章，用时 {elapsed:.1f}s")
+        if write_back and results:
+            path = pipeline.write_back(results)
+            print(f"已写回电子书: {path}")
+        return results
+
+    def run(self, volumes=None, write_back=True):
+        """
+        run_async 的同步入口，参数相同
+        """
+        return AT.run(self.run_async(volumes, write_back))
+
+# 示例使用
+if __name__ == "__main__":
+    # 全书按卷并行处理，模型请求最多同时进行 16 个
+    # import AIUESAGENT as AT
+    # scheduler = VolumeScheduler(RewritePipeline(agent=AT.AsyncAIUESAgent(concurrency=16)))
+    # scheduler.run()
+
+    pass